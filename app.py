@@ -1,389 +1,589 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
-from database import query_db # Import our database query function
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, make_response, get_flashed_messages, jsonify, stream_template, stream_with_context, session, g, abort
+from database import query_db, stream_query, current_wal_lsn, read_after # Import our database helpers
+from database_async import query_db_async
+from reference_data import (
+    get_parties, get_states, get_state, get_lgas, get_lga_wards, reference_etag, reference_last_modified,
+    DEFAULT_STATE_ID
+)
+from rollups import LGA_TOTALS_SQL
+import instrumentation
+import fragment_cache
+import compression
+import ratelimit
+from response_cache import ResponseCache, RESPONSE_CACHE_MAX_AGE
+from ingest import ingest
+from live_results import broadcaster, event_stream, stream_slots, LIVE_BUSY_RETRY_SECONDS
+from reconcile import get_reconciliation, summarize
+from history import get_totals_at, get_series
+from results_engine import engine as results_engine, DIMENSIONS
+from submissions import enqueue_submission, get_submission, start_worker_threads, IdempotencyConflict
+import asyncio
+import base64
+import hmac
+import io
+import json
+import os
 import datetime
+import re
+import time
+import uuid
+from werkzeug.exceptions import RequestEntityTooLarge
 
 app = Flask(__name__)
 # A secret key is needed for flashing messages
 app.config['SECRET_KEY'] = 'your_very_secret_key_for_the_test' # CHANGE THIS IN PRODUCTION AND USE A STRONGER KEY
+# Send ETag/Last-Modified on form pages built only from cached reference data
+app.config['REFERENCE_ETAGS'] = os.environ.get('REFERENCE_ETAGS', '1') == '1'
+# Server-Timing headers, per-route query/row counts and the /metrics endpoint
+instrumentation.init_app(app)
+# Reference data sets each {% cache %} fragment is rendered from, by fragment name
+FRAGMENT_DATASETS = {
+    'lga-options': lambda state_id: [('lgas', state_id)],
+    'party-score-inputs': lambda: ['parties'],
+}
+
+
+def fragment_version(name, *args):
+    return reference_etag(*FRAGMENT_DATASETS[name](*args))
+
+
+# {% cache %} fragments are reused until the reference data they show changes
+fragment_cache.init_app(app, version=fragment_version)
+# gzip/brotli response bodies
+compression.init_app(app)
+# Token buckets and admission control on the aggregation, search and write endpoints
+ratelimit.init_app(app, {
+    ('q2_page', 'GET'): ratelimit.Rule(per_ip='60/60'),
+    ('q2_page', 'POST'): ratelimit.Rule(per_ip='30/60', per_route='1200/60'),
+    ('q3_page', 'POST'): ratelimit.Rule(per_ip='20/60', per_route='600/60'),
+    ('api_polling_units', 'GET'): ratelimit.Rule(per_ip='120/60'),
+    ('reconciliation_page', 'GET'): ratelimit.Rule(per_ip='10/60', per_route='120/60'),
+    ('api_reconciliation', 'GET'): ratelimit.Rule(per_ip='10/60', per_route='120/60'),
+    ('api_ingest', 'POST'): ratelimit.Rule(per_ip='5/60', per_route='30/60'),
+    ('api_results_aggregate', 'GET'): ratelimit.Rule(per_ip='120/60', admission=False),
+    ('api_history_totals', 'GET'): ratelimit.Rule(per_ip='60/60'),
+    ('api_history_series', 'GET'): ratelimit.Rule(per_ip='60/60'),
+    # Live streams hold a thread for as long as they are open, so only their opening rate is limited
+    ('api_live_lga_totals', 'GET'): ratelimit.Rule(per_ip='20/60', admission=False),
+})
+# Request bodies larger than this are refused with 413 (forms are tiny; /api/ingest has its own limit)
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', str(1 << 20)))
+# After storing results, a browser's replica reads wait for its write for this many seconds
+app.config['READ_YOUR_WRITES_SECONDS'] = float(os.environ.get('READ_YOUR_WRITES_SECONDS', '300'))
+
+
+@app.before_request
+def apply_read_your_writes():
+    """Routes this request's replica reads only to replicas that have replayed the browser's last write."""
+    pending = session.get('read_after')
+    if pending and pending[1] <= time.time():
+        session.pop('read_after')
+        pending = None
+    read_after(pending[0] if pending else None) # Always set: threads serve many requests
+
+
+@app.before_request
+def ensure_submission_workers():
+    """Starts this worker process's submission queue threads on its first request."""
+    start_worker_threads()
+
+
+def remember_write():
+    """Records the primary's WAL position after a write, for apply_read_your_writes()."""
+    lsn = current_wal_lsn()
+    if lsn is not None:
+        session['read_after'] = [lsn, time.time() + app.config['READ_YOUR_WRITES_SECONDS']]
+
+
+# --- State Scope ---
+# Every page is served per state: /states/<state_id>/q2 and so on, with the
+# DEFAULT_STATE_ID state also at the unprefixed URLs (/q2). The state is
+# checked against the states table and exposed to views and templates as
+# g.state; url_for() keeps links within the current state.
+def state_route(rule, **options):
+    """Registers a view under rule for the default state and under /states/<state_id>rule for any state."""
+    def decorator(view):
+        app.route(rule, defaults={'state_id': DEFAULT_STATE_ID}, **options)(view)
+        app.route(f'/states/<int:state_id>{rule}', **options)(view)
+        return view
+    return decorator
+
+
+@app.url_value_preprocessor
+def pull_state(endpoint, values):
+    """Moves the state_id URL value into g.state, answering 404 for unknown states."""
+    if values and 'state_id' in values:
+        g.state = get_state(values.pop('state_id'))
+        if g.state is None:
+            abort(404)
+
+
+@app.url_defaults
+def add_state(endpoint, values):
+    """Fills in the current state when building the URL of another state-scoped view."""
+    if 'state_id' not in values and 'state' in g and app.url_map.is_endpoint_expecting(endpoint, 'state_id'):
+        values['state_id'] = g.state['state_id']
+
+
+@app.context_processor
+def inject_state():
+    return {'state': g.get('state')}
+
+
+def render_reference_page(template, datasets, **context):
+    """
+    Renders a form page whose content comes from the reference data cache.
+
+    datasets lists the reference data sets (see reference_etag()) the page is built from.
 
-@app.route('/')
+    Plain GETs without pending flash messages get ETag and Last-Modified
+    validators, so browsers can revalidate and receive a 304 instead of the
+    full page while the parties, LGAs and wards are unchanged.
+    """
+    response = make_response(render_template(template, **context))
+    if app.config['REFERENCE_ETAGS'] and request.method == 'GET' and not get_flashed_messages():
+        response.set_etag(reference_etag('states', *datasets)) # Pages show the state's name too
+        response.last_modified = reference_last_modified('states', *datasets)
+        response.cache_control.no_cache = True # Always revalidate, never serve stale forms
+        response = response.make_conditional(request)
+    return response
+
+@state_route('/')
 def index():
-    """Renders the home page with links to all questions."""
-    return render_template('index.html')
+    """Renders the home page with links to all questions and to the other states."""
+    return render_template('index.html', states=get_states())
 
-@app.route('/q1', methods=['GET', 'POST'])
-def q1_page():
+@state_route('/q1', methods=['GET', 'POST'])
+async def q1_page():
     """
     Handles both displaying the form (GET) and processing results (POST) for Question 1.
     Displays individual polling unit results.
+    The polling unit details and its results are fetched concurrently.
+    A GET with ?polling_unit_uniqueid= shows the results too (used by the full polling unit list).
     """
-    # Only fetch polling units that actually have announced results for the dropdown
-    polling_units = query_db(
-        """
-        SELECT DISTINCT pu.uniqueid, pu.polling_unit_name, l.lga_name, w.ward_name
-        FROM polling_unit pu
-        JOIN lga l ON pu.lga_id = l.lga_id
-        JOIN ward w ON pu.ward_id = w.ward_id
-        JOIN announced_pu_results apr ON pu.uniqueid = apr.polling_unit_uniqueid -- Join with results table
-        WHERE l.state_id = 25 -- Assuming Delta State ID is 25
-        ORDER BY l.lga_name, w.ward_name, pu.polling_unit_name;
-        """,
-        fetchall=True
-    )
-
+    # The polling unit picker is filled page by page from /api/polling-units
     results = []
     polling_unit_info = {}
     
-    if request.method == 'POST':
-        selected_uniqueid = request.form.get('polling_unit_uniqueid')
-
-        if selected_uniqueid:
-            # Fetch polling unit details
-            pu_info = query_db(
-                """
-                SELECT pu.polling_unit_name, l.lga_name, w.ward_name
-                FROM polling_unit pu
-                JOIN lga l ON pu.lga_id = l.lga_id
-                JOIN ward w ON pu.ward_id = w.ward_id
-                WHERE pu.uniqueid = %s;
-                """,
-                (selected_uniqueid,),
-                fetchone=True
+    if request.method == 'POST' or 'polling_unit_uniqueid' in request.args:
+        selected_uniqueid = request.values.get('polling_unit_uniqueid', type=int)
+
+        if selected_uniqueid is not None:
+            # Fetch polling unit details and its results at the same time
+            pu_info, results = await asyncio.gather(
+                query_db_async(
+                    """
+                    SELECT pu.polling_unit_name, l.lga_name, w.ward_name
+                    FROM polling_unit pu
+                    JOIN lga l ON pu.lga_id = l.lga_id
+                    -- Ward ids repeat across LGAs, so pick the ward of this polling unit's LGA
+                    LEFT JOIN LATERAL (
+                        SELECT ward_name FROM ward
+                        WHERE ward.ward_id = pu.ward_id AND ward.lga_id = pu.lga_id
+                        ORDER BY ward.uniqueid
+                        LIMIT 1
+                    ) w ON TRUE
+                    WHERE pu.uniqueid = %s AND l.state_id = %s;
+                    """,
+                    (selected_uniqueid, g.state['state_id']),
+                    fetchone=True,
+                    replica=True
+                ),
+                query_db_async(
+                    """
+                    SELECT party_abbreviation, party_score
+                    FROM announced_pu_results
+                    WHERE polling_unit_uniqueid = %s
+                    ORDER BY party_abbreviation;
+                    """,
+                    (selected_uniqueid,),
+                    fetchall=True,
+                    replica=True
+                )
             )
-            if pu_info: # pu_info is a dict due to DictCursor
+            if pu_info: # pu_info is a dict (dict_row factory)
                 polling_unit_info = {
                     'name': pu_info['polling_unit_name'],
                     'lga': pu_info['lga_name'],
                     'ward': pu_info['ward_name']
                 }
-
-            # Fetch results for the selected polling unit
-            results = query_db(
-                """
-                SELECT party_abbreviation, party_score
-                FROM announced_pu_results
-                WHERE polling_unit_uniqueid = %s
-                ORDER BY party_abbreviation;
-                """,
-                (selected_uniqueid,),
-                fetchall=True
-            )
+            else:
+                results = [] # Polling units of other states are not shown under this state
             if not results:
                 flash("No results found for this specific polling unit in the database.", "info")
         else:
             flash("Please select a Polling Unit.", "error")
 
-    return render_template('q1.html', polling_units=polling_units, results=results, polling_unit_info=polling_unit_info)
+    return render_template('q1.html', results=results, polling_unit_info=polling_unit_info)
 
 
-@app.route('/q2', methods=['GET', 'POST'])
-def q2_page():
+@state_route('/q1/polling-units')
+def q1_all_polling_units():
     """
-    Renders the page for Question 2: Summed results for all polling units under a particular LGA.
-    Handles both GET (display form) and POST (submit form) requests.
+    Lists every polling unit that has results, for browsers without JavaScript.
+
+    Rows come from a server-side cursor and the template is streamed while it
+    renders, so worker memory and time to first byte stay flat however many
+    polling units there are.
     """
-    # Always fetch LGAs for the dropdown, whether GET or POST
-    lgas = query_db(
+    polling_units = stream_query(
         """
-        SELECT lga_id, lga_name
-        FROM lga
-        WHERE state_id = 25 -- Assuming Delta State ID is 25
-        ORDER BY lga_name;
+        SELECT pu.uniqueid, pu.polling_unit_name, l.lga_name, w.ward_name
+        FROM polling_unit pu
+        JOIN lga l ON pu.lga_id = l.lga_id
+        LEFT JOIN LATERAL (
+            SELECT ward_name FROM ward
+            WHERE ward.ward_id = pu.ward_id AND ward.lga_id = pu.lga_id
+            ORDER BY ward.uniqueid
+            LIMIT 1
+        ) w ON TRUE
+        WHERE l.state_id = %s
+          AND EXISTS (SELECT 1 FROM announced_pu_results apr WHERE apr.polling_unit_uniqueid = pu.uniqueid)
+        ORDER BY l.lga_name, w.ward_name, pu.polling_unit_name;
         """,
-        fetchall=True
+        (g.state['state_id'],),
+        replica=True
     )
-    
-    results = []
-    selected_lga_name = ""
+    return stream_template('polling_units.html', polling_units=polling_units)
 
-    if request.method == 'POST':
-        selected_lga_id = request.form.get('lga_id')
 
-        if selected_lga_id:
-            # Get LGA name
-            lga_row = query_db("SELECT lga_name FROM lga WHERE lga_id = %s;", (selected_lga_id,), fetchone=True)
-            if lga_row: # lga_row is a dict due to DictCursor
-                selected_lga_name = lga_row['lga_name']
-            else:
-                selected_lga_name = "N/A (LGA not found)"
-                flash("Selected LGA not found in database.", "error")
-
-            # Get summed results for all polling units under the selected LGA
-            results = query_db(
-                """
-                SELECT apr.party_abbreviation, SUM(apr.party_score) as total_score
-                FROM announced_pu_results apr
-                JOIN polling_unit pu ON apr.polling_unit_uniqueid = pu.uniqueid
-                JOIN ward w ON pu.ward_id = w.ward_id
-                JOIN lga l ON w.lga_id = l.lga_id
-                WHERE l.lga_id = %s
-                GROUP BY apr.party_abbreviation
-                ORDER BY total_score DESC;
-                """,
-                (selected_lga_id,),
-                fetchall=True
-            )
-            if not results:
-                flash(f"No results found for {selected_lga_name} LGA.", "info")
-        else:
-            flash("Please select an LGA.", "error")
+POLLING_UNIT_PAGE_SIZE = 25
+POLLING_UNIT_MAX_PAGE_SIZE = 100
 
-    return render_template('q2.html', lgas=lgas, results=results, selected_lga_name=selected_lga_name)
 
+def encode_cursor(sort_name, uniqueid):
+    """Encodes the last row of a page as an opaque keyset-pagination cursor."""
+    raw = json.dumps([sort_name, uniqueid]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
 
-@app.route('/q3', methods=['GET', 'POST'])
-def q3_page():
-    """
-    Renders the page for Question 3: Store results for ALL parties for a new polling unit.
-    Handles both GET (display form) and POST (submit form) requests.
-    """
-    # Fetch parties for dynamic form generation
-    parties = query_db("SELECT partyid, partyname FROM party ORDER BY partyname;", fetchall=True)
 
-    # Fetch LGAs and Wards to help user select a location for the new polling unit
-    lgas = query_db("SELECT lga_id, lga_name FROM lga WHERE state_id = 25 ORDER BY lga_name;", fetchall=True)
-    wards = query_db("SELECT ward_id, ward_name, lga_id FROM ward ORDER BY ward_name;", fetchall=True)
+def decode_cursor(cursor):
+    """Decodes a cursor from encode_cursor(); returns None if it is malformed."""
+    try:
+        sort_name, uniqueid = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return str(sort_name), int(uniqueid)
+    except (ValueError, TypeError):
+        return None
 
-    if request.method == 'POST':
-        polling_unit_name = request.form.get('polling_unit_name')
-        
-        # --- FIX FOR "invalid input syntax for type integer" ERROR ---
-        # Convert ward_id and lga_id to integers as the DB expects integers
-        ward_id = request.form.get('ward_id', type=int) 
-        lga_id = request.form.get('lga_id', type=int)
-        # --- END FIX ---
 
-        entered_by = request.form.get('entered_by_user')
+@state_route('/api/polling-units')
+def api_polling_units():
+    """
+    Searches the state's polling units that have announced results, one page at a time.
 
-        # Updated validation to check for None after type conversion
-        if not polling_unit_name or ward_id is None or lga_id is None or not entered_by:
-            flash("All fields (Polling Unit Name, LGA, Ward, Your Name) are required and must be valid selections.", "error")
-            # Re-fetch data for rendering the form again after an error
-            parties = query_db("SELECT partyid, partyname FROM party ORDER BY partyname;", fetchall=True)
-            lgas = query_db("SELECT lga_id, lga_name FROM lga WHERE state_id = 25 ORDER BY lga_name;", fetchall=True)
-            wards = query_db("SELECT ward_id, ward_name, lga_id FROM ward ORDER BY ward_name;", fetchall=True)
-            return render_template('q3.html', parties=parties, lgas=lgas, wards=wards)
+    Query parameters:
+        q: Matched against polling unit, ward and LGA names. Terms shorter than
+           three characters are prefix matches, longer ones substring matches
+           (both served by the pg_trgm indexes from migration 2).
+        cursor: The next_cursor of the previous page.
+        limit: Page size (default 25, at most 100).
 
-        try:
-            max_uniqueid_row = query_db("SELECT MAX(uniqueid) as max_id FROM polling_unit;", fetchone=True)
-            max_uniqueid = max_uniqueid_row['max_id'] if max_uniqueid_row and max_uniqueid_row['max_id'] is not None else 0
-            new_uniqueid = max_uniqueid + 1
-
-            # FIX: Added 'polling_unit_description' with a default empty string to satisfy NOT NULL constraint
-            inserted_polling_unit_uniqueid = query_db(
-                """
-                INSERT INTO polling_unit (
-                    uniqueid, polling_unit_id, ward_id, lga_id, uniquewardid,
-                    polling_unit_name, polling_unit_description,
-                    entered_by_user, date_entered, user_ip_address
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP, %s)
-                RETURNING uniqueid;
-                """,
-                (
-                    new_uniqueid,
-                    new_uniqueid, # Using same as uniqueid for polling_unit_id as a placeholder
-                    ward_id,      # Now correctly an integer
-                    lga_id,       # Now correctly an integer
-                    f"{lga_id}-{ward_id}-{new_uniqueid}", # This string is fine for a text column
-                    polling_unit_name,
-                    "", # Providing an empty string for the NOT NULL 'polling_unit_description'
-                    entered_by,
-                    request.remote_addr
-                ),
-                commit=True,
-                fetchone=True
-            )
-            inserted_polling_unit_uniqueid = inserted_polling_unit_uniqueid['uniqueid']
+    Pages are ordered by polling unit name and id and paginated by keyset, so
+    every page costs the same no matter how deep into the list it is.
+    """
+    term = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', POLLING_UNIT_PAGE_SIZE, type=int), 1), POLLING_UNIT_MAX_PAGE_SIZE)
+    after = ('', 0)
+    if request.args.get('cursor'):
+        after = decode_cursor(request.args['cursor'])
+        if after is None:
+            return jsonify(error="Invalid cursor."), 400
+
+    params = {'state_id': g.state['state_id'], 'after_name': after[0], 'after_id': after[1], 'limit': limit + 1}
+    if term:
+        escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        params['pattern'] = f"{escaped}%" if len(term) < 3 else f"%{escaped}%"
+        # Each branch can use its own trigram index; UNION removes duplicates
+        search_filter = """
+          AND pu.uniqueid IN (
+            SELECT uniqueid FROM polling_unit WHERE polling_unit_name ILIKE %(pattern)s
+            UNION
+            SELECT pu.uniqueid FROM polling_unit pu
+            JOIN ward w ON w.lga_id = pu.lga_id AND w.ward_id = pu.ward_id
+            WHERE w.ward_name ILIKE %(pattern)s
+            UNION
+            SELECT pu.uniqueid FROM polling_unit pu
+            JOIN lga l ON l.lga_id = pu.lga_id
+            WHERE l.lga_name ILIKE %(pattern)s
+          )
+        """
+    else:
+        search_filter = ""
 
+    rows = query_db(
+        f"""
+        SELECT pu.uniqueid, pu.polling_unit_name, l.lga_name, w.ward_name,
+               COALESCE(pu.polling_unit_name, '') AS sort_name
+        FROM polling_unit pu
+        JOIN lga l ON pu.lga_id = l.lga_id
+        -- Ward ids repeat across LGAs, so pick the ward of this polling unit's LGA
+        LEFT JOIN LATERAL (
+            SELECT ward_name FROM ward
+            WHERE ward.ward_id = pu.ward_id AND ward.lga_id = pu.lga_id
+            ORDER BY ward.uniqueid
+            LIMIT 1
+        ) w ON TRUE
+        WHERE l.state_id = %(state_id)s {search_filter}
+          AND EXISTS (SELECT 1 FROM announced_pu_results apr WHERE apr.polling_unit_uniqueid = pu.uniqueid)
+          AND (COALESCE(pu.polling_unit_name, ''), pu.uniqueid) > (%(after_name)s, %(after_id)s)
+        ORDER BY COALESCE(pu.polling_unit_name, ''), pu.uniqueid
+        LIMIT %(limit)s;
+        """,
+        params,
+        fetchall=True,
+        replica=True
+    )
 
-            # Insert party scores for the new polling unit
-            for party in parties:
-                partyid = party['partyid']
-                partyname = party['partyname']
-                score_key = f'party_score_{partyid}' # Form field name for each party score
-                party_score = request.form.get(score_key, type=int)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['sort_name'], rows[-1]['uniqueid'])
+    items = [
+        {
+            'uniqueid': row['uniqueid'],
+            'polling_unit_name': row['polling_unit_name'],
+            'lga_name': row['lga_name'],
+            'ward_name': row['ward_name'],
+        }
+        for row in rows
+    ]
+    return jsonify(items=items, next_cursor=next_cursor)
 
-                # Only insert if a score was provided and it's a valid integer
-                if party_score is not None: 
-                    query_db(
-                        """
-                        INSERT INTO announced_pu_results (
-                            polling_unit_uniqueid, party_abbreviation, party_score,
-                            entered_by_user, date_entered, user_ip_address
-                        ) VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP, %s);
-                        """,
-                        (
-                            inserted_polling_unit_uniqueid,
-                            partyname,
-                            party_score,
-                            entered_by,
-                            request.remote_addr
-                        ),
-                        commit=True
-                    )
-            
-            flash(f"New polling unit '{polling_unit_name}' (ID: {inserted_polling_unit_uniqueid}) and its results saved successfully!", "success")
-            return redirect(url_for('q3_page'))
 
-        except Exception as e:
-            flash(f"An error occurred while saving: {e}", "error")
-            print(f"Error during Q3 submission: {e}") # Log the error to console
-            # Re-fetch parties, lgas, wards to re-render the form with existing data
-            parties = query_db("SELECT partyid, partyname FROM party ORDER BY partyname;", fetchall=True)
-            lgas = query_db("SELECT lga_id, lga_name FROM lga WHERE state_id = 25 ORDER BY lga_name;", fetchall=True)
-            wards = query_db("SELECT ward_id, ward_name, lga_id FROM ward ORDER BY ward_name;", fetchall=True)
-            return render_template('q3.html', parties=parties, lgas=lgas, wards=wards)
+# Rendered /q2 result pages, keyed by state, LGA, the LGA's totals version and the reference data version
+q2_cache = ResponseCache()
 
-    # For GET requests or if an error occurred during POST and we re-render
-    return render_template('q3.html', parties=parties, lgas=lgas, wards=wards)
 
+@state_route('/q2', methods=['GET', 'POST'])
+async def q2_page():
+    """
+    Renders the page for Question 2: Summed results for all polling units under a particular LGA.
+    The results of an LGA live at GET /q2?lga_id=; a POSTed form is redirected there.
 
-if __name__ == '__main__':
-    app.run(debug=True) # Set debug=False for productionfrom flask import Flask, render_template, request, redirect, url_for, flash
-from database import query_db # Import our database query function
-import datetime
+    Result pages come from q2_cache while the LGA's totals are unchanged, and
+    carry an ETag and a short public max-age so browsers and proxies can reuse them too.
+    """
+    if request.method == 'POST':
+        selected_lga_id = request.form.get('lga_id', type=int)
+        if selected_lga_id is None:
+            flash("Please select an LGA.", "error")
+            return redirect(url_for('q2_page'))
+        return redirect(url_for('q2_page', lga_id=selected_lga_id), code=303)
+
+    # Always fetch the state's LGAs for the dropdown (served from the reference cache)
+    lgas = get_lgas(g.state['state_id'])
+    selected_lga_id = request.args.get('lga_id', type=int)
+    if selected_lga_id is None:
+        return render_reference_page('q2.html', [('lgas', g.state['state_id'])], lgas=lgas, results=[], selected_lga_name="")
+
+    # Only the LGAs of the state being served can be selected
+    lga_row = next((lga for lga in lgas if lga['lga_id'] == selected_lga_id), None)
+    if lga_row is None:
+        flash(f"Selected LGA not found in {g.state['state_name']}.", "error")
+        return render_template('q2.html', lgas=lgas, results=[], selected_lga_name="N/A (LGA not found)"), 404
+
+    async def render_results():
+        # Summed results for all polling units under the selected LGA (precomputed by rollups.py).
+        # Read from the primary: a lagging replica could store old totals under the new version.
+        results = await query_db_async(LGA_TOTALS_SQL, (selected_lga_id,), fetchall=True)
+        # Rendered into the page rather than flashed, so it is cached along with the results
+        notices = [] if results else [("info", f"No results found for {lga_row['lga_name']} LGA.")]
+        return render_template('q2.html', lgas=lgas, results=results, notices=notices,
+                               selected_lga_name=lga_row['lga_name']).encode('utf-8')
+
+    version = broadcaster.lga_version(selected_lga_id)
+    if version is None or get_flashed_messages(): # Changes cannot be tracked right now, or the page is one-off
+        body, outcome = await render_results(), 'bypass'
+    else:
+        key = (g.state['state_id'], selected_lga_id, version, reference_etag('states', ('lgas', g.state['state_id'])))
+        body, outcome = await q2_cache.get_or_compute_async(key, render_results)
+
+    response = make_response(body)
+    response.headers['X-Cache'] = outcome
+    if outcome != 'bypass':
+        response.add_etag() # From the body, so every worker agrees on it
+        response.cache_control.public = True
+        response.cache_control.max_age = RESPONSE_CACHE_MAX_AGE
+        response = response.make_conditional(request)
+    return response
+
+
+@state_route('/q2/live')
+def q2_live_page():
+    """Renders the live dashboard: LGA totals that update as results are stored, without re-submitting."""
+    return render_reference_page('q2_live.html', [('lgas', g.state['state_id'])], lgas=get_lgas(g.state['state_id']))
+
+
+@state_route('/api/live/lga-totals')
+def api_live_lga_totals():
+    """
+    Streams the party totals of the state's LGAs as Server-Sent Events.
 
-app = Flask(__name__)
-# A secret key is needed for flashing messages
-app.config['SECRET_KEY'] = 'your_very_secret_key_for_the_test' # CHANGE THIS IN PRODUCTION AND USE A STRONGER KEY
+    The first event is a snapshot, followed by a delta event for every committed
+    change. All viewers in a worker share one LISTEN connection and one copy of
+    the totals (see live_results.py); each open stream occupies a worker thread,
+    so beyond LIVE_MAX_STREAMS streams per worker viewers get 503 with Retry-After.
+    """
+    if not stream_slots.acquire(blocking=False):
+        response = jsonify(error="Too many live viewers, please retry later.")
+        response.status_code = 503
+        response.headers['Retry-After'] = str(LIVE_BUSY_RETRY_SECONDS)
+        return response
+    try:
+        lga_ids = [lga['lga_id'] for lga in get_lgas(g.state['state_id'])]
+        response = Response(stream_with_context(event_stream(lga_ids)), mimetype='text/event-stream')
+    except BaseException:
+        stream_slots.release()
+        raise
+    response.call_on_close(stream_slots.release) # Runs however the stream ends, even if it never started
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # Stop nginx from buffering the stream
+    return response
+
+
+@state_route('/reconciliation')
+def reconciliation_page():
+    """
+    Compares the summed polling unit results of each LGA with its announced LGA results.
+    Optional ?lga_id= narrows the report to one LGA and ?mismatches=1 hides matching rows.
+    """
+    lgas = get_lgas(g.state['state_id'])
+    selected_lga_id = request.args.get('lga_id', type=int)
+    mismatches_only = request.args.get('mismatches') == '1'
+    rows = get_reconciliation(state_id=g.state['state_id'], lga_id=selected_lga_id, mismatches_only=mismatches_only)
+    return render_template('reconciliation.html', lgas=lgas, rows=rows, summary=summarize(rows),
+                           selected_lga_id=selected_lga_id, mismatches_only=mismatches_only)
 
-@app.route('/')
-def index():
-    """Renders the home page with links to all questions."""
-    return render_template('index.html')
 
-@app.route('/q1', methods=['GET', 'POST'])
-def q1_page():
+@app.route('/api/reconciliation')
+def api_reconciliation():
     """
-    Handles both displaying the form (GET) and processing results (POST) for Question 1.
-    Displays individual polling unit results.
+    Returns the reconciliation report as JSON.
+
+    Query parameters: state_id (all states when omitted), lga_id, and mismatches=1.
     """
-    # Only fetch polling units that actually have announced results for the dropdown
-    polling_units = query_db(
-        """
-        SELECT DISTINCT pu.uniqueid, pu.polling_unit_name, l.lga_name, w.ward_name
-        FROM polling_unit pu
-        JOIN lga l ON pu.lga_id = l.lga_id
-        JOIN ward w ON pu.ward_id = w.ward_id
-        JOIN announced_pu_results apr ON pu.uniqueid = apr.polling_unit_uniqueid -- Join with results table
-        WHERE l.state_id = 25 -- Assuming Delta State ID is 25
-        ORDER BY l.lga_name, w.ward_name, pu.polling_unit_name;
-        """,
-        fetchall=True
+    rows = get_reconciliation(
+        state_id=request.args.get('state_id', type=int),
+        lga_id=request.args.get('lga_id', type=int),
+        mismatches_only=request.args.get('mismatches') == '1',
     )
+    return jsonify(summary=summarize(rows), rows=rows)
 
-    results = []
-    polling_unit_info = {}
-    
-    if request.method == 'POST':
-        selected_uniqueid = request.form.get('polling_unit_uniqueid')
-
-        if selected_uniqueid:
-            # Fetch polling unit details
-            pu_info = query_db(
-                """
-                SELECT pu.polling_unit_name, l.lga_name, w.ward_name
-                FROM polling_unit pu
-                JOIN lga l ON pu.lga_id = l.lga_id
-                JOIN ward w ON pu.ward_id = w.ward_id
-                WHERE pu.uniqueid = %s;
-                """,
-                (selected_uniqueid,),
-                fetchone=True
-            )
-            if pu_info: # pu_info is a dict due to DictCursor
-                polling_unit_info = {
-                    'name': pu_info['polling_unit_name'],
-                    'lga': pu_info['lga_name'],
-                    'ward': pu_info['ward_name']
-                }
-
-            # Fetch results for the selected polling unit
-            results = query_db(
-                """
-                SELECT party_abbreviation, party_score
-                FROM announced_pu_results
-                WHERE polling_unit_uniqueid = %s
-                ORDER BY party_abbreviation;
-                """,
-                (selected_uniqueid,),
-                fetchall=True
-            )
-            if not results:
-                flash("No results found for this specific polling unit in the database.", "info")
-        else:
-            flash("Please select a Polling Unit.", "error")
-
-    return render_template('q1.html', polling_units=polling_units, results=results, polling_unit_info=polling_unit_info)
 
+@app.route('/api/results/aggregate')
+def api_results_aggregate():
+    """
+    Aggregates party scores in memory (see results_engine.py), without querying Postgres per request.
 
-@app.route('/q2', methods=['GET', 'POST'])
-def q2_page():
+    Query parameters: group_by (comma-separated: state, lga, ward, polling_unit, party),
+    the filters state_id, lga_id, ward_id, polling_unit_id and party (each repeatable),
+    top (N per parent group) and limit (default 1000, at most 10000).
     """
-    Renders the page for Question 2: Summed results for all polling units under a particular LGA.
-    Handles both GET (display form) and POST (submit form) requests.
+    group_by = [d for d in request.args.get('group_by', '').split(',') if d]
+    unknown = [d for d in group_by if d not in DIMENSIONS]
+    if unknown or len(set(group_by)) != len(group_by):
+        return jsonify(error=f"group_by takes distinct values among: {', '.join(DIMENSIONS)}"), 400
+    filters = {}
+    for dimension in DIMENSIONS:
+        name = 'party' if dimension == 'party' else f'{dimension}_id'
+        values = request.args.getlist(name, type=str if dimension == 'party' else int)
+        if len(values) != len(request.args.getlist(name)):
+            return jsonify(error=f"{name} must be an integer"), 400
+        if values:
+            filters[dimension] = values
+    top = request.args.get('top', type=int)
+    if top is not None and top < 1:
+        return jsonify(error="top must be at least 1"), 400
+    limit = min(max(request.args.get('limit', 1000, type=int), 1), 10000)
+
+    result = results_engine.aggregate(group_by, filters, top=top, limit=limit)
+    result['truncated'] = result['total_rows'] > len(result['rows'])
+    return jsonify(result)
+
+
+def parse_moment(value):
+    """Parses an ISO 8601 query parameter; returns None if it is missing, raises ValueError if it is malformed."""
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value.replace(' ', 'T', 1))
+
+
+@state_route('/api/history/totals')
+def api_history_totals():
     """
-    # Always fetch LGAs for the dropdown, whether GET or POST
-    lgas = query_db(
-        """
-        SELECT lga_id, lga_name
-        FROM lga
-        WHERE state_id = 25 -- Assuming Delta State ID is 25
-        ORDER BY lga_name;
-        """,
-        fetchall=True
-    )
-    
-    results = []
-    selected_lga_name = ""
-
-    if request.method == 'POST':
-        selected_lga_id = request.form.get('lga_id')
+    Returns the party totals of the state's LGAs as they were at a moment (see history.py).
 
-        if selected_lga_id:
-            # Get LGA name
-            lga_row = query_db("SELECT lga_name FROM lga WHERE lga_id = %s;", (selected_lga_id,), fetchone=True)
-            if lga_row: # lga_row is a dict due to DictCursor
-                selected_lga_name = lga_row['lga_name']
-            else:
-                selected_lga_name = "N/A (LGA not found)"
-                flash("Selected LGA not found in database.", "error")
-
-            # Get summed results for all polling units under the selected LGA
-            results = query_db(
-                """
-                SELECT apr.party_abbreviation, SUM(apr.party_score) as total_score
-                FROM announced_pu_results apr
-                JOIN polling_unit pu ON apr.polling_unit_uniqueid = pu.uniqueid
-                JOIN ward w ON pu.ward_id = w.ward_id
-                JOIN lga l ON w.lga_id = l.lga_id
-                WHERE l.lga_id = %s
-                GROUP BY apr.party_abbreviation
-                ORDER BY total_score DESC;
-                """,
-                (selected_lga_id,),
-                fetchall=True
-            )
-            if not results:
-                flash(f"No results found for {selected_lga_name} LGA.", "info")
-        else:
-            flash("Please select an LGA.", "error")
+    Query parameters: at (ISO 8601, default now; without an offset it is read in
+    the database's time zone) and lga_id (repeatable, default every LGA of the state).
+    Totals come from the last snapshot taken at or before that moment.
+    """
+    lgas = {lga['lga_id']: lga['lga_name'] for lga in get_lgas(g.state['state_id'])}
+    lga_ids = request.args.getlist('lga_id', type=int) or list(lgas)
+    if any(lga_id not in lgas for lga_id in lga_ids):
+        return jsonify(error=f"lga_id must be an LGA of {g.state['state_name']}."), 400
+    try:
+        at = parse_moment(request.args.get('at')) or datetime.datetime.now(datetime.timezone.utc)
+    except ValueError:
+        return jsonify(error="at must be an ISO 8601 timestamp."), 400
+
+    snapshot, totals = get_totals_at(lga_ids, at)
+    if snapshot:
+        snapshot = dict(snapshot, taken_at=snapshot['taken_at'].isoformat())
+    return jsonify(
+        at=at.isoformat(),
+        snapshot=snapshot,
+        lgas=[{'lga_id': lga_id, 'lga_name': lgas[lga_id], 'totals': totals[lga_id]} for lga_id in lga_ids],
+    )
 
-    return render_template('q2.html', lgas=lgas, results=results, selected_lga_name=selected_lga_name)
 
+@state_route('/api/history/series')
+def api_history_series():
+    """
+    Returns how the party totals of one LGA progressed over time (see history.py).
 
-@app.route('/q3', methods=['GET', 'POST'])
+    Query parameters: lga_id (required), from and to (ISO 8601; by default from
+    the first snapshot until now). Each point is a snapshot in which a total changed.
+    """
+    lgas = {lga['lga_id']: lga['lga_name'] for lga in get_lgas(g.state['state_id'])}
+    lga_id = request.args.get('lga_id', type=int)
+    if lga_id not in lgas:
+        return jsonify(error=f"lga_id must be an LGA of {g.state['state_name']}."), 400
+    try:
+        start, end = parse_moment(request.args.get('from')), parse_moment(request.args.get('to'))
+    except ValueError:
+        return jsonify(error="from and to must be ISO 8601 timestamps."), 400
+
+    points, truncated = get_series(lga_id, start, end)
+    points = [dict(point, at=point['at'].isoformat()) for point in points] # ISO 8601, not Flask's RFC 822 dates
+    return jsonify(lga_id=lga_id, lga_name=lgas[lga_id], points=points, truncated=truncated)
+
+
+@app.route('/api/lgas/<int:lga_id>/wards')
+def api_lga_wards(lga_id):
+    """Returns the wards of one LGA as JSON, served from the per-LGA reference cache."""
+    response = jsonify(wards=get_lga_wards(lga_id))
+    if app.config['REFERENCE_ETAGS']:
+        response.set_etag(reference_etag(('wards', lga_id)))
+        response.cache_control.no_cache = True
+        response = response.make_conditional(request)
+    return response
+
+
+@state_route('/q3', methods=['GET', 'POST'])
 def q3_page():
     """
     Renders the page for Question 3: Store results for ALL parties for a new polling unit.
     Handles both GET (display form) and POST (submit form) requests.
+    A valid POST is queued under its idempotency key (see submissions.py) and
+    answered at once with a redirect to its status page; replaying the same key
+    never stores the results twice. Requests that prefer JSON (the browser's
+    offline outbox) get the queue status or the validation error as JSON instead.
     """
-    # Fetch parties for dynamic form generation
-    parties = query_db("SELECT partyid, partyname FROM party ORDER BY partyname;", fetchall=True)
+    # Fetch parties for dynamic form generation (served from the reference cache)
+    parties = get_parties()
 
-    # Fetch LGAs and Wards to help user select a location for the new polling unit
-    lgas = query_db("SELECT lga_id, lga_name FROM lga WHERE state_id = 25 ORDER BY lga_name;", fetchall=True)
-    wards = query_db("SELECT ward_id, ward_name, lga_id FROM ward ORDER BY ward_name;", fetchall=True)
+    # Fetch the state's LGAs to help user select a location; the wards of the chosen LGA come from /api/lgas/<lga_id>/wards
+    lgas = get_lgas(g.state['state_id'])
 
     if request.method == 'POST':
         polling_unit_name = request.form.get('polling_unit_name')
@@ -397,86 +597,159 @@ def q3_page():
         entered_by = request.form.get('entered_by_user')
 
         # Updated validation to check for None after type conversion
-        if not polling_unit_name or ward_id is None or lga_id is None or not entered_by:
-            flash("All fields (Polling Unit Name, LGA, Ward, Your Name) are required and must be valid selections.", "error")
-            # Re-fetch data for rendering the form again after an error
-            parties = query_db("SELECT partyid, partyname FROM party ORDER BY partyname;", fetchall=True)
-            lgas = query_db("SELECT lga_id, lga_name FROM lga WHERE state_id = 25 ORDER BY lga_name;", fetchall=True)
-            wards = query_db("SELECT ward_id, ward_name, lga_id FROM ward ORDER BY ward_name;", fetchall=True)
-            return render_template('q3.html', parties=parties, lgas=lgas, wards=wards)
+        # The ward must belong to the selected LGA, and the LGA to the state being served
+        valid_lga_ids = {lga['lga_id'] for lga in lgas}
+        valid_ward_ids = {ward['ward_id'] for ward in get_lga_wards(lga_id)} if lga_id in valid_lga_ids else set()
+        if not polling_unit_name or ward_id not in valid_ward_ids or not entered_by:
+            message = "All fields (Polling Unit Name, LGA, Ward, Your Name) are required and must be valid selections."
+            if wants_json():
+                return jsonify(error=message), 400
+            flash(message, "error")
+            return render_template('q3.html', parties=parties, lgas=lgas)
+
+        # The form carries a key generated in the browser; API clients may send an Idempotency-Key header
+        idempotency_key = request.form.get('idempotency_key') or request.headers.get('Idempotency-Key') or ''
+        if not IDEMPOTENCY_KEY_PATTERN.fullmatch(idempotency_key):
+            idempotency_key = str(uuid.uuid4()) # No usable key (e.g. JavaScript disabled): this POST cannot be deduplicated
 
         try:
-            max_uniqueid_row = query_db("SELECT MAX(uniqueid) as max_id FROM polling_unit;", fetchone=True)
-            max_uniqueid = max_uniqueid_row['max_id'] if max_uniqueid_row and max_uniqueid_row['max_id'] is not None else 0
-            new_uniqueid = max_uniqueid + 1
-
-            # FIX: Added 'polling_unit_description' with a default empty string to satisfy NOT NULL constraint
-            inserted_polling_unit_uniqueid = query_db(
-                """
-                INSERT INTO polling_unit (
-                    uniqueid, polling_unit_id, ward_id, lga_id, uniquewardid,
-                    polling_unit_name, polling_unit_description,
-                    entered_by_user, date_entered, user_ip_address
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP, %s)
-                RETURNING uniqueid;
-                """,
-                (
-                    new_uniqueid,
-                    new_uniqueid, # Using same as uniqueid for polling_unit_id as a placeholder
-                    ward_id,      # Now correctly an integer
-                    lga_id,       # Now correctly an integer
-                    f"{lga_id}-{ward_id}-{new_uniqueid}", # This string is fine for a text column
-                    polling_unit_name,
-                    "", # Providing an empty string for the NOT NULL 'polling_unit_description'
-                    entered_by,
-                    request.remote_addr
-                ),
-                commit=True,
-                fetchone=True
-            )
-            inserted_polling_unit_uniqueid = inserted_polling_unit_uniqueid['uniqueid']
-
-
-            # Insert party scores for the new polling unit
+            # Collect the score for each party; only parties with a valid integer score are stored
+            scores = []
             for party in parties:
-                partyid = party['partyid']
-                partyname = party['partyname']
-                score_key = f'party_score_{partyid}' # Form field name for each party score
+                score_key = f'party_score_{party["partyid"]}' # Form field name for each party score
                 party_score = request.form.get(score_key, type=int)
+                if party_score is not None:
+                    scores.append((party['partyname'], party_score))
+
+            # Queued durably; a submission worker writes the polling unit and its results shortly
+            submission, created = enqueue_submission(
+                idempotency_key,
+                polling_unit_name,
+                ward_id,
+                lga_id,
+                entered_by,
+                request.remote_addr,
+                scores
+            )
 
-                # Only insert if a score was provided and it's a valid integer
-                if party_score is not None: 
-                    query_db(
-                        """
-                        INSERT INTO announced_pu_results (
-                            polling_unit_uniqueid, party_abbreviation, party_score,
-                            entered_by_user, date_entered, user_ip_address
-                        ) VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP, %s);
-                        """,
-                        (
-                            inserted_polling_unit_uniqueid,
-                            partyname,
-                            party_score,
-                            entered_by,
-                            request.remote_addr
-                        ),
-                        commit=True
-                    )
-            
-            flash(f"New polling unit '{polling_unit_name}' (ID: {inserted_polling_unit_uniqueid}) and its results saved successfully!", "success")
-            return redirect(url_for('q3_page'))
+            status_url = url_for('q3_submission_page', idempotency_key=idempotency_key)
+            if wants_json():
+                return jsonify(key=idempotency_key, created=created, status=submission['status'], status_url=status_url), 202
+            if created:
+                flash(f"Results for '{polling_unit_name}' received (reference {idempotency_key}).", "success")
+            else:
+                flash(f"These results were already received (reference {idempotency_key}).", "success")
+            return redirect(status_url, code=303)
+
+        except IdempotencyConflict:
+            # Typically a form restored by the back button, still carrying the key of an earlier submission
+            message = f"Reference {idempotency_key} was already used for different results; nothing was saved. Please submit again."
+            if wants_json():
+                return jsonify(error=message), 409
+            flash(message, "error")
+            return render_template('q3.html', parties=parties, lgas=lgas), 409
 
         except Exception as e:
-            flash(f"An error occurred while saving: {e}", "error")
             print(f"Error during Q3 submission: {e}") # Log the error to console
-            # Re-fetch parties, lgas, wards to re-render the form with existing data
-            parties = query_db("SELECT partyid, partyname FROM party ORDER BY partyname;", fetchall=True)
-            lgas = query_db("SELECT lga_id, lga_name FROM lga WHERE state_id = 25 ORDER BY lga_name;", fetchall=True)
-            wards = query_db("SELECT ward_id, ward_name, lga_id FROM ward ORDER BY ward_name;", fetchall=True)
-            return render_template('q3.html', parties=parties, lgas=lgas, wards=wards)
+            if wants_json():
+                return jsonify(error=f"An error occurred while saving: {e}"), 500
+            flash(f"An error occurred while saving: {e}", "error")
+            # Re-render the form with the (cached) parties, lgas and wards
+            return render_template('q3.html', parties=parties, lgas=lgas)
 
     # For GET requests or if an error occurred during POST and we re-render
-    return render_template('q3.html', parties=parties, lgas=lgas, wards=wards)
+    return render_reference_page('q3.html', ['parties', ('lgas', g.state['state_id'])], parties=parties, lgas=lgas)
+
+
+IDEMPOTENCY_KEY_PATTERN = re.compile(r'[A-Za-z0-9_-]{8,100}')
+
+
+def wants_json():
+    """True when the client asked for JSON rather than a page (e.g. Accept: application/json)."""
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+
+@state_route('/q3/submissions/<idempotency_key>')
+def q3_submission_page(idempotency_key):
+    """
+    Shows what became of a /q3 submission. The page polls api_submission_status
+    until the submission is applied or failed, which also gives the submitter
+    read-your-writes once the polling unit exists.
+    """
+    submission = get_submission(idempotency_key)
+    if submission is None:
+        abort(404)
+    if submission['status'] == 'applied':
+        remember_write()
+    return render_template('q3_submission.html', idempotency_key=idempotency_key, submission=submission)
+
+
+@app.route('/api/submissions/<idempotency_key>')
+def api_submission_status(idempotency_key):
+    """Returns the status of a queued /q3 submission: pending, applied (with its polling unit id) or failed."""
+    submission = get_submission(idempotency_key)
+    if submission is None:
+        return jsonify(error="Unknown submission."), 404
+    if submission['status'] == 'applied':
+        remember_write() # The submitter's next replica reads include the new polling unit
+    return jsonify(submission)
+
+
+INGEST_MAX_REPORTED_ERRORS = 1000
+# Bulk loading is only enabled when a token is configured; clients send it as "Authorization: Bearer <token>"
+INGEST_TOKEN = os.environ.get('INGEST_TOKEN', '')
+INGEST_MAX_BYTES = int(os.environ.get('INGEST_MAX_BYTES', str(64 << 20))) # Largest accepted upload
+
+
+@state_route('/api/ingest', methods=['POST'])
+def api_ingest():
+    """
+    Bulk-loads an uploaded CSV or JSON Lines results file (see ingest.py).
+
+    Rows are validated against the LGAs of the state in the URL, so each
+    state's results are loaded through /states/<state_id>/api/ingest.
+
+    Requires the INGEST_TOKEN bearer token (the endpoint answers 404 when none
+    is configured) and accepts uploads of up to INGEST_MAX_BYTES.
+    Form fields: file (required), format ('csv' or 'jsonl', defaults to the file
+    extension) and entered_by (default for rows without entered_by_user).
+    Returns the load summary and up to INGEST_MAX_REPORTED_ERRORS rejected rows.
+    """
+    if not INGEST_TOKEN:
+        abort(404)
+    # Checked before the body is read, so unauthenticated uploads are never spooled
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.encode('utf-8'), INGEST_TOKEN.encode('utf-8')):
+        response = jsonify(error="A valid ingest token is required.")
+        response.status_code = 401
+        response.headers['WWW-Authenticate'] = 'Bearer'
+        return response
+
+    request.max_content_length = INGEST_MAX_BYTES
+    try:
+        upload = request.files.get('file')
+    except RequestEntityTooLarge:
+        return jsonify(error=f"Uploads are limited to {INGEST_MAX_BYTES} bytes."), 413
+    if upload is None:
+        return jsonify(error="A 'file' upload is required."), 400
+    fmt = request.form.get('format') or ('jsonl' if upload.filename.endswith(('.jsonl', '.ndjson')) else 'csv')
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify(error="format must be 'csv' or 'jsonl'."), 400
+
+    errors = []
+    def report(line_no, message):
+        if len(errors) < INGEST_MAX_REPORTED_ERRORS:
+            errors.append({'line_no': line_no, 'error': message})
+
+    # Werkzeug spools large uploads to a temporary file, so this reads from disk in a stream
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    try:
+        summary = ingest(stream, fmt, entered_by=request.form.get('entered_by', ''),
+                         ip_address=request.remote_addr, on_error=report, state_id=g.state['state_id'])
+    except Exception as e:
+        print(f"Error during bulk ingest: {e}") # Log the error to console
+        return jsonify(error=f"The file could not be loaded: {e}"), 500
+    return jsonify(summary=summary.as_dict(), errors=errors)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,270 @@
+"""
+Drives /q1, /q2 and /q3 at a configurable concurrency and reports latency.
+
+Two targets are supported: the Flask test client in this process, and a real
+gunicorn server started from the Procfile settings. For every scenario the run
+reports p50/p95/p99 latency, throughput and queries per request (taken from the
+Server-Timing header). The results are saved as JSON so that runs can be
+compared.
+
+Usage:
+    python bench/run.py [--target flask|gunicorn] [--concurrency 16] [--requests 500]
+                        [--scenarios q1_post,q2_results] [--label NAME] [--compare results/old.json]
+
+Run bench/fixture.py first; DATABASE_URL defaults to the benchmark database.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, 'bench', 'results')
+sys.path.insert(0, REPO_ROOT)
+from bench.fixture import DEFAULT_BENCH_DATABASE_URL # noqa: E402
+
+QUERIES_PATTERN = re.compile(r'queries=(\d+)')
+
+
+def load_sample_ids(state_id=25, sample=2000):
+    """Picks polling units, LGAs and wards to request, from the benchmark database."""
+    from database import query_db
+    polling_units = [row['uniqueid'] for row in query_db(
+        """
+        SELECT pu.uniqueid FROM polling_unit pu
+        JOIN lga l ON l.lga_id = pu.lga_id
+        WHERE l.state_id = %s
+          AND EXISTS (SELECT 1 FROM announced_pu_results apr WHERE apr.polling_unit_uniqueid = pu.uniqueid)
+        ORDER BY random() LIMIT %s;
+        """,
+        (state_id, sample), fetchall=True
+    )]
+    wards = query_db(
+        """
+        SELECT w.lga_id, w.ward_id FROM ward w
+        JOIN lga l ON l.lga_id = w.lga_id
+        WHERE l.state_id = %s;
+        """,
+        (state_id,), fetchall=True
+    )
+    parties = [row['partyid'] for row in query_db("SELECT partyid FROM party;", fetchall=True)]
+    return {
+        'polling_units': polling_units,
+        'lga_wards': [(row['lga_id'], row['ward_id']) for row in wards],
+        'lgas': sorted({row['lga_id'] for row in wards}),
+        'parties': parties,
+    }
+
+
+def build_request(scenario, ids, rng):
+    """Returns (method, path, form data) for one request of a scenario."""
+    if scenario == 'q1_get':
+        return 'GET', '/q1', None
+    if scenario == 'q1_post':
+        return 'POST', '/q1', {'polling_unit_uniqueid': rng.choice(ids['polling_units'])}
+    if scenario == 'q1_search':
+        return 'GET', '/api/polling-units?' + urllib.parse.urlencode({'q': rng.choice(['bench', 'pu 1', 'ward', 'pri'])}), None
+    if scenario == 'q2_get':
+        return 'GET', '/q2', None
+    if scenario == 'q2_results':
+        return 'GET', '/q2?' + urllib.parse.urlencode({'lga_id': rng.choice(ids['lgas'])}), None
+    if scenario == 'q3_get':
+        return 'GET', '/q3', None
+    if scenario == 'q3_post':
+        lga_id, ward_id = rng.choice(ids['lga_wards'])
+        data = {'polling_unit_name': f'Bench submission {rng.randrange(10**9)}', 'lga_id': lga_id,
+                'ward_id': ward_id, 'entered_by_user': 'bench'}
+        for party in ids['parties']:
+            data[f'party_score_{party}'] = rng.randrange(1000)
+        return 'POST', '/q3', data
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+SCENARIOS = ['q1_get', 'q1_post', 'q1_search', 'q2_get', 'q2_results', 'q3_get', 'q3_post']
+
+
+class FlaskTarget:
+    """Sends requests through the Flask test client, one client per thread."""
+
+    def __init__(self):
+        from app import app
+        self.app = app
+        self._local = threading.local()
+
+    def send(self, method, path, data):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, data=data)
+        return response.status_code, response.headers.get('Server-Timing', '')
+
+    def close(self):
+        pass
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None # Report the 303 from a POST to /q2 or /q3 instead of following it (surfaces as HTTPError)
+
+
+class GunicornTarget:
+    """Starts gunicorn the way the Procfile does and sends real HTTP requests to it."""
+
+    def __init__(self, workers, threads, port):
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.process = subprocess.Popen(
+            ['gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+             '--worker-class', 'gthread', '--threads', str(threads), 'app:app'],
+            cwd=REPO_ROOT, env=os.environ.copy()
+        )
+        self.opener = urllib.request.build_opener(_NoRedirect)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                self.opener.open(self.base_url + '/', timeout=1).read()
+                return
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.2)
+        self.close()
+        raise RuntimeError("gunicorn did not start within 30s")
+
+    def send(self, method, path, data):
+        body = urllib.parse.urlencode(data).encode('ascii') if data is not None else None
+        request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                response.read()
+                return response.status, response.headers.get('Server-Timing', '')
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code, e.headers.get('Server-Timing', '')
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait(timeout=30)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(pct / 100.0 * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+def run_scenario(target, scenario, ids, requests, concurrency, seed):
+    """Sends requests for one scenario and returns its summary."""
+    def worker(index):
+        rng = random.Random(seed * 1000003 + index)
+        method, path, data = build_request(scenario, ids, rng)
+        started = time.perf_counter()
+        try:
+            status, server_timing = target.send(method, path, data)
+        except Exception:
+            status, server_timing = None, ''
+        elapsed = time.perf_counter() - started
+        match = QUERIES_PATTERN.search(server_timing)
+        return elapsed, status, int(match.group(1)) if match else None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(worker, range(requests)))
+    wall = time.perf_counter() - started
+
+    # Redirects count as successes: POSTs to /q3 (and /q2) answer 303 See Other
+    ok = [s for s in samples if s[1] is not None and 200 <= s[1] < 400]
+    latencies = sorted(s[0] * 1000 for s in ok)
+    queries = [s[2] for s in ok if s[2] is not None]
+    return {
+        'requests': requests,
+        'errors': requests - len(ok),
+        'throughput_rps': len(ok) / wall if wall else 0.0,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'queries_per_request': sum(queries) / len(queries) if queries else None,
+    }
+
+
+def print_report(results, baseline=None):
+    header = f"{'scenario':10s} {'req':>6s} {'err':>5s} {'rps':>9s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'q/req':>6s}"
+    print(header)
+    print('-' * len(header))
+    fmt = lambda value, spec: format(value, spec) if value is not None else '-'
+    for scenario, r in results.items():
+        print(f"{scenario:10s} {r['requests']:6d} {r['errors']:5d} {fmt(r['throughput_rps'], '9.1f')} "
+              f"{fmt(r['p50_ms'], '9.1f')} {fmt(r['p95_ms'], '9.1f')} {fmt(r['p99_ms'], '9.1f')} "
+              f"{fmt(r['queries_per_request'], '6.1f')}")
+        old = (baseline or {}).get(scenario)
+        if old and old.get('p95_ms') and r['p95_ms'] and old.get('throughput_rps'):
+            print(f"{'':10s} vs baseline: p95 {100.0 * (r['p95_ms'] / old['p95_ms'] - 1):+.1f}%, "
+                  f"throughput {100.0 * (r['throughput_rps'] / old['throughput_rps'] - 1):+.1f}%")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the result pages.")
+    parser.add_argument('--target', choices=['flask', 'gunicorn'], default='flask')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Comma-separated: " + ', '.join(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=500, help="Requests per scenario.")
+    parser.add_argument('--workers', type=int, default=2, help="gunicorn workers.")
+    parser.add_argument('--threads', type=int, default=8, help="gunicorn threads per worker.")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--label', default='run')
+    parser.add_argument('--compare', help="A saved result file to compare against.")
+    cli_args = parser.parse_args()
+
+    os.environ.setdefault('DATABASE_URL', DEFAULT_BENCH_DATABASE_URL)
+    os.environ['RATE_LIMITS'] = '0' # Every request comes from one client; limits would turn samples into 429s
+    scenarios = [s.strip() for s in cli_args.scenarios.split(',') if s.strip()]
+    ids = load_sample_ids()
+    target = (FlaskTarget() if cli_args.target == 'flask'
+              else GunicornTarget(cli_args.workers, cli_args.threads, cli_args.port))
+    try:
+        results = {}
+        for scenario in scenarios:
+            run_scenario(target, scenario, ids, min(cli_args.concurrency * 2, cli_args.requests),
+                         cli_args.concurrency, cli_args.seed) # Warm-up: pools, caches, plans
+            results[scenario] = run_scenario(target, scenario, ids, cli_args.requests,
+                                             cli_args.concurrency, cli_args.seed)
+    finally:
+        target.close()
+
+    baseline = None
+    if cli_args.compare:
+        with open(cli_args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    print_report(results, baseline)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    path = os.path.join(RESULTS_DIR, f"{stamp}-{cli_args.label}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'label': cli_args.label,
+            'revision': git_revision(),
+            'created_at': stamp,
+            'settings': {k: v for k, v in vars(cli_args).items() if k != 'compare'},
+            'results': results,
+        }, f, indent=2)
+    print(f"Saved {path}")
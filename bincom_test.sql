@@ -7,7 +7,7 @@
 -- Server version: 5.1.36
 -- PHP Version: 5.2.9-2
 
-SET "SQL_MODE=NO_AUTO_VALUE_ON_ZERO"
+-- MySQL only; PostgreSQL has no SQL_MODE: SET "SQL_MODE=NO_AUTO_VALUE_ON_ZERO";
 
 
 --
@@ -20,7 +20,7 @@ SET "SQL_MODE=NO_AUTO_VALUE_ON_ZERO"
 -- Table structure for table agentname
 --
 
-DROP TABLE IF EXISTS agentname
+DROP TABLE IF EXISTS agentname;
 CREATE TABLE IF NOT EXISTS agentname (
   name_id SERIAL PRIMARY KEY,
   firstname VARCHAR(255) NOT NULL,
@@ -1225,3 +1225,21 @@ INSERT INTO ward (uniqueid, ward_id, ward_name, lga_id, ward_description, entere
 (261, 0, 'Oporoza', 35, 'Oporoza', 'Bincom', CURRENT_TIMESTAMP, '127.0.0.1'),
 (262, 0, 'Orere', 35, 'Orere', 'Bincom', CURRENT_TIMESTAMP, '127.0.0.1'),
 (263, 0, 'Ugborodo', 35, 'Ugborodo', 'Bincom', CURRENT_TIMESTAMP, '127.0.0.1');
+
+
+-- --------------------------------------------------------
+
+--
+-- Move SERIAL sequences past the explicitly inserted ids so that
+-- sequence-based inserts (new parties, LGAs, wards, polling units and results) do not collide
+--
+
+SELECT setval(pg_get_serial_sequence('agentname', 'name_id'), COALESCE((SELECT MAX(name_id) FROM agentname), 0) + 1, false);
+SELECT setval(pg_get_serial_sequence('announced_lga_results', 'result_id'), COALESCE((SELECT MAX(result_id) FROM announced_lga_results), 0) + 1, false);
+SELECT setval(pg_get_serial_sequence('announced_pu_results', 'result_id'), COALESCE((SELECT MAX(result_id) FROM announced_pu_results), 0) + 1, false);
+SELECT setval(pg_get_serial_sequence('announced_state_results', 'result_id'), COALESCE((SELECT MAX(result_id) FROM announced_state_results), 0) + 1, false);
+SELECT setval(pg_get_serial_sequence('announced_ward_results', 'result_id'), COALESCE((SELECT MAX(result_id) FROM announced_ward_results), 0) + 1, false);
+SELECT setval(pg_get_serial_sequence('lga', 'uniqueid'), COALESCE((SELECT MAX(uniqueid) FROM lga), 0) + 1, false);
+SELECT setval(pg_get_serial_sequence('party', 'id'), COALESCE((SELECT MAX(id) FROM party), 0) + 1, false);
+SELECT setval(pg_get_serial_sequence('polling_unit', 'uniqueid'), COALESCE((SELECT MAX(uniqueid) FROM polling_unit), 0) + 1, false);
+SELECT setval(pg_get_serial_sequence('ward', 'uniqueid'), COALESCE((SELECT MAX(uniqueid) FROM ward), 0) + 1, false);
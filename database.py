@@ -1,6 +1,18 @@
+import logging
 import os # Import the 'os' module to access environment variables
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
 import psycopg2
-import psycopg2.extras # Needed for DictCursor
+import psycopg2.extensions
+import psycopg2.extras # Needed for RealDictCursor and NamedTupleCursor
+import psycopg2.pool
+from instrumentation import record, log_slow_query, SLOW_QUERY_MS
+
+logger = logging.getLogger(__name__)
 
 # --- Database Connection Details ---
 # IMPORTANT: These hardcoded values are for LOCAL DEVELOPMENT ONLY.
@@ -11,24 +23,51 @@ DB_PASSWORD = os.environ.get("DB_PASSWORD", "admin")      # Fallback for local
 DB_HOST = os.environ.get("DB_HOST", "localhost")          # Fallback for local
 DB_PORT = os.environ.get("DB_PORT", "5432")               # Fallback for local
 
+# --- Connection Pool Settings ---
+# Each gunicorn worker gets its own pool (created lazily after the fork).
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "1"))           # Idle connections kept open
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))          # Hard cap per worker
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))          # Seconds to wait for a free connection
+DB_POOL_RECYCLE = float(os.environ.get("DB_POOL_RECYCLE", "1800"))        # Reconnect connections older than this
+DB_POOL_PRE_PING = float(os.environ.get("DB_POOL_PRE_PING", "30"))        # Health-check connections idle longer than this
+
+# --- Read Replicas ---
+# DATABASE_URL is the primary. Reads that opt in with replica=True go to one of
+# the DATABASE_REPLICA_URLS (comma-separated) that is healthy, at most
+# REPLICA_MAX_LAG_SECONDS behind and has replayed the caller's own last write
+# (see read_after()); otherwise they go to the primary. Writes always do.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get("REPLICA_MAX_LAG_SECONDS", "10"))
+REPLICA_CHECK_INTERVAL = float(os.environ.get("REPLICA_CHECK_INTERVAL", "5"))  # Seconds between health checks
+REPLICA_RETRY_AFTER = float(os.environ.get("REPLICA_RETRY_AFTER", "30"))       # Seconds a failed replica is skipped
+DB_CONNECT_TIMEOUT = int(os.environ.get("DB_CONNECT_TIMEOUT", "5"))            # Replica connect timeout
+
 
-def get_db_connection():
-    """Establishes and returns a new database connection."""
+def get_db_connection(dsn=None):
+    """
+    Establishes and returns a new database connection.
+
+    Args:
+        dsn (str): Connection string of a read replica; the primary when None.
+    """
     conn = None
     try:
         # --- CRITICAL CHANGE FOR RENDER.COM DEPLOYMENT ---
         # Prioritize DATABASE_URL environment variable provided by Render
         DATABASE_URL = os.environ.get('DATABASE_URL')
 
-        if DATABASE_URL:
+        if dsn:
+            # Fail fast, so an unreachable replica only delays the check that notices it
+            conn = psycopg2.connect(dsn, connect_timeout=DB_CONNECT_TIMEOUT)
+        elif DATABASE_URL:
             # If DATABASE_URL is set (as it will be on Render), use it directly
             conn = psycopg2.connect(DATABASE_URL)
-            print("Connected using DATABASE_URL environment variable.") # For debugging
+            logger.debug("Connected using DATABASE_URL environment variable.")
         else:
             # Fallback to individual environment variables or hardcoded values for local development
             # It's good practice to also read these from environment variables even locally
             # if you want to avoid hardcoding completely.
-            print("DATABASE_URL not found. Attempting connection with individual DB variables.") # For debugging
+            logger.debug("DATABASE_URL not found. Attempting connection with individual DB variables.")
             conn = psycopg2.connect(
                 dbname=DB_NAME,
                 user=DB_USER,
@@ -36,12 +75,347 @@ def get_db_connection():
                 host=DB_HOST,
                 port=DB_PORT
             )
+        record(connections=1)
         return conn
     except psycopg2.Error as e:
         print(f"Database connection error: {e}")
         raise # Re-raise the exception for the calling code to handle
 
-def query_db(query, args=(), fetchone=False, fetchall=False, commit=False):
+
+def _explain(query, args):
+    """Returns the EXPLAIN output of a statement, using a separate connection."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("EXPLAIN " + query, args)
+            return "\n".join(row[0] for row in cur.fetchall())
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+class InstrumentedCursor(psycopg2.extras.RealDictCursor):
+    """
+    RealDictCursor that reports execute/fetch time and row counts to instrumentation.
+
+    Statements slower than SLOW_QUERY_MS are written to the slow query log with
+    their parameters and EXPLAIN output. EXPLAIN runs on a separate connection,
+    so it can never disturb the caller's transaction.
+    """
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            elapsed = time.perf_counter() - started
+            record('execute', elapsed, queries=1)
+            if elapsed * 1000 >= SLOW_QUERY_MS:
+                explainable = str(query).lstrip().split(None, 1)[0].upper() in ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+                log_slow_query(query, vars, elapsed, (lambda: _explain(query, vars)) if explainable else None)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        record('fetch', time.perf_counter() - started, rows=1 if row is not None else 0)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        record('fetch', time.perf_counter() - started, rows=len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        record('fetch', time.perf_counter() - started, rows=len(rows))
+        return rows
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """Raised when no pooled connection became free within DB_POOL_TIMEOUT."""
+
+
+class ConnectionPool:
+    """
+    A small thread-safe pool of psycopg2 connections.
+
+    Unlike psycopg2.pool, idle connections above the minimum size are kept
+    for reuse instead of being closed on return, connections are recycled
+    after DB_POOL_RECYCLE seconds, and connections that sat idle for longer
+    than DB_POOL_PRE_PING seconds are health-checked before being handed out.
+    """
+
+    def __init__(self, connect, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 timeout=DB_POOL_TIMEOUT, recycle=DB_POOL_RECYCLE, pre_ping=DB_POOL_PRE_PING):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._idle = deque() # (conn, created_at, last_used)
+        self._created = {}   # id(conn) -> created_at, for connections currently checked out
+        self.closed = False
+
+    def getconn(self):
+        """Checks out a healthy connection, opening a new one if none are idle."""
+        if self.closed:
+            raise psycopg2.pool.PoolError("connection pool is closed")
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"No database connection available after {self.timeout}s")
+        try:
+            while True:
+                with self._lock:
+                    entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    conn = self._connect()
+                    self._created[id(conn)] = time.monotonic()
+                    return conn
+                conn, created_at, last_used = entry
+                if self._is_usable(conn, created_at, last_used):
+                    self._created[id(conn)] = created_at
+                    return conn
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, close=False):
+        """Returns a connection to the pool, resetting any open transaction."""
+        created_at = self._created.pop(id(conn), None)
+        try:
+            if close or self.closed or created_at is None or conn.closed:
+                self._discard(conn)
+                return
+            status = conn.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                self._discard(conn) # Server connection lost
+                return
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback() # Never hand out a connection that is mid-transaction
+            with self._lock:
+                self._idle.append((conn, created_at, time.monotonic()))
+        except psycopg2.Error:
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def fill(self):
+        """Opens connections until at least min_size are idle (best effort)."""
+        while len(self._idle) < self.min_size and not self.closed:
+            try:
+                conn = self._connect()
+            except psycopg2.Error:
+                return # Let the first real query surface the error
+            with self._lock:
+                self._idle.append((conn, time.monotonic(), time.monotonic()))
+
+    def closeall(self):
+        """Closes every idle connection and refuses further checkouts."""
+        self.closed = True
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    def _is_usable(self, conn, created_at, last_used):
+        if conn.closed:
+            return False
+        now = time.monotonic()
+        if self.recycle and now - created_at > self.recycle:
+            return False
+        if self.pre_ping and now - last_used > self.pre_ping:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1;")
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+_pools = {}      # dsn (None for the primary) -> ConnectionPool
+_pools_pid = None
+_pool_lock = threading.Lock()
+# Pools inherited from a parent process are parked here instead of being garbage
+# collected: closing them in the child would tear down the parent's sockets.
+_inherited_pools = []
+
+
+def get_pool(dsn=None):
+    """Returns this process's connection pool for the primary or a replica, creating it on first use (fork-safe)."""
+    global _pools_pid
+    pid = os.getpid()
+    pool = _pools.get(dsn)
+    if pool is not None and _pools_pid == pid:
+        return pool
+    with _pool_lock:
+        if _pools_pid != pid:
+            _inherited_pools.extend(_pools.values())
+            _pools.clear()
+            _pools_pid = pid
+        pool = _pools.get(dsn)
+        if pool is None:
+            pool = _pools[dsn] = ConnectionPool(lambda: get_db_connection(dsn))
+            pool.fill()
+        return pool
+
+
+def close_pool():
+    """Closes the current process's pools (e.g. on worker shutdown)."""
+    with _pool_lock:
+        if _pools_pid == os.getpid():
+            for pool in _pools.values():
+                pool.closeall()
+        _pools.clear()
+
+
+@contextmanager
+def pooled_connection(dsn=None):
+    """
+    Checks a connection out of the pool for the duration of a with-block.
+
+    Connections that hit a connection-level error are closed instead of being
+    returned, so a dropped server connection is never reused.
+
+    Args:
+        dsn (str): A replica's connection string; the primary when None.
+    """
+    pool = get_pool(dsn)
+    started = time.perf_counter()
+    conn = pool.getconn()
+    record('connect', time.perf_counter() - started, checkouts=1)
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        pool.putconn(conn, close=broken)
+
+
+def parse_lsn(lsn):
+    """Converts a WAL position such as '16/B374D848' to an integer that orders correctly."""
+    high, low = lsn.split('/')
+    return (int(high, 16) << 32) | int(low, 16)
+
+
+REPLICA_STATUS_SQL = """
+SELECT pg_is_in_recovery() AS in_recovery,
+       pg_last_wal_replay_lsn()::text AS replay_lsn,
+       -- An idle primary sends no new transactions, so only count lag while WAL is waiting to be replayed
+       CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+       END AS lag_seconds;
+"""
+
+
+class Replica:
+    """A read replica and its health, replay position and lag as of its last check."""
+
+    def __init__(self, dsn):
+        self.dsn = dsn
+        self.healthy = False
+        self.replay_lsn = 0
+        self.lag_seconds = None
+        self.checked_at = None # time.monotonic() of the last check
+        self.retry_at = 0.0
+        self._checking = threading.Lock()
+
+    def refresh_if_due(self):
+        """Re-checks the replica every REPLICA_CHECK_INTERVAL seconds; one thread checks, the others use the last result."""
+        now = time.monotonic()
+        if now < self.retry_at or (self.checked_at is not None and now - self.checked_at < REPLICA_CHECK_INTERVAL):
+            return
+        if not self._checking.acquire(blocking=False):
+            return
+        try:
+            with pooled_connection(self.dsn) as conn:
+                with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                    cur.execute(REPLICA_STATUS_SQL)
+                    status = cur.fetchone()
+                conn.rollback()
+            self.lag_seconds = float(status['lag_seconds'])
+            self.replay_lsn = parse_lsn(status['replay_lsn']) if status['replay_lsn'] else 0
+            # A promoted replica no longer follows the primary
+            self.healthy = status['in_recovery'] and self.lag_seconds <= REPLICA_MAX_LAG_SECONDS
+        except psycopg2.Error as e:
+            self.mark_failed(e)
+        finally:
+            self.checked_at = time.monotonic()
+            self._checking.release()
+
+    def mark_failed(self, error):
+        self.healthy = False
+        self.retry_at = time.monotonic() + REPLICA_RETRY_AFTER
+        print(f"Read replica unavailable, reading from the primary: {error}")
+
+
+_replicas = [Replica(dsn) for dsn in DATABASE_REPLICA_URLS]
+_replica_turn = itertools.count()
+# WAL position the current request's replica reads must have caught up with
+_read_after_lsn = ContextVar('read_after_lsn', default=0)
+
+
+def read_after(lsn):
+    """
+    Makes replica reads in the current context skip replicas that have not replayed lsn yet.
+
+    Used for read-your-writes: pass the position current_wal_lsn() returned
+    after the caller's own write.
+    """
+    _read_after_lsn.set(lsn or 0)
+
+
+def current_wal_lsn():
+    """Returns the primary's current WAL position as an integer, or None when no replicas are configured."""
+    if not _replicas:
+        return None
+    return parse_lsn(query_db("SELECT pg_current_wal_lsn()::text AS lsn;", fetchone=True)['lsn'])
+
+
+def choose_read_dsn():
+    """Returns the DSN of a replica fit to serve a read now (round robin), or None for the primary."""
+    if not _replicas:
+        return None
+    required = _read_after_lsn.get()
+    start = next(_replica_turn)
+    for i in range(len(_replicas)):
+        replica = _replicas[(start + i) % len(_replicas)]
+        replica.refresh_if_due()
+        if replica.healthy and replica.replay_lsn >= required:
+            return replica.dsn
+    return None
+
+
+def replica_failed(dsn, error):
+    """Takes a replica out of rotation for REPLICA_RETRY_AFTER seconds after a connection-level error."""
+    for replica in _replicas:
+        if replica.dsn == dsn:
+            replica.mark_failed(error)
+
+
+def replica_status():
+    """Returns the last known state of each replica (DSNs are not included)."""
+    return [
+        {'replica': i, 'healthy': r.healthy, 'lag_seconds': r.lag_seconds, 'replay_lsn': r.replay_lsn}
+        for i, r in enumerate(_replicas)
+    ]
+
+
+def query_db(query, args=(), fetchone=False, fetchall=False, commit=False, replica=False):
     """
     Executes a database query.
 
@@ -51,44 +425,428 @@ def query_db(query, args=(), fetchone=False, fetchall=False, commit=False):
         fetchone (bool): If True, fetches only one row.
         fetchall (bool): If True, fetches all rows.
         commit (bool): If True, commits the transaction (for INSERT, UPDATE, DELETE).
+        replica (bool): If True (and commit is False), reads from a healthy,
+            caught-up replica when there is one, falling back to the primary.
 
     Returns:
         dict or list of dict or None: Query results as dictionaries or None.
+        Rows are fetched before the commit, so commit=True can be combined with
+        fetchone/fetchall for INSERT ... RETURNING statements.
     """
-    conn = None
-    cur = None
+    if replica and not commit:
+        dsn = choose_read_dsn()
+        if dsn is not None:
+            try:
+                return _execute(dsn, query, args, fetchone, fetchall, commit)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                replica_failed(dsn, e) # Retried on the primary below
+    return _execute(None, query, args, fetchone, fetchall, commit)
+
+
+def _execute(dsn, query, args, fetchone, fetchall, commit):
     try:
-        conn = get_db_connection()
-        # Use DictCursor to get results as dictionaries (column_name: value)
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute(query, args)
+        with pooled_connection(dsn) as conn:
+            # RealDictCursor rows already are dicts (column_name: value), so they are returned without copying
+            with conn.cursor(cursor_factory=InstrumentedCursor) as cur:
+                try:
+                    cur.execute(query, args)
 
-        if commit:
-            conn.commit()
-            return None # No data to return for commit operations
-        elif fetchone:
-            result = cur.fetchone()
-            # Convert Row to dict, handle None. psycopg2.extras.DictRow behaves like a dict.
-            return dict(result) if result else None
-        elif fetchall:
-            results = cur.fetchall()
-            return [dict(row) for row in results] # Convert all DictRows to dicts
-        else:
-            return None # For queries that don't fetch (e.g., CREATE TABLE, DROP TABLE without RETURNING)
+                    result = None # For queries that don't fetch (e.g., CREATE TABLE, DROP TABLE without RETURNING)
+                    if fetchone:
+                        result = cur.fetchone()
+                    elif fetchall:
+                        result = cur.fetchall()
+
+                    # Fetch before committing so INSERT ... RETURNING works with commit=True
+                    if commit:
+                        conn.commit()
+                    return result
+                except psycopg2.Error:
+                    if not conn.closed:
+                        conn.rollback() # Rollback in case of error
+                    raise
 
     except psycopg2.Error as e:
         print(f"Database query error: {e}")
-        if conn:
-            conn.rollback() # Rollback in case of error
         raise # Re-raise the exception after logging/rollback
+
+
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", "2000")) # Rows per server-side fetch
+
+
+def stream_query(query, args=(), batch_size=STREAM_BATCH_SIZE, row_type='namedtuple', replica=False):
+    """
+    Yields the rows of a large read without materializing the whole result.
+
+    A server-side (named) cursor keeps the result on the database server and
+    rows are pulled in batches of batch_size, so memory use and time to first
+    row do not grow with the size of the result. The pooled connection is held
+    until the generator is exhausted or closed, so consume it promptly (e.g.
+    from a Flask streaming response).
+
+    Args:
+        query (str): The SQL query to execute.
+        args (tuple): Arguments to pass to the query.
+        batch_size (int): Rows fetched per round trip.
+        row_type (str): 'namedtuple' (attribute access, as templates expect) or 'tuple'.
+        replica (bool): Read from a replica if one qualifies, falling back to
+            the primary as query_db does. The fallback is only possible before
+            the first row is yielded; a replica lost mid-stream raises.
+
+    Yields:
+        namedtuple or tuple: One row at a time.
+    """
+    if replica:
+        dsn = choose_read_dsn()
+        if dsn is not None:
+            rows = _stream(dsn, query, args, batch_size, row_type)
+            try:
+                first = next(rows) # Connects, executes and fetches the first batch
+            except StopIteration:
+                return
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                replica_failed(dsn, e) # Nothing was yielded yet: retried on the primary below
+            else:
+                yield first
+                yield from rows
+                return
+    yield from _stream(None, query, args, batch_size, row_type)
+
+
+def _stream(dsn, query, args, batch_size, row_type):
+    cursor_factory = psycopg2.extras.NamedTupleCursor if row_type == 'namedtuple' else None
+    with pooled_connection(dsn) as conn:
+        with conn.cursor(name=f"stream_{threading.get_ident()}_{time.monotonic_ns()}",
+                         cursor_factory=cursor_factory) as cur:
+            cur.itersize = batch_size
+            started = time.perf_counter()
+            cur.execute(query, args)
+            record('execute', time.perf_counter() - started, queries=1)
+            while True:
+                started = time.perf_counter()
+                rows = cur.fetchmany(batch_size)
+                record('fetch', time.perf_counter() - started, rows=len(rows))
+                if not rows:
+                    break
+                yield from rows
+        conn.rollback() # End the read-only transaction the named cursor needed
+
+
+@contextmanager
+def transaction():
+    """
+    Runs several statements on one pooled connection inside a single transaction.
+
+    Yields an (instrumented) RealDictCursor. The transaction is committed when the with-block exits
+    normally and rolled back if it raises.
+    """
+    with pooled_connection() as conn:
+        try:
+            with conn.cursor(cursor_factory=InstrumentedCursor) as cur:
+                yield cur
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+
+
+def insert_polling_unit_results(cur, polling_unit_name, ward_id, lga_id, entered_by, ip_address, scores):
+    """
+    Inserts a new polling unit and all of its party scores in one statement.
+
+    The polling unit id comes from the polling_unit.uniqueid sequence, so
+    concurrent submissions can never be handed the same id. The polling unit
+    row and every announced_pu_results row are written by a single multi-row
+    INSERT, i.e. one round trip regardless of the number of parties.
+
+    Args:
+        cur: A cursor inside an open transaction (see transaction()).
+        polling_unit_name (str): Name of the new polling unit.
+        ward_id (int): Ward the polling unit belongs to.
+        lga_id (int): LGA the polling unit belongs to.
+        entered_by (str): Name of the person submitting the results.
+        ip_address (str): Submitter's IP address.
+        scores (list of (str, int)): (party_abbreviation, party_score) pairs.
+
+    Returns:
+        int: The uniqueid of the new polling unit.
+    """
+    params = {
+        'ward_id': ward_id,
+        'lga_id': lga_id,
+        'polling_unit_name': polling_unit_name,
+        'entered_by': entered_by,
+        'ip_address': ip_address,
+    }
+    new_polling_unit_sql = """
+        INSERT INTO polling_unit (
+            uniqueid, polling_unit_id, ward_id, lga_id, uniquewardid,
+            polling_unit_name, polling_unit_description,
+            entered_by_user, date_entered, user_ip_address
+        )
+        SELECT id, id, %(ward_id)s, %(lga_id)s,
+               %(lga_id)s::text || '-' || %(ward_id)s::text || '-' || id::text,
+               %(polling_unit_name)s, '', -- Empty string satisfies the NOT NULL description
+               %(entered_by)s, CURRENT_TIMESTAMP, %(ip_address)s
+        FROM (SELECT nextval(pg_get_serial_sequence('polling_unit', 'uniqueid')) AS id) AS new_id
+        RETURNING uniqueid
+    """
+
+    if not scores:
+        cur.execute(new_polling_unit_sql + ";", params)
+        return cur.fetchone()['uniqueid']
+
+    value_rows = []
+    for i, (party_abbreviation, party_score) in enumerate(scores):
+        params[f'party_{i}'] = party_abbreviation
+        params[f'score_{i}'] = party_score
+        value_rows.append(f"(%(party_{i})s, %(score_{i})s::integer)")
+
+    cur.execute(
+        f"""
+        WITH new_pu AS ({new_polling_unit_sql}),
+        new_results AS (
+            INSERT INTO announced_pu_results (
+                polling_unit_uniqueid, party_abbreviation, party_score,
+                entered_by_user, date_entered, user_ip_address
+            )
+            SELECT new_pu.uniqueid, s.party_abbreviation, s.party_score,
+                   %(entered_by)s, CURRENT_TIMESTAMP, %(ip_address)s
+            FROM new_pu, (VALUES {", ".join(value_rows)}) AS s(party_abbreviation, party_score)
+        )
+        SELECT uniqueid FROM new_pu;
+        """,
+        params
+    )
+    return cur.fetchone()['uniqueid']
+
+
+def submit_polling_unit_results(polling_unit_name, ward_id, lga_id, entered_by, ip_address, scores):
+    """
+    Stores a new polling unit and its party scores in a single transaction.
+
+    See insert_polling_unit_results() for the arguments.
+
+    Returns:
+        int: The uniqueid of the new polling unit.
+    """
+    with transaction() as cur:
+        return insert_polling_unit_results(cur, polling_unit_name, ward_id, lga_id, entered_by, ip_address, scores)
+
+
+# Every SERIAL column; their sequences must stay ahead of explicitly inserted ids
+SERIAL_COLUMNS = [
+    ('agentname', 'name_id'),
+    ('announced_lga_results', 'result_id'),
+    ('announced_pu_results', 'result_id'),
+    ('announced_state_results', 'result_id'),
+    ('announced_ward_results', 'result_id'),
+    ('lga', 'uniqueid'),
+    ('party', 'id'),
+    ('polling_unit', 'uniqueid'),
+    ('ward', 'uniqueid'),
+]
+
+
+def sync_sequences(cur):
+    """
+    Moves each SERIAL sequence past the largest id already in its table.
+
+    Data loaded with explicit ids (such as bincom_test.sql) leaves the
+    sequences at 1, which would make sequence-based inserts collide.
+    Tables missing from this database are skipped.
+    """
+    for table, column in SERIAL_COLUMNS:
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL AS present;", (table,))
+        if not cur.fetchone()['present']:
+            continue
+        cur.execute(
+            f"""
+            SELECT setval(pg_get_serial_sequence(%s, %s),
+                          COALESCE((SELECT MAX({column}) FROM {table}), 0) + 1, false);
+            """,
+            (table, column)
+        )
+
+
+# --- Snapshots: bootstrap and export ---
+# A snapshot is a directory holding manifest.json (each table's columns, primary
+# key, SERIAL columns and row count) and one gzipped CSV per table. Exporting
+# and loading both go through COPY, so seeding a large dataset takes seconds
+# rather than replaying bincom_test.sql one INSERT at a time.
+SNAPSHOT_FORMAT = 1
+# Parents before children, in the order they are loaded
+SNAPSHOT_TABLES = [
+    'states', 'lga', 'ward', 'polling_unit', 'party', 'agentname',
+    'announced_pu_results', 'announced_ward_results', 'announced_lga_results', 'announced_state_results',
+]
+
+TABLE_COLUMNS_SQL = """
+SELECT a.attname AS name, format_type(a.atttypid, a.atttypmod) AS type, a.attnotnull AS not_null,
+       pg_get_expr(d.adbin, d.adrelid) AS default,
+       COALESCE(pg_get_serial_sequence(%s, a.attname) IS NOT NULL, false) AS serial
+FROM pg_attribute a
+LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+ORDER BY a.attnum;
+"""
+PRIMARY_KEY_SQL = """
+SELECT a.attname AS name
+FROM pg_index i
+JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+WHERE i.indrelid = %s::regclass AND i.indisprimary
+ORDER BY array_position(i.indkey::SMALLINT[], a.attnum);
+"""
+
+
+def export_snapshot(path):
+    """
+    Writes every existing table of SNAPSHOT_TABLES to a snapshot directory.
+
+    All tables are read in one REPEATABLE READ transaction, so the snapshot is
+    consistent even while results keep arriving.
+
+    Args:
+        path (str): Directory to write to; created if needed.
+
+    Returns:
+        dict: The manifest that was written.
+    """
+    import gzip
+    import json
+
+    os.makedirs(path, exist_ok=True)
+    manifest = {'format': SNAPSHOT_FORMAT, 'tables': []}
+    conn = get_db_connection()
+    try:
+        conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute("SELECT CURRENT_TIMESTAMP::TEXT AS now;")
+            manifest['exported_at'] = cur.fetchone()['now']
+            for table in SNAPSHOT_TABLES:
+                cur.execute("SELECT to_regclass(%s) IS NOT NULL AS present;", (table,))
+                if not cur.fetchone()['present']:
+                    print(f"Skipping {table}: not in this database.")
+                    continue
+                cur.execute(TABLE_COLUMNS_SQL, (table, table))
+                columns = [dict(row) for row in cur.fetchall()]
+                cur.execute(PRIMARY_KEY_SQL, (table,))
+                primary_key = [row['name'] for row in cur.fetchall()]
+                column_list = ", ".join(f'"{c["name"]}"' for c in columns)
+                order_by = ", ".join(f'"{name}"' for name in primary_key) or "1"
+                file_name = f"{table}.csv.gz"
+                with gzip.open(os.path.join(path, file_name), 'wb') as out:
+                    cur.copy_expert(
+                        f"COPY (SELECT {column_list} FROM {table} ORDER BY {order_by}) TO STDOUT WITH (FORMAT csv, HEADER true)",
+                        out
+                    )
+                    rows = cur.rowcount
+                if rows < 0: # Server did not report the COPY row count
+                    cur.execute(f"SELECT COUNT(*) AS n FROM {table};")
+                    rows = cur.fetchone()['n']
+                manifest['tables'].append({
+                    'name': table, 'file': file_name, 'rows': rows,
+                    'columns': columns, 'primary_key': primary_key,
+                })
+                print(f"Exported {table}: {rows} rows")
+        conn.rollback()
     finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
+        conn.close()
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
 
-if __name__ == '__main__':
-    # This block runs only when database.py is executed directly, not imported
+
+def _create_table_sql(table):
+    columns = []
+    for column in table['columns']:
+        if column['serial']:
+            column_type = 'BIGSERIAL' if column['type'] == 'bigint' else 'SERIAL'
+        else:
+            column_type = column['type']
+            if column['default'] is not None:
+                column_type += f" DEFAULT {column['default']}"
+        columns.append(f'"{column["name"]}" {column_type}{" NOT NULL" if column["not_null"] else ""}')
+    return f"CREATE TABLE {table['name']} (\n  " + ",\n  ".join(columns) + "\n);"
+
+
+def bootstrap_snapshot(path, replace=False):
+    """
+    Creates the tables of a snapshot and loads them with COPY.
+
+    Each table is created without its primary key, filled with COPY ... FREEZE
+    in the same transaction (no row-by-row index maintenance, no later
+    vacuum rewrite) and only then given its primary key. After the commit the
+    sequences are moved past the loaded ids and the migrations build the
+    secondary indexes and the rollup tables.
+
+    Args:
+        path (str): Snapshot directory written by export_snapshot().
+        replace (bool): Drop tables that already hold data. Without it the
+            bootstrap refuses to touch a database that is not empty.
+    """
+    import gzip
+    import json
+    import migrations
+
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported snapshot format: {manifest.get('format')}")
+    tables = manifest['tables']
+
+    started = time.perf_counter()
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            if not replace:
+                for table in tables:
+                    cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (table['name'],))
+                    if cur.fetchone()[0]:
+                        cur.execute(f"SELECT EXISTS (SELECT 1 FROM {table['name']});")
+                        if cur.fetchone()[0]:
+                            raise ValueError(f"Table {table['name']} already holds data; use --replace to overwrite it.")
+            # The new tables need every migration applied to them again
+            cur.execute("DROP TABLE IF EXISTS schema_migrations;")
+            for table in reversed(tables):
+                cur.execute(f"DROP TABLE IF EXISTS {table['name']} CASCADE;")
+            for table in tables:
+                cur.execute(_create_table_sql(table))
+                column_list = ", ".join(f'"{c["name"]}"' for c in table['columns'])
+                with gzip.open(os.path.join(path, table['file']), 'rb') as data:
+                    cur.copy_expert(
+                        f"COPY {table['name']} ({column_list}) FROM STDIN WITH (FORMAT csv, HEADER true, FREEZE true)",
+                        data
+                    )
+                if 0 <= cur.rowcount != table['rows']:
+                    raise ValueError(f"{table['file']} holds {cur.rowcount} rows, the manifest says {table['rows']}")
+                if table['primary_key']:
+                    key = ", ".join(f'"{name}"' for name in table['primary_key'])
+                    cur.execute(f"ALTER TABLE {table['name']} ADD PRIMARY KEY ({key});")
+                for column in table['columns']:
+                    if column['serial']:
+                        cur.execute(
+                            f"""
+                            SELECT setval(pg_get_serial_sequence(%s, %s),
+                                          COALESCE((SELECT MAX("{column['name']}") FROM {table['name']}), 0) + 1, false);
+                            """,
+                            (table['name'], column['name'])
+                        )
+                print(f"Loaded {table['name']}: {table['rows']} rows")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    migrations.upgrade()
+    print(f"Bootstrapped {len(tables)} tables from {path} in {time.perf_counter() - started:.1f}s")
+
+
+def check_connection():
+    """Prints connection diagnostics and the tables in the public schema."""
     print("Testing database connection...")
     try:
         conn = get_db_connection()
@@ -111,3 +869,39 @@ if __name__ == '__main__':
             print("No tables found or query failed.")
     except Exception as e_query:
         print(f"Query test failed with error: {e_query}")
+
+
+if __name__ == '__main__':
+    # This block runs only when database.py is executed directly, not imported
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Database utilities for the election results app.")
+    subcommands = parser.add_subparsers(dest='command')
+    subcommands.add_parser('check', help="Test the connection and list tables (default).")
+    subcommands.add_parser('sync-sequences', help="Move SERIAL sequences past existing ids.")
+    subcommands.add_parser('replicas', help="Check every read replica and print its health and lag.")
+    export_parser = subcommands.add_parser('export', help="Write a COPY snapshot of the data tables.")
+    export_parser.add_argument('path', nargs='?', default='snapshot')
+    bootstrap_parser = subcommands.add_parser('bootstrap', help="Create and load the data tables from a snapshot.")
+    bootstrap_parser.add_argument('path', nargs='?', default='snapshot')
+    bootstrap_parser.add_argument('--replace', action='store_true', help="Overwrite tables that already hold data.")
+    cli_args = parser.parse_args()
+
+    if cli_args.command == 'sync-sequences':
+        with transaction() as cur:
+            sync_sequences(cur)
+        print("Sequences synchronised.")
+    elif cli_args.command == 'export':
+        export_snapshot(cli_args.path)
+        print(f"Snapshot written to {cli_args.path}")
+    elif cli_args.command == 'bootstrap':
+        bootstrap_snapshot(cli_args.path, replace=cli_args.replace)
+    elif cli_args.command == 'replicas':
+        for replica in _replicas:
+            replica.refresh_if_due()
+        for status in replica_status():
+            print(status)
+        if not _replicas:
+            print("No replicas configured (DATABASE_REPLICA_URLS).")
+    else:
+        check_connection()
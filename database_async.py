@@ -0,0 +1,129 @@
+import asyncio
+import os
+import psycopg
+import threading
+import time
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from database import (
+    DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT,
+    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING,
+    DB_CONNECT_TIMEOUT, choose_read_dsn, replica_failed
+)
+from instrumentation import record, log_slow_query, SLOW_QUERY_MS
+
+# --- Async Read Path ---
+# Flask runs every async view in a fresh, short-lived event loop, and a pool of
+# async connections cannot outlive the loop it was created on. The pool
+# therefore lives on one long-running loop in a background thread per worker
+# process; views hand their queries to that loop and await the result, so the
+# queries of one request (and of concurrent requests) run side by side.
+# Reads with replica=True are routed like database.query_db's, with one pool per replica.
+ASYNC_DB_POOL_MAX_SIZE = int(os.environ.get("ASYNC_DB_POOL_MAX_SIZE", str(DB_POOL_MAX_SIZE)))
+
+_loop = None
+_loop_pid = None
+_pools = {} # dsn (None for the primary) -> AsyncConnectionPool
+_lock = threading.Lock()
+
+
+def _conninfo(dsn=None):
+    if dsn:
+        return make_conninfo(dsn, connect_timeout=DB_CONNECT_TIMEOUT)
+    DATABASE_URL = os.environ.get('DATABASE_URL')
+    if DATABASE_URL:
+        return DATABASE_URL
+    return make_conninfo(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT)
+
+
+def _get_loop():
+    """Returns this process's background event loop, starting it on first use (fork-safe)."""
+    global _loop, _loop_pid
+    pid = os.getpid()
+    if _loop is not None and _loop_pid == pid:
+        return _loop
+    with _lock:
+        if _loop is None or _loop_pid != pid:
+            # A loop inherited across fork has no thread running it; start afresh
+            _loop = asyncio.new_event_loop()
+            _loop_pid = pid
+            _pools.clear()
+            threading.Thread(target=_loop.run_forever, name="async-db-loop", daemon=True).start()
+        return _loop
+
+
+async def _get_pool(dsn=None):
+    """Returns the async connection pool of the primary or a replica, opening it on first use. Runs on the background loop."""
+    if dsn not in _pools:
+        pool = AsyncConnectionPool(
+            _conninfo(dsn),
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=ASYNC_DB_POOL_MAX_SIZE,
+            timeout=DB_POOL_TIMEOUT,
+            max_lifetime=DB_POOL_RECYCLE,
+            max_idle=max(DB_POOL_PRE_PING, 60.0),
+            check=AsyncConnectionPool.check_connection, # Health-check connections on checkout
+            open=False,
+        )
+        await pool.open()
+        _pools[dsn] = pool
+    return _pools[dsn]
+
+
+async def _execute(dsn, query, args, fetchone, fetchall):
+    pool = await _get_pool(dsn)
+    async with pool.connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute(query, args)
+            if fetchone:
+                return await cur.fetchone()
+            if fetchall:
+                return await cur.fetchall()
+            return None
+
+
+async def _run(dsn, query, args, fetchone, fetchall):
+    future = asyncio.run_coroutine_threadsafe(_execute(dsn, query, args, fetchone, fetchall), _get_loop())
+    return await asyncio.wrap_future(future)
+
+
+async def query_db_async(query, args=(), fetchone=False, fetchall=False, replica=False):
+    """
+    Executes a read-only query without blocking the calling event loop.
+
+    Same placeholders and return values as database.query_db (rows are dicts),
+    so independent lookups can be awaited together with asyncio.gather().
+
+    Args:
+        query (str): The SQL query to execute.
+        args (tuple or dict): Arguments to pass to the query.
+        fetchone (bool): If True, fetches only one row.
+        fetchall (bool): If True, fetches all rows.
+        replica (bool): If True, reads from a healthy, caught-up replica when
+            there is one, falling back to the primary.
+
+    Returns:
+        dict or list of dict or None: Query results as dictionaries or None.
+    """
+    started = time.perf_counter()
+    dsn = choose_read_dsn() if replica else None
+    try:
+        if dsn is not None:
+            try:
+                result = await _run(dsn, query, args, fetchone, fetchall)
+            except (psycopg.OperationalError, psycopg.InterfaceError) as e:
+                replica_failed(dsn, e) # Retried on the primary below
+                dsn = None
+        if dsn is None:
+            result = await _run(None, query, args, fetchone, fetchall)
+    except Exception as e:
+        print(f"Database query error: {e}")
+        raise
+    # Checkout, execute and fetch all happen on the background loop; they are reported as execute time
+    elapsed = time.perf_counter() - started
+    rows = len(result) if isinstance(result, list) else int(result is not None)
+    record('execute', elapsed, queries=1, rows=rows)
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        log_slow_query(query, args, elapsed)
+    return result
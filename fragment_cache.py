@@ -0,0 +1,92 @@
+import os
+import threading
+from collections import OrderedDict
+from jinja2 import nodes, FileSystemBytecodeCache
+from jinja2.ext import Extension
+
+# --- Template Fragment Cache ---
+# The dropdown option lists and party input grids only depend on reference
+# data, yet they were re-rendered on every request. Wrapping them in
+#
+#     {% cache 'lga-options' %} ... {% endcache %}
+#
+# renders them once per version of the data they show: the cache key is the
+# fragment name, any further arguments of the tag and the version the app
+# reports for them, so a change to (say) one state's LGAs produces new keys for
+# that state's fragments only and the old entries age out.
+FRAGMENT_CACHE_SIZE = int(os.environ.get("FRAGMENT_CACHE_SIZE", "256"))  # Rendered fragments kept per process
+# Compiled templates are written here so new gunicorn workers skip compiling them (off when empty)
+JINJA_BYTECODE_CACHE_DIR = os.environ.get("JINJA_BYTECODE_CACHE_DIR", "")
+
+
+class FragmentCache:
+    """A small thread-safe LRU of rendered fragments."""
+
+    def __init__(self, max_entries=FRAGMENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FragmentCacheExtension(Extension):
+    """Adds the {% cache name[, key, ...] %}...{% endcache %} tag."""
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=FragmentCache(), fragment_cache_version=lambda *key_parts: '')
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key_parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key_parts.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render_cached', [nodes.List(key_parts)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render_cached(self, key_parts, caller):
+        key = (self.environment.fragment_cache_version(*key_parts),) + tuple(key_parts)
+        cache = self.environment.fragment_cache
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = caller()
+            cache.set(key, fragment)
+        return fragment
+
+
+def init_app(app, version):
+    """
+    Enables the {% cache %} tag (and the bytecode cache, if configured) on a Flask app.
+
+    Args:
+        app: The Flask app.
+        version (callable): Called with a fragment's key parts (name first),
+            returns the current version of the data that fragment shows;
+            fragments rendered under another version are not reused.
+    """
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache_version = version
+    if JINJA_BYTECODE_CACHE_DIR:
+        os.makedirs(JINJA_BYTECODE_CACHE_DIR, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_BYTECODE_CACHE_DIR)
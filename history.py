@@ -0,0 +1,239 @@
+"""
+Historical per-LGA party totals, for "totals as of 21:00" and progression curves.
+
+Every HISTORY_INTERVAL_SECONDS a snapshot compares rollup_lga_results (kept
+current by the rollup triggers) with result_history_head, the totals recorded
+by the previous snapshot, and appends only the LGA/party totals that changed
+to result_history. The totals of an LGA at any moment are then the latest
+recorded total of each party up to the last snapshot taken at or before that
+moment, so historical reads never rescan announced_pu_results.
+
+Results stored before snapshots were being taken can be turned into history
+once with backfill, which buckets them by date_entered.
+
+Usage:
+    python history.py run                  # take a snapshot every HISTORY_INTERVAL_SECONDS
+    python history.py record               # take one snapshot now
+    python history.py backfill             # build history from date_entered (empty history only)
+    python history.py totals --lga 19 --at "2011-05-20 21:00"
+"""
+import datetime
+import os
+import time
+from database import query_db, transaction
+
+HISTORY_INTERVAL_SECONDS = int(os.environ.get("HISTORY_INTERVAL_SECONDS", "300"))  # Time between snapshots
+HISTORY_MAX_POINTS = int(os.environ.get("HISTORY_MAX_POINTS", "2000"))             # Points returned per series
+HISTORY_LOCK_ID = 7340115 # pg_advisory_xact_lock key serialising snapshots
+
+# One statement, so the rollups, the head and the new rows all come from one database snapshot.
+# Pairs that disappeared from the rollups (all their results deleted) are recorded as 0.
+RECORD_SQL = """
+WITH changed AS (
+    SELECT COALESCE(c.lga_id, h.lga_id) AS lga_id,
+           COALESCE(c.party_abbreviation, h.party_abbreviation) AS party_abbreviation,
+           COALESCE(c.total_score, 0) AS total_score,
+           COALESCE(c.total_score, 0) - COALESCE(h.total_score, 0) AS delta
+    FROM rollup_lga_results c
+    FULL JOIN result_history_head h ON h.lga_id = c.lga_id AND h.party_abbreviation = c.party_abbreviation
+    WHERE COALESCE(c.total_score, 0) <> COALESCE(h.total_score, 0)
+),
+snapshot AS (
+    INSERT INTO result_snapshots (taken_at, changed)
+    SELECT statement_timestamp(), COUNT(*) FROM changed
+    RETURNING snapshot_id, taken_at, changed
+),
+history AS (
+    INSERT INTO result_history (lga_id, party_abbreviation, snapshot_id, total_score, delta)
+    SELECT c.lga_id, c.party_abbreviation, s.snapshot_id, c.total_score, c.delta
+    FROM changed c, snapshot s
+),
+head AS (
+    INSERT INTO result_history_head (lga_id, party_abbreviation, total_score)
+    SELECT lga_id, party_abbreviation, total_score FROM changed
+    ON CONFLICT (lga_id, party_abbreviation) DO UPDATE SET total_score = EXCLUDED.total_score
+)
+SELECT snapshot_id, taken_at, changed FROM snapshot;
+"""
+
+# Results bucketed by date_entered into HISTORY_INTERVAL_SECONDS steps; each bucket becomes one snapshot
+BACKFILL_SQL = """
+WITH buckets AS (
+    SELECT LEAST(date_bin(%(step)s * INTERVAL '1 second', r.date_entered, TIMESTAMP '2000-01-01')
+                 + %(step)s * INTERVAL '1 second', LOCALTIMESTAMP) AS taken_at,
+           pu.lga_id, r.party_abbreviation, SUM(r.party_score)::BIGINT AS delta
+    FROM announced_pu_results r
+    JOIN polling_unit pu ON pu.uniqueid = r.polling_unit_uniqueid
+    GROUP BY 1, 2, 3
+),
+snapshots AS (
+    INSERT INTO result_snapshots (taken_at, changed, source)
+    SELECT taken_at, COUNT(*), 'backfill' FROM buckets GROUP BY taken_at ORDER BY taken_at
+    RETURNING snapshot_id, taken_at
+),
+history AS (
+    INSERT INTO result_history (lga_id, party_abbreviation, snapshot_id, total_score, delta)
+    SELECT b.lga_id, b.party_abbreviation, s.snapshot_id,
+           SUM(b.delta) OVER (PARTITION BY b.lga_id, b.party_abbreviation ORDER BY b.taken_at), b.delta
+    FROM buckets b
+    JOIN snapshots s ON s.taken_at = b.taken_at
+)
+INSERT INTO result_history_head (lga_id, party_abbreviation, total_score)
+SELECT lga_id, party_abbreviation, SUM(delta) FROM buckets GROUP BY 1, 2;
+"""
+
+SNAPSHOT_AT_SQL = """
+SELECT snapshot_id, taken_at FROM result_snapshots
+WHERE taken_at <= %s
+ORDER BY taken_at DESC, snapshot_id DESC
+LIMIT 1;
+"""
+
+# The latest recorded total of each party of each LGA, up to a snapshot
+TOTALS_AT_SQL = """
+SELECT DISTINCT ON (lga_id, party_abbreviation) lga_id, party_abbreviation, total_score
+FROM result_history
+WHERE lga_id = ANY(%s) AND snapshot_id <= %s
+ORDER BY lga_id, party_abbreviation, snapshot_id DESC;
+"""
+
+CHANGES_SQL = """
+SELECT s.snapshot_id, s.taken_at, h.party_abbreviation, h.total_score
+FROM result_history h
+JOIN result_snapshots s ON s.snapshot_id = h.snapshot_id
+WHERE h.lga_id = %s AND h.snapshot_id > %s AND s.taken_at <= %s
+ORDER BY s.snapshot_id, h.party_abbreviation;
+"""
+
+
+def record_snapshot():
+    """
+    Appends the LGA/party totals that changed since the previous snapshot.
+
+    Returns:
+        dict: snapshot_id, taken_at and the number of changed totals.
+    """
+    with transaction() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(%s);", (HISTORY_LOCK_ID,))
+        cur.execute(RECORD_SQL)
+        return cur.fetchone()
+
+
+def backfill(step=HISTORY_INTERVAL_SECONDS):
+    """
+    Builds history from announced_pu_results.date_entered, one snapshot per step seconds.
+
+    Only runs while no snapshot exists, since the backfilled snapshots must come first.
+
+    Returns:
+        int: Number of snapshots created, or None if history already exists.
+    """
+    with transaction() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(%s);", (HISTORY_LOCK_ID,))
+        cur.execute("SELECT EXISTS (SELECT 1 FROM result_snapshots) AS present;")
+        if cur.fetchone()['present']:
+            return None
+        cur.execute(BACKFILL_SQL, {'step': step})
+        cur.execute("SELECT COUNT(*) AS n FROM result_snapshots;")
+        return cur.fetchone()['n']
+
+
+def snapshot_at(at):
+    """Returns the last snapshot (snapshot_id, taken_at) taken at or before a moment, or None."""
+    return query_db(SNAPSHOT_AT_SQL, (at,), fetchone=True, replica=True)
+
+
+def get_totals_at(lga_ids, at):
+    """
+    Returns the party totals of some LGAs as they were at a moment.
+
+    Args:
+        lga_ids (list): LGAs to report.
+        at (datetime): The moment; naive values are in the database's time zone.
+
+    Returns:
+        tuple: (snapshot, totals) where snapshot is the snapshot the totals come
+            from (None before the first one) and totals maps lga_id to {party: total}.
+    """
+    totals = {lga_id: {} for lga_id in lga_ids}
+    snapshot = snapshot_at(at)
+    if snapshot is None or not lga_ids:
+        return snapshot, totals
+    for row in query_db(TOTALS_AT_SQL, (list(lga_ids), snapshot['snapshot_id']), fetchall=True, replica=True):
+        if row['total_score']:
+            totals[row['lga_id']][row['party_abbreviation']] = row['total_score']
+    return snapshot, totals
+
+
+def get_series(lga_id, start=None, end=None, max_points=HISTORY_MAX_POINTS):
+    """
+    Returns how the party totals of an LGA progressed between two moments.
+
+    The first point holds the totals at start (when given); each further
+    point is a snapshot in which any of the LGA's totals changed.
+
+    Args:
+        lga_id (int): The LGA.
+        start (datetime): Beginning of the series; the first snapshot when None.
+        end (datetime): End of the series; now when None.
+        max_points (int): Return at most this many points.
+
+    Returns:
+        tuple: (points, truncated) where points is a list of dicts with
+            snapshot_id, at and totals ({party: total}).
+    """
+    end = end or datetime.datetime.now(datetime.timezone.utc)
+    base, totals, points = None, {}, []
+    if start is not None:
+        base, start_totals = get_totals_at([lga_id], start)
+        totals = start_totals[lga_id]
+        points.append({'snapshot_id': base['snapshot_id'] if base else None, 'at': start, 'totals': dict(totals)})
+
+    changes = query_db(CHANGES_SQL, (lga_id, base['snapshot_id'] if base else 0, end), fetchall=True, replica=True)
+    for row in changes:
+        if not points or row['snapshot_id'] != points[-1]['snapshot_id']:
+            if len(points) >= max_points:
+                return points, True
+            points.append({'snapshot_id': row['snapshot_id'], 'at': row['taken_at'], 'totals': None})
+        if row['total_score']:
+            totals[row['party_abbreviation']] = row['total_score']
+        else:
+            totals.pop(row['party_abbreviation'], None)
+        points[-1]['totals'] = dict(totals)
+    return points, False
+
+
+def run(interval=HISTORY_INTERVAL_SECONDS):
+    """Takes a snapshot at every multiple of interval seconds, forever."""
+    while True:
+        try:
+            snapshot = record_snapshot()
+            print(f"Snapshot {snapshot['snapshot_id']} at {snapshot['taken_at']}: {snapshot['changed']} totals changed")
+        except Exception as e:
+            print(f"History snapshot error: {e}")
+        time.sleep(interval - time.time() % interval)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Record and query historical LGA totals.")
+    parser.add_argument('command', choices=['run', 'record', 'backfill', 'totals'])
+    parser.add_argument('--lga', type=int, action='append', help="LGA to report (repeatable).")
+    parser.add_argument('--at', type=datetime.datetime.fromisoformat, help="Moment to report, e.g. '2011-05-20 21:00'.")
+    cli_args = parser.parse_args()
+
+    if cli_args.command == 'run':
+        print(f"Recording a snapshot every {HISTORY_INTERVAL_SECONDS}s...")
+        run()
+    elif cli_args.command == 'record':
+        print(record_snapshot())
+    elif cli_args.command == 'backfill':
+        created = backfill()
+        print("History already exists; nothing to backfill." if created is None else f"{created} snapshots created.")
+    else:
+        snapshot, totals = get_totals_at(cli_args.lga or [], cli_args.at or datetime.datetime.now(datetime.timezone.utc))
+        print(f"As of snapshot {snapshot['snapshot_id']} taken at {snapshot['taken_at']}" if snapshot else "No snapshot yet.")
+        for lga_id, parties in totals.items():
+            for party, total in sorted(parties.items(), key=lambda item: -item[1]):
+                print(f"{lga_id:6d}  {party:8s} {total:10d}")
@@ -0,0 +1,322 @@
+"""
+Bulk ingestion of polling unit results from CSV or JSON Lines files.
+
+Each input row carries one party score for one polling unit:
+
+    polling_unit_number, polling_unit_name, lga_id, ward_id,
+    party_abbreviation, party_score[, entered_by_user]
+
+Rows are validated against the party, lga and ward reference data while the
+file is streamed, and valid rows are loaded with COPY into a temporary staging
+table in fixed-size chunks. The staged rows are then merged into polling_unit
+and announced_pu_results in the same transaction, so a file is loaded
+completely or not at all. Memory use depends on the chunk size, not on the
+file size. Rejected rows are reported with their line number and reason.
+
+Usage:
+    python ingest.py results.csv [--state STATE_ID] [--format csv|jsonl] [--entered-by NAME] [--errors errors.csv]
+"""
+import csv
+import io
+import json
+from database import transaction
+from reference_data import DEFAULT_STATE_ID, get_parties, get_lgas, get_lga_wards, invalidate_reference_data
+
+INGEST_CHUNK_ROWS = 5000 # Rows buffered in memory before each COPY
+INGEST_FIELDS = [
+    'polling_unit_number', 'polling_unit_name', 'lga_id', 'ward_id',
+    'party_abbreviation', 'party_score', 'entered_by_user',
+]
+
+
+class IngestSummary:
+    """Counts for one ingestion run."""
+
+    def __init__(self):
+        self.rows_read = 0
+        self.rows_loaded = 0
+        self.polling_units_created = 0
+        self.errors = 0
+
+    def as_dict(self):
+        return {
+            'rows_read': self.rows_read,
+            'rows_loaded': self.rows_loaded,
+            'polling_units_created': self.polling_units_created,
+            'errors': self.errors,
+        }
+
+
+def iter_records(stream, fmt):
+    """
+    Yields (line_no, record) pairs from a text stream without reading it all.
+
+    Args:
+        stream: A text file object.
+        fmt (str): 'csv' (with a header row) or 'jsonl'.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'jsonl':
+        for line_no, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_no, ValueError(f"invalid JSON: {e}")
+                continue
+            yield line_no, record if isinstance(record, dict) else ValueError("expected a JSON object")
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+class _Validator:
+    """Checks records against the reference data (parties, LGAs of the state, wards per LGA)."""
+
+    def __init__(self, state_id=DEFAULT_STATE_ID):
+        # A party may be given by id or name; it is stored by name, as /q3 does
+        self.parties = {p['partyid']: p['partyname'] for p in get_parties()}
+        self.parties.update({p['partyname']: p['partyname'] for p in get_parties()})
+        self.lga_ids = {lga['lga_id'] for lga in get_lgas(state_id)}
+        self._ward_ids = {}
+
+    def ward_ids(self, lga_id):
+        if lga_id not in self._ward_ids:
+            self._ward_ids[lga_id] = {ward['ward_id'] for ward in get_lga_wards(lga_id)}
+        return self._ward_ids[lga_id]
+
+    def clean(self, record, default_entered_by):
+        """Returns the row as a tuple in INGEST_FIELDS order, or raises ValueError."""
+        def text(name, required=True):
+            value = record.get(name)
+            value = '' if value is None else str(value).strip()
+            if required and not value:
+                raise ValueError(f"{name} is required")
+            return value
+
+        def integer(name):
+            value = text(name)
+            try:
+                return int(value)
+            except ValueError:
+                raise ValueError(f"{name} must be an integer")
+
+        polling_unit_number = text('polling_unit_number')
+        if len(polling_unit_number) > 50:
+            raise ValueError("polling_unit_number is longer than 50 characters")
+        polling_unit_name = text('polling_unit_name', required=False)
+        lga_id = integer('lga_id')
+        ward_id = integer('ward_id')
+        party = text('party_abbreviation')
+        score = integer('party_score')
+        entered_by = text('entered_by_user', required=False) or default_entered_by
+
+        if lga_id not in self.lga_ids:
+            raise ValueError(f"unknown lga_id {lga_id}")
+        if ward_id not in self.ward_ids(lga_id):
+            raise ValueError(f"ward_id {ward_id} is not in lga_id {lga_id}")
+        if party not in self.parties:
+            raise ValueError(f"unknown party {party!r}")
+        party = self.parties[party]
+        if score < 0:
+            raise ValueError("party_score must not be negative")
+        if not entered_by:
+            raise ValueError("entered_by_user is required")
+        return (polling_unit_number, polling_unit_name[:50], lga_id, ward_id, party, score, entered_by[:50])
+
+
+def _copy_chunk(cur, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cur.copy_expert(
+        "COPY ingest_staging (line_no, " + ", ".join(INGEST_FIELDS) + ") FROM STDIN WITH (FORMAT csv);",
+        buffer
+    )
+
+
+def _reject(cur, sql, reason, on_error, summary):
+    """Runs a DELETE ... RETURNING line_no on the staging table and reports each row."""
+    cur.execute(sql)
+    for row in cur.fetchall():
+        summary.errors += 1
+        on_error(row['line_no'], reason)
+
+
+def ingest(stream, fmt='csv', entered_by='', ip_address='bulk-ingest', on_error=None, state_id=DEFAULT_STATE_ID):
+    """
+    Loads a results file in one transaction.
+
+    Args:
+        stream: A text file object to read from.
+        fmt (str): 'csv' or 'jsonl'.
+        entered_by (str): Default for rows without entered_by_user.
+        ip_address (str): Stored in user_ip_address of every new row.
+        on_error (callable): Called as on_error(line_no, message) for each rejected row.
+        state_id (int): State whose LGAs are accepted (defaults to DEFAULT_STATE_ID).
+
+    Returns:
+        IngestSummary: Counts of rows read, loaded, rejected and polling units created.
+    """
+    on_error = on_error or (lambda line_no, message: None)
+    summary = IngestSummary()
+    validator = _Validator(state_id)
+
+    with transaction() as cur:
+        cur.execute(
+            """
+            CREATE TEMP TABLE ingest_staging (
+              line_no INTEGER NOT NULL,
+              polling_unit_number TEXT NOT NULL,
+              polling_unit_name TEXT,
+              lga_id INTEGER NOT NULL,
+              ward_id INTEGER NOT NULL,
+              party_abbreviation TEXT NOT NULL,
+              party_score INTEGER NOT NULL,
+              entered_by_user TEXT NOT NULL
+            ) ON COMMIT DROP;
+            """
+        )
+
+        chunk = []
+        for line_no, record in iter_records(stream, fmt):
+            summary.rows_read += 1
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                chunk.append((line_no,) + validator.clean(record, entered_by))
+            except ValueError as e:
+                summary.errors += 1
+                on_error(line_no, str(e))
+                continue
+            if len(chunk) >= INGEST_CHUNK_ROWS:
+                _copy_chunk(cur, chunk)
+                chunk = []
+        if chunk:
+            _copy_chunk(cur, chunk)
+        cur.execute("ANALYZE ingest_staging;")
+
+        # One polling unit per polling_unit_number; its location comes from its first row
+        cur.execute(
+            """
+            CREATE TEMP TABLE ingest_units ON COMMIT DROP AS
+            SELECT DISTINCT ON (polling_unit_number)
+                   polling_unit_number, polling_unit_name, lga_id, ward_id, entered_by_user,
+                   NULL::INTEGER AS uniqueid, FALSE AS is_new
+            FROM ingest_staging
+            ORDER BY polling_unit_number, line_no;
+            """
+        )
+        _reject(cur, """
+            DELETE FROM ingest_staging s USING ingest_units u
+            WHERE s.polling_unit_number = u.polling_unit_number
+              AND (s.lga_id, s.ward_id) <> (u.lga_id, u.ward_id)
+            RETURNING s.line_no;
+            """, "lga_id/ward_id differ from earlier rows of this polling unit", on_error, summary)
+        _reject(cur, """
+            DELETE FROM ingest_staging s USING (
+                SELECT line_no, ROW_NUMBER() OVER (
+                    PARTITION BY polling_unit_number, party_abbreviation ORDER BY line_no) AS n
+                FROM ingest_staging
+            ) d
+            WHERE s.line_no = d.line_no AND d.n > 1
+            RETURNING s.line_no;
+            """, "duplicate party score for this polling unit in the file", on_error, summary)
+
+        # Attach to existing polling units at the same location (numbers repeat across LGAs and
+        # states), then allocate ids for the new ones from the sequence
+        cur.execute(
+            """
+            UPDATE ingest_units u SET uniqueid = pu.uniqueid
+            FROM (SELECT p.polling_unit_number, p.lga_id, p.ward_id, MIN(p.uniqueid) AS uniqueid
+                  FROM polling_unit p
+                  WHERE p.polling_unit_number IN (SELECT polling_unit_number FROM ingest_units)
+                  GROUP BY 1, 2, 3) pu
+            WHERE (pu.polling_unit_number, pu.lga_id, pu.ward_id) = (u.polling_unit_number, u.lga_id, u.ward_id);
+            """
+        )
+        cur.execute(
+            """
+            UPDATE ingest_units
+            SET uniqueid = nextval(pg_get_serial_sequence('polling_unit', 'uniqueid')), is_new = TRUE
+            WHERE uniqueid IS NULL;
+            """
+        )
+        _reject(cur, """
+            DELETE FROM ingest_staging s USING ingest_units u, announced_pu_results apr
+            WHERE s.polling_unit_number = u.polling_unit_number
+              AND apr.polling_unit_uniqueid = u.uniqueid
+              AND apr.party_abbreviation = s.party_abbreviation
+            RETURNING s.line_no;
+            """, "a result for this party is already recorded for this polling unit", on_error, summary)
+
+        cur.execute(
+            """
+            INSERT INTO polling_unit (
+                uniqueid, polling_unit_id, ward_id, lga_id, uniquewardid,
+                polling_unit_number, polling_unit_name, polling_unit_description,
+                entered_by_user, date_entered, user_ip_address
+            )
+            SELECT u.uniqueid, u.uniqueid, u.ward_id, u.lga_id,
+                   u.lga_id::text || '-' || u.ward_id::text || '-' || u.uniqueid::text,
+                   u.polling_unit_number, NULLIF(u.polling_unit_name, ''), '',
+                   u.entered_by_user, CURRENT_TIMESTAMP, %s
+            FROM ingest_units u
+            WHERE u.is_new
+              AND EXISTS (SELECT 1 FROM ingest_staging s WHERE s.polling_unit_number = u.polling_unit_number);
+            """,
+            (ip_address,)
+        )
+        summary.polling_units_created = cur.rowcount
+
+        # A single statement, so the rollup triggers fold the whole file in at once
+        cur.execute(
+            """
+            INSERT INTO announced_pu_results (
+                polling_unit_uniqueid, party_abbreviation, party_score,
+                entered_by_user, date_entered, user_ip_address
+            )
+            SELECT u.uniqueid, s.party_abbreviation, s.party_score,
+                   s.entered_by_user, CURRENT_TIMESTAMP, %s
+            FROM ingest_staging s
+            JOIN ingest_units u ON u.polling_unit_number = s.polling_unit_number
+            ORDER BY s.line_no;
+            """,
+            (ip_address,)
+        )
+        summary.rows_loaded = cur.rowcount
+
+    invalidate_reference_data()
+    return summary
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Bulk-load polling unit results from CSV or JSON Lines.")
+    parser.add_argument('path', help="File to load ('-' for standard input).")
+    parser.add_argument('--state', type=int, default=DEFAULT_STATE_ID, help="State whose LGAs the rows belong to.")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension.")
+    parser.add_argument('--entered-by', default='', help="Default entered_by_user for rows without one.")
+    parser.add_argument('--errors', help="Write rejected rows (line_no, error) to this CSV file.")
+    cli_args = parser.parse_args()
+
+    fmt = cli_args.format or ('jsonl' if cli_args.path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    error_file = open(cli_args.errors, 'w', newline='', encoding='utf-8') if cli_args.errors else None
+    error_writer = csv.writer(error_file if error_file else sys.stderr)
+    error_writer.writerow(['line_no', 'error'])
+
+    source = sys.stdin if cli_args.path == '-' else open(cli_args.path, newline='', encoding='utf-8-sig')
+    try:
+        result = ingest(source, fmt, entered_by=cli_args.entered_by, state_id=cli_args.state,
+                        on_error=lambda line_no, message: error_writer.writerow([line_no, message]))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if error_file:
+            error_file.close()
+    print(json.dumps(result.as_dict()))
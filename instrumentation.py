@@ -0,0 +1,197 @@
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+# --- Request Instrumentation ---
+# Every request collects how many queries, pool checkouts, new connections and
+# rows it used, and how long it spent connecting, executing, fetching and
+# rendering. The numbers go out as a Server-Timing header on the response and
+# are accumulated per route for the Prometheus-style /metrics endpoint.
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "500"))          # Log statements slower than this
+SLOW_QUERY_EXPLAIN = os.environ.get("SLOW_QUERY_EXPLAIN", "1") == "1"  # Attach EXPLAIN output to the log
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "1") == "1"
+
+PHASES = ('connect', 'execute', 'fetch', 'render')
+COUNTERS = ('queries', 'checkouts', 'connections', 'rows')
+# Upper bounds (seconds) of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+slow_query_log = logging.getLogger('slow_queries')
+
+
+class RequestStats:
+    """Counters and phase timings for one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+
+
+_current = ContextVar('request_stats', default=None)
+
+
+def start_request():
+    """Begins collecting stats for the current request; returns the stats object."""
+    stats = RequestStats()
+    _current.set(stats)
+    return stats
+
+
+def current_stats():
+    """Returns the stats of the request being served, or None outside a request."""
+    return _current.get()
+
+
+def record(phase=None, seconds=0.0, **counts):
+    """Adds time to a phase and/or increments counters of the current request, if any."""
+    stats = _current.get()
+    if stats is None:
+        return
+    if phase:
+        stats.seconds[phase] += seconds
+    for name, value in counts.items():
+        stats.counts[name] += value
+
+
+def log_slow_query(query, args, seconds, explain=None):
+    """
+    Logs a statement that took longer than SLOW_QUERY_MS.
+
+    Args:
+        query (str): The SQL text.
+        args: The statement parameters.
+        seconds (float): Time the statement took.
+        explain (callable): Returns EXPLAIN output for the statement; only called
+            when SLOW_QUERY_EXPLAIN is enabled.
+    """
+    plan = ""
+    if SLOW_QUERY_EXPLAIN and explain is not None:
+        try:
+            plan = "\n" + explain()
+        except Exception as e:
+            plan = f"\n(EXPLAIN failed: {e})"
+    slow_query_log.warning(
+        "Slow query (%.1f ms): %s\nParameters: %r%s",
+        seconds * 1000, " ".join(str(query).split()), args, plan
+    )
+
+
+class _Metrics:
+    """Per-route totals since the worker started, rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = {}   # (route, method, status) -> count
+        self._routes = {}     # route -> {'count', 'seconds', 'buckets', phases..., counters...}
+
+    def observe(self, route, method, status, stats, duration):
+        with self._lock:
+            key = (route, method, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            totals = self._routes.setdefault(route, {
+                'count': 0, 'seconds': 0.0, 'buckets': [0] * len(DURATION_BUCKETS),
+                'phases': dict.fromkeys(PHASES, 0.0), 'counters': dict.fromkeys(COUNTERS, 0),
+            })
+            totals['count'] += 1
+            totals['seconds'] += duration
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    totals['buckets'][i] += 1
+            for phase in PHASES:
+                totals['phases'][phase] += stats.seconds[phase]
+            for name in COUNTERS:
+                totals['counters'][name] += stats.counts[name]
+
+    def render(self):
+        worker = os.getpid()
+        lines = [
+            "# HELP http_requests_total Requests served by this worker.",
+            "# TYPE http_requests_total counter",
+        ]
+        with self._lock:
+            for (route, method, status), count in sorted(self._requests.items()):
+                lines.append(f'http_requests_total{{worker="{worker}",route="{route}",method="{method}",status="{status}"}} {count}')
+
+            lines += [
+                "# HELP http_request_duration_seconds Request latency by route.",
+                "# TYPE http_request_duration_seconds histogram",
+            ]
+            for route, totals in sorted(self._routes.items()):
+                labels = f'worker="{worker}",route="{route}"'
+                for bound, count in zip(DURATION_BUCKETS, totals['buckets']):
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {totals["count"]}')
+                lines.append(f'http_request_duration_seconds_sum{{{labels}}} {totals["seconds"]:.6f}')
+                lines.append(f'http_request_duration_seconds_count{{{labels}}} {totals["count"]}')
+
+            lines += [
+                "# HELP request_phase_seconds_total Time spent per phase (connect, execute, fetch, render).",
+                "# TYPE request_phase_seconds_total counter",
+            ]
+            for route, totals in sorted(self._routes.items()):
+                for phase, seconds in totals['phases'].items():
+                    lines.append(f'request_phase_seconds_total{{worker="{worker}",route="{route}",phase="{phase}"}} {seconds:.6f}')
+
+            lines += [
+                "# HELP db_operations_total Queries, pool checkouts, new connections and rows fetched.",
+                "# TYPE db_operations_total counter",
+            ]
+            for route, totals in sorted(self._routes.items()):
+                for name, value in totals['counters'].items():
+                    lines.append(f'db_operations_total{{worker="{worker}",route="{route}",kind="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = _Metrics()
+
+
+def server_timing_header(stats, duration):
+    """Formats a request's stats as a Server-Timing header value."""
+    parts = [f"db-{phase};dur={stats.seconds[phase] * 1000:.2f}" for phase in ('connect', 'execute', 'fetch')]
+    parts.append(f"render;dur={stats.seconds['render'] * 1000:.2f}")
+    parts.append(f"total;dur={duration * 1000:.2f}")
+    counts = " ".join(f"{name}={stats.counts[name]}" for name in COUNTERS)
+    parts.append(f'db;desc="{counts}"')
+    return ", ".join(parts)
+
+
+def init_app(app):
+    """Wires request stats, template render timing, Server-Timing and /metrics into a Flask app."""
+    from flask import Response, request, before_render_template, template_rendered, g
+
+    @app.before_request
+    def _start_request_stats():
+        start_request()
+
+    def _render_started(sender, template, context, **extra):
+        g._render_started = time.perf_counter()
+
+    def _render_finished(sender, template, context, **extra):
+        started = g.pop('_render_started', None)
+        if started is not None:
+            record('render', time.perf_counter() - started)
+
+    # weak=False: the receivers are local functions that would otherwise be garbage collected
+    before_render_template.connect(_render_started, app, weak=False)
+    template_rendered.connect(_render_finished, app, weak=False)
+
+    @app.after_request
+    def _finish_request_stats(response):
+        stats = current_stats()
+        if stats is None:
+            return response
+        duration = time.perf_counter() - stats.started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        if route != '/metrics':
+            metrics.observe(route, request.method, response.status_code, stats, duration)
+        if SERVER_TIMING:
+            response.headers['Server-Timing'] = server_timing_header(stats, duration)
+        return response
+
+    @app.route('/metrics')
+    def metrics_page():
+        """Prometheus-style metrics of this worker process."""
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
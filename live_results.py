@@ -0,0 +1,201 @@
+"""
+Live per-LGA party totals pushed to dashboard viewers.
+
+One listener thread per worker process holds a dedicated connection that
+LISTENs on the rollup trigger channel. It loads the LGA totals once, applies
+each committed delta to that shared copy and fans the delta out to every
+subscribed viewer, so any number of viewers costs one query plus one
+notification stream per worker instead of a GROUP BY per refresh.
+
+The same stream versions each LGA's totals for the response cache: see
+lga_version().
+
+Events handed to subscribers are (event, data) pairs:
+
+    ('snapshot', {'totals': {lga_id: {party: total}}})   # sent first and after a resync
+    ('delta', {'at': ..., 'deltas': [{'lga_id', 'party', 'score'}, ...]})
+"""
+import json
+import os
+import queue
+import select
+import threading
+import time
+from database import get_db_connection
+from rollups import RESULTS_CHANNEL
+
+LIVE_HEARTBEAT_SECONDS = float(os.environ.get("LIVE_HEARTBEAT_SECONDS", "15"))  # Keep-alive comment interval
+LIVE_SUBSCRIBER_QUEUE = int(os.environ.get("LIVE_SUBSCRIBER_QUEUE", "256"))     # Events buffered per viewer
+LIVE_RECONNECT_SECONDS = 2.0
+# Each open stream holds a gthread worker thread, so at most this many are served per worker
+# (half the threads by default), leaving the rest for ordinary requests
+LIVE_MAX_STREAMS = int(os.environ.get("LIVE_MAX_STREAMS", str(max(int(os.environ.get("GUNICORN_THREADS", "8")) // 2, 1))))
+LIVE_BUSY_RETRY_SECONDS = 30 # Retry-After sent to viewers turned away at the cap
+
+
+class ResultsBroadcaster:
+    """Keeps the shared LGA totals current from NOTIFY and fans changes out to subscribers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}        # lga_id -> {party: total}
+        self._subscribers = {}   # queue.Queue -> set of lga_ids
+        self._versions = {}      # lga_id -> number of deltas applied since the last reload
+        self._epoch = 0          # Bumped on every reload, which invalidates every version
+        self._listening = False
+        self._thread = None
+        self._pid = None
+
+    def _ensure_listener(self):
+        """Starts the listener thread in this process (again after a fork)."""
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid:
+            return
+        self._pid = pid
+        self._subscribers = {}
+        self._listening = False
+        self._thread = threading.Thread(target=self._listen_forever, name="live-results", daemon=True)
+        self._thread.start()
+
+    def subscribe(self, lga_ids):
+        """
+        Registers a viewer of some LGAs.
+
+        Args:
+            lga_ids (iterable): LGAs whose totals the viewer shows.
+
+        Returns:
+            queue.Queue: Receives (event, data) pairs, starting with a snapshot.
+        """
+        lga_ids = set(lga_ids)
+        subscriber = queue.Queue(maxsize=LIVE_SUBSCRIBER_QUEUE)
+        with self._lock:
+            self._ensure_listener()
+            self._subscribers[subscriber] = lga_ids
+            subscriber.put_nowait(('snapshot', self._snapshot_for(lga_ids)))
+        return subscriber
+
+    def lga_version(self, lga_id):
+        """
+        Returns a value that changes whenever the totals of an LGA change.
+
+        Returns None while this process is not listening (e.g. just after
+        start-up or while reconnecting), when changes could go unnoticed and
+        nothing derived from the totals should be cached.
+        """
+        with self._lock:
+            self._ensure_listener()
+            if not self._listening:
+                return None
+            return self._epoch, self._versions.get(lga_id, 0)
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.pop(subscriber, None)
+
+    def _snapshot_for(self, lga_ids):
+        return {'totals': {lga_id: dict(self._totals.get(lga_id, {})) for lga_id in lga_ids}}
+
+    def _send(self, subscriber, event):
+        try:
+            subscriber.put_nowait(event)
+        except queue.Full:
+            # A viewer that stopped reading is dropped; its browser reconnects and gets a fresh snapshot
+            self._subscribers.pop(subscriber, None)
+            with subscriber.mutex:
+                subscriber.queue.clear()
+            subscriber.put_nowait(('close', None))
+
+    def _reload(self, cur):
+        """Reloads every LGA total and sends each subscriber a fresh snapshot."""
+        cur.execute("SELECT lga_id, party_abbreviation, total_score FROM rollup_lga_results;")
+        totals = {}
+        for lga_id, party, total in cur.fetchall():
+            totals.setdefault(lga_id, {})[party] = total
+        with self._lock:
+            self._totals = totals
+            self._versions = {}
+            self._epoch += 1
+            self._listening = True
+            for subscriber, lga_ids in list(self._subscribers.items()):
+                self._send(subscriber, ('snapshot', self._snapshot_for(lga_ids)))
+
+    def _apply(self, payload):
+        """Folds one notification into the totals and forwards it to interested subscribers."""
+        with self._lock:
+            for delta in payload['deltas']:
+                parties = self._totals.setdefault(delta['lga_id'], {})
+                parties[delta['party']] = parties.get(delta['party'], 0) + delta['score']
+                self._versions[delta['lga_id']] = self._versions.get(delta['lga_id'], 0) + 1
+            for subscriber, lga_ids in list(self._subscribers.items()):
+                deltas = [d for d in payload['deltas'] if d['lga_id'] in lga_ids]
+                if deltas:
+                    self._send(subscriber, ('delta', {'at': payload.get('at'), 'deltas': deltas}))
+
+    def _listen_forever(self):
+        while True:
+            try:
+                self._listen()
+            except Exception as e:
+                print(f"Live results listener error: {e}")
+            time.sleep(LIVE_RECONNECT_SECONDS)
+
+    def _listen(self):
+        conn = get_db_connection()
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                # LISTEN first, so no delta committed during the reload is missed
+                cur.execute(f"LISTEN {RESULTS_CHANNEL};")
+                self._reload(cur)
+                while True:
+                    if select.select([conn], [], [], LIVE_HEARTBEAT_SECONDS) == ([], [], []):
+                        cur.execute("SELECT 1;") # Detects a dead connection while idle
+                        continue
+                    conn.poll()
+                    notifies, conn.notifies[:] = list(conn.notifies), []
+                    for notify in notifies:
+                        payload = json.loads(notify.payload)
+                        if payload.get('resync'):
+                            self._reload(cur)
+                        else:
+                            self._apply(payload)
+        finally:
+            with self._lock:
+                self._listening = False
+            conn.close()
+
+
+broadcaster = ResultsBroadcaster()
+
+
+def sse_message(event, data):
+    """Formats one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+# Taken by the view before a stream starts and released when its response is closed
+stream_slots = threading.BoundedSemaphore(LIVE_MAX_STREAMS)
+
+
+def event_stream(lga_ids):
+    """
+    Yields Server-Sent Events for a viewer of some LGAs until the client goes away.
+
+    A comment line is sent every LIVE_HEARTBEAT_SECONDS without events, so
+    proxies keep the connection open and a closed client is noticed.
+    """
+    subscriber = broadcaster.subscribe(lga_ids)
+    try:
+        yield f"retry: {int(LIVE_RECONNECT_SECONDS * 1000)}\n\n"
+        while True:
+            try:
+                event, data = subscriber.get(timeout=LIVE_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if event == 'close':
+                return
+            yield sse_message(event, data)
+    finally:
+        broadcaster.unsubscribe(subscriber)
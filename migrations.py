@@ -0,0 +1,302 @@
+"""
+Versioned schema migrations for an existing election results database.
+
+Applied versions are recorded in schema_migrations, so running upgrade again
+only applies what is missing. Index migrations use CREATE INDEX CONCURRENTLY,
+so they can be applied to a live database without blocking writes.
+
+Usage:
+    python migrations.py status    # list migrations and whether they are applied
+    python migrations.py upgrade   # apply every pending migration in order
+    python migrations.py verify    # EXPLAIN the hot queries and flag sequential scans
+"""
+import json
+from database import get_db_connection
+from rollups import ROLLUP_TABLES_SQL, ROLLUP_TRIGGERS_SQL, REBUILD_SQL
+
+# Each migration is (version, name, statements, transactional).
+# Non-transactional migrations run each statement in autocommit mode, which
+# CREATE INDEX CONCURRENTLY requires.
+MIGRATIONS = [
+    (1, 'hot join key indexes', [
+        # /q1 results lookup and the has-results check: index-only on polling unit id
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_apr_polling_unit
+           ON announced_pu_results (polling_unit_uniqueid) INCLUDE (party_abbreviation, party_score);""",
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_polling_unit_lga_ward
+           ON polling_unit (lga_id, ward_id);""",
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_polling_unit_ward
+           ON polling_unit (ward_id);""",
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ward_lga_ward
+           ON ward (lga_id, ward_id) INCLUDE (ward_name);""",
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ward_ward_id
+           ON ward (ward_id) INCLUDE (ward_name, lga_id);""",
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_lga_lga_id
+           ON lga (lga_id) INCLUDE (lga_name, state_id);""",
+        # LGA dropdown: WHERE state_id = ? ORDER BY lga_name, answered from the index alone
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_lga_state_name
+           ON lga (state_id, lga_name) INCLUDE (lga_id);""",
+    ], False),
+    (2, 'polling unit search indexes', [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm;",
+        # Trigram indexes serve both prefix and substring ILIKE searches in /api/polling-units
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_polling_unit_name_trgm
+           ON polling_unit USING gin (polling_unit_name gin_trgm_ops);""",
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ward_name_trgm
+           ON ward USING gin (ward_name gin_trgm_ops);""",
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_lga_name_trgm
+           ON lga USING gin (lga_name gin_trgm_ops);""",
+        # Keyset pagination order of the picker
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_polling_unit_sort
+           ON polling_unit ((COALESCE(polling_unit_name, '')), uniqueid);""",
+    ], False),
+    (3, 'submission queue', [
+        # Durable intake of /q3 submissions, applied by submissions.py workers
+        """CREATE TABLE IF NOT EXISTS submission_queue (
+             id BIGSERIAL PRIMARY KEY,
+             idempotency_key VARCHAR(100) NOT NULL UNIQUE,
+             payload JSONB NOT NULL,
+             status VARCHAR(10) NOT NULL DEFAULT 'pending', -- pending, applied or failed
+             polling_unit_uniqueid INTEGER,
+             error TEXT,
+             attempts INTEGER NOT NULL DEFAULT 0,
+             created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+             applied_at TIMESTAMP
+           );""",
+        """CREATE INDEX IF NOT EXISTS idx_submission_queue_pending
+           ON submission_queue (id) WHERE status = 'pending';""",
+    ], True),
+    (4, 'result history', [
+        # Append-only per-LGA, per-party totals recorded by history.py
+        """CREATE TABLE IF NOT EXISTS result_snapshots (
+             snapshot_id BIGSERIAL PRIMARY KEY,
+             taken_at TIMESTAMP NOT NULL,
+             changed INTEGER NOT NULL,
+             source VARCHAR(10) NOT NULL DEFAULT 'live' -- live or backfill
+           );""",
+        """CREATE INDEX IF NOT EXISTS idx_result_snapshots_taken_at
+           ON result_snapshots (taken_at) INCLUDE (snapshot_id);""",
+        # Only the LGA/party totals that changed since the previous snapshot
+        """CREATE TABLE IF NOT EXISTS result_history (
+             lga_id INTEGER NOT NULL,
+             party_abbreviation VARCHAR(255) NOT NULL,
+             snapshot_id BIGINT NOT NULL REFERENCES result_snapshots (snapshot_id),
+             total_score BIGINT NOT NULL,
+             delta BIGINT NOT NULL,
+             PRIMARY KEY (lga_id, party_abbreviation, snapshot_id)
+           );""",
+        # The totals as of the latest snapshot, compared with the rollups by the next one
+        """CREATE TABLE IF NOT EXISTS result_history_head (
+             lga_id INTEGER NOT NULL,
+             party_abbreviation VARCHAR(255) NOT NULL,
+             total_score BIGINT NOT NULL,
+             PRIMARY KEY (lga_id, party_abbreviation)
+           );""",
+    ], True),
+    (5, 'reconciliation', [
+        # Stored comparison of summed polling unit results with announced LGA results (reconcile.py)
+        """CREATE TABLE IF NOT EXISTS reconciliation_results (
+             lga_id INTEGER NOT NULL,
+             party_key VARCHAR(4) NOT NULL,
+             pu_total BIGINT,
+             announced_total BIGINT,
+             computed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+             PRIMARY KEY (lga_id, party_key)
+           );""",
+        """CREATE TABLE IF NOT EXISTS reconciliation_marker (
+             id INTEGER PRIMARY KEY CHECK (id = 1),
+             pu_signature TEXT NOT NULL,
+             announced_signature TEXT NOT NULL,
+             ran_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+           );""",
+    ], True),
+    (6, 'polling unit number index', [
+        # ingest.py matches existing polling units on number and location
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_polling_unit_number
+           ON polling_unit (polling_unit_number, lga_id, ward_id) INCLUDE (uniqueid);""",
+    ], False),
+    (7, 'submission payload hash', [
+        # Lets a replayed idempotency key be told apart from a reused one
+        "ALTER TABLE submission_queue ADD COLUMN IF NOT EXISTS payload_hash CHAR(64);",
+    ], True),
+    (8, 'rollup tables and triggers', [
+        # Precomputed totals behind /q2, the live dashboard and reconciliation (see rollups.py),
+        # filled from the existing results in the same transaction
+        ROLLUP_TABLES_SQL,
+        ROLLUP_TRIGGERS_SQL,
+        REBUILD_SQL,
+    ], True),
+]
+
+# Representative hot queries checked by verify: (label, sql, args, relations that must not be seq-scanned)
+VERIFY_QUERIES = [
+    ('q1 polling unit results',
+     "SELECT party_abbreviation, party_score FROM announced_pu_results WHERE polling_unit_uniqueid = %s ORDER BY party_abbreviation;",
+     (8,), ['announced_pu_results']),
+    ('q1 polling unit details',
+     """SELECT pu.polling_unit_name, l.lga_name, w.ward_name
+        FROM polling_unit pu
+        JOIN lga l ON pu.lga_id = l.lga_id
+        LEFT JOIN LATERAL (
+            SELECT ward_name FROM ward
+            WHERE ward.ward_id = pu.ward_id AND ward.lga_id = pu.lga_id
+            ORDER BY ward.uniqueid
+            LIMIT 1
+        ) w ON TRUE
+        WHERE pu.uniqueid = %s;""",
+     (8,), ['polling_unit', 'lga', 'ward']),
+    ('q1/q2 LGA dropdown',
+     "SELECT lga_id, lga_name FROM lga WHERE state_id = %s ORDER BY lga_name;",
+     (25,), ['lga']),
+    ('q2 LGA aggregation over polling units',
+     """SELECT apr.party_abbreviation, SUM(apr.party_score) AS total_score
+        FROM polling_unit pu
+        JOIN announced_pu_results apr ON apr.polling_unit_uniqueid = pu.uniqueid
+        WHERE pu.lga_id = %s
+        GROUP BY apr.party_abbreviation;""",
+     (17,), ['polling_unit', 'announced_pu_results']),
+    ('q1 polling unit search',
+     "SELECT uniqueid FROM polling_unit WHERE polling_unit_name ILIKE %s;",
+     ('%primary%',), ['polling_unit']),
+    ('q3 wards of an LGA',
+     "SELECT ward_id, ward_name FROM ward WHERE lga_id = %s ORDER BY ward_name;",
+     (17,), ['ward']),
+]
+
+
+def _ensure_migrations_table(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+          version INTEGER PRIMARY KEY,
+          name VARCHAR(255) NOT NULL,
+          applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+
+
+def applied_versions(conn):
+    """Returns the set of migration versions already recorded in the database."""
+    with conn.cursor() as cur:
+        _ensure_migrations_table(cur)
+        cur.execute("SELECT version FROM schema_migrations;")
+        return {row[0] for row in cur.fetchall()}
+
+
+def _drop_invalid_index(cur, statement):
+    """Drops a half-built index left behind by a failed CREATE INDEX CONCURRENTLY."""
+    words = statement.split()
+    if 'CONCURRENTLY' not in words or 'EXISTS' not in words:
+        return
+    index_name = words[words.index('EXISTS') + 1]
+    cur.execute(
+        """
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND NOT i.indisvalid;
+        """,
+        (index_name,)
+    )
+    if cur.fetchone():
+        print(f"  dropping invalid index {index_name} from an earlier failed build")
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name};")
+
+
+def upgrade():
+    """Applies every pending migration in version order."""
+    conn = get_db_connection()
+    try:
+        conn.autocommit = True
+        done = applied_versions(conn)
+        for version, name, statements, transactional in MIGRATIONS:
+            if version in done:
+                continue
+            print(f"Applying migration {version}: {name}")
+            with conn.cursor() as cur:
+                if transactional:
+                    cur.execute("BEGIN;")
+                for statement in statements:
+                    if not transactional:
+                        _drop_invalid_index(cur, statement)
+                    cur.execute(statement)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES (%s, %s);",
+                    (version, name)
+                )
+                if transactional:
+                    cur.execute("COMMIT;")
+        # Fresh statistics so the planner actually picks the new indexes
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE polling_unit, announced_pu_results, ward, lga;")
+    finally:
+        conn.close()
+
+
+def status():
+    """Prints each known migration and whether it has been applied."""
+    conn = get_db_connection()
+    try:
+        conn.autocommit = True
+        done = applied_versions(conn)
+    finally:
+        conn.close()
+    for version, name, _, _ in MIGRATIONS:
+        print(f"{version:4d}  {'applied' if version in done else 'pending':8s}  {name}")
+
+
+def _plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from _plan_nodes(child)
+
+
+def verify():
+    """
+    EXPLAINs the hot queries and reports any sequential scan on a checked table.
+
+    Sequential scans are disabled for the check, so small development tables
+    are judged by whether a usable index exists rather than by what the planner
+    prefers at their current size.
+
+    Returns:
+        bool: True if every query can be answered through indexes.
+    """
+    conn = get_db_connection()
+    ok = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL enable_seqscan = off;")
+            for label, sql, args, relations in VERIFY_QUERIES:
+                cur.execute("EXPLAIN (FORMAT JSON) " + sql, args)
+                plan = cur.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                nodes = list(_plan_nodes(plan[0]['Plan']))
+                seq_scans = sorted({n['Relation Name'] for n in nodes
+                                    if n['Node Type'] == 'Seq Scan' and n.get('Relation Name') in relations})
+                indexes = sorted({n['Index Name'] for n in nodes if 'Index Name' in n})
+                if seq_scans:
+                    ok = False
+                    print(f"FAIL  {label}: sequential scan on {', '.join(seq_scans)}")
+                else:
+                    print(f"ok    {label}: {', '.join(indexes) or 'no index needed'}")
+        conn.rollback()
+    finally:
+        conn.close()
+    return ok
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Apply and verify schema migrations.")
+    parser.add_argument('command', choices=['status', 'upgrade', 'verify'])
+    cli_args = parser.parse_args()
+
+    if cli_args.command == 'upgrade':
+        upgrade()
+        print("Database is up to date.")
+    elif cli_args.command == 'status':
+        status()
+    else:
+        sys.exit(0 if verify() else 1)
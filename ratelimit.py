@@ -0,0 +1,217 @@
+import math
+import os
+import threading
+import time
+
+try:
+    import redis # Optional: only needed when RATE_LIMIT_REDIS_URL is set
+except ImportError:
+    redis = None
+
+from psycopg_pool import PoolTimeout as AsyncPoolTimeout
+from database import PoolTimeout
+
+# --- Rate Limiting and Admission Control ---
+# Routes listed in the rules passed to init_app() are guarded before the view
+# runs, cheapest check first:
+#   1. a token bucket per client IP and route, and one per route for all clients
+#      (429 Too Many Requests with Retry-After when either is empty; a token is
+#      only taken from them when both have one, so rejected requests cost nothing);
+#   2. a per-process semaphore bounding how many guarded requests use the
+#      database at once (503 Service Unavailable with Retry-After if no slot
+#      frees up within ADMISSION_WAIT seconds).
+# Buckets live in process memory, or in Redis (or any server speaking its
+# protocol) when RATE_LIMIT_REDIS_URL is set, so that all gunicorn workers
+# share them. Running out of pooled connections anywhere also answers 503.
+RATE_LIMITS_ENABLED = os.environ.get("RATE_LIMITS", "1") == "1"
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL", "")
+RATE_LIMIT_PROXY_HOPS = int(os.environ.get("RATE_LIMIT_PROXY_HOPS", "0"))        # Trusted proxies adding X-Forwarded-For
+ADMISSION_MAX_CONCURRENT = int(os.environ.get("ADMISSION_MAX_CONCURRENT", os.environ.get("DB_POOL_MAX_SIZE", "10")))
+ADMISSION_WAIT = float(os.environ.get("ADMISSION_WAIT", "0.25"))                  # Seconds to wait for a slot
+ADMISSION_RETRY_AFTER = 1                                                         # Seconds suggested to rejected clients
+
+
+class Rule:
+    """
+    Limits for one route.
+
+    Limits are written as 'COUNT/SECONDS', e.g. '30/60': up to 30 requests in a
+    burst, refilled at 30 per 60 seconds.
+
+    Args:
+        per_ip (str): Limit for each client IP, or None.
+        per_route (str): Limit for all clients together, or None.
+        admission (bool): Also take a slot of the admission semaphore.
+    """
+
+    def __init__(self, per_ip=None, per_route=None, admission=True):
+        self.per_ip = parse_limit(per_ip)
+        self.per_route = parse_limit(per_route)
+        self.admission = admission
+
+
+def parse_limit(limit):
+    """Returns (tokens per second, burst) for a 'COUNT/SECONDS' string, or None."""
+    if not limit:
+        return None
+    count, seconds = limit.split('/')
+    return float(count) / float(seconds), float(count)
+
+
+class MemoryStore:
+    """Token buckets in this process's memory."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {} # key -> (tokens, updated_at)
+        self._next_prune = time.monotonic() + 60
+
+    def take(self, buckets):
+        """
+        Takes one token from every bucket, or from none of them if any is empty.
+
+        Args:
+            buckets (list): (key, rate, burst) of each bucket.
+
+        Returns:
+            tuple: (allowed, seconds until every bucket has a token).
+        """
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for key, rate, burst in buckets:
+                tokens, updated_at = self._buckets.get(key, (burst, now))
+                levels.append((key, min(burst, tokens + (now - updated_at) * rate), rate))
+            retry_after = max([(1 - tokens) / rate for _, tokens, rate in levels if tokens < 1], default=0.0)
+            allowed = retry_after == 0.0
+            for key, tokens, _ in levels:
+                self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+            if now >= self._next_prune:
+                self._prune(now)
+        return allowed, retry_after
+
+    def _prune(self, now):
+        # A bucket untouched for 10 minutes is full again for every limit in use; forget it
+        self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < 600}
+        self._next_prune = now + 60
+
+
+# Refill every bucket, then take a token from all of them only if each has one, atomically
+# on the server. ARGV is now followed by rate and burst of each key; a key expires once
+# its bucket would be full.
+_TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local levels = {}
+local retry_after = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'updated_at')
+    local tokens = tonumber(state[1]) or burst
+    local updated_at = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+    if tokens < 1 then
+        retry_after = math.max(retry_after, (1 - tokens) / rate)
+    end
+    levels[i] = tokens
+end
+local allowed = 0
+if retry_after == 0 then
+    allowed = 1
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    redis.call('HSET', key, 'tokens', tostring(levels[i] - allowed), 'updated_at', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return {allowed, tostring(retry_after)}
+"""
+
+
+class RedisStore:
+    """Token buckets in Redis, shared by every worker using the same server."""
+
+    def __init__(self, url):
+        self._client = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+        self._take = self._client.register_script(_TAKE_SCRIPT)
+
+    def take(self, buckets):
+        args = [time.time()]
+        for _, rate, burst in buckets:
+            args += [rate, burst]
+        try:
+            allowed, retry_after = self._take(keys=[f"ratelimit:{key}" for key, _, _ in buckets], args=args)
+        except redis.RedisError as e:
+            print(f"Rate limit store error, allowing the request: {e}")
+            return True, 0.0 # Fail open: an unavailable limiter must not take the site down
+        return bool(allowed), float(retry_after)
+
+
+def make_store():
+    """Returns a RedisStore when RATE_LIMIT_REDIS_URL is set (and redis is installed), else a MemoryStore."""
+    if RATE_LIMIT_REDIS_URL:
+        if redis is not None:
+            return RedisStore(RATE_LIMIT_REDIS_URL)
+        print("RATE_LIMIT_REDIS_URL is set but the redis package is not installed; using per-process limits.")
+    return MemoryStore()
+
+
+def client_ip(request):
+    """The client address, taken from X-Forwarded-For only as far as RATE_LIMIT_PROXY_HOPS trusted proxies."""
+    if RATE_LIMIT_PROXY_HOPS and len(request.access_route) >= RATE_LIMIT_PROXY_HOPS:
+        return request.access_route[-RATE_LIMIT_PROXY_HOPS]
+    return request.remote_addr
+
+
+def init_app(app, rules, store=None):
+    """
+    Guards the routes of a Flask app.
+
+    Args:
+        app: The Flask app.
+        rules (dict): (endpoint, method) -> Rule.
+        store: Bucket store; make_store() by default.
+    """
+    from flask import request, g, jsonify
+
+    store = store or make_store()
+    admission = threading.BoundedSemaphore(max(ADMISSION_MAX_CONCURRENT, 1))
+
+    def reject(status, message, retry_after):
+        response = jsonify(error=message) if request.path.startswith('/api/') else app.response_class(message, mimetype='text/plain')
+        response.status_code = status
+        response.headers['Retry-After'] = str(max(int(math.ceil(retry_after)), 1))
+        return response
+
+    @app.before_request
+    def _limit_request():
+        if not RATE_LIMITS_ENABLED:
+            return None
+        rule = rules.get((request.endpoint, request.method))
+        if rule is None:
+            return None
+        buckets = []
+        if rule.per_ip:
+            buckets.append((f"{request.endpoint}:{request.method}:ip:{client_ip(request)}", *rule.per_ip))
+        if rule.per_route:
+            buckets.append((f"{request.endpoint}:{request.method}:all", *rule.per_route))
+        if buckets:
+            allowed, retry_after = store.take(buckets)
+            if not allowed:
+                return reject(429, "Too many requests, please retry later.", retry_after)
+        if rule.admission:
+            if not admission.acquire(timeout=ADMISSION_WAIT):
+                return reject(503, "The server is busy, please retry shortly.", ADMISSION_RETRY_AFTER)
+            g._admitted = True
+        return None
+
+    @app.teardown_request
+    def _release_admission(exc=None):
+        if g.pop('_admitted', False):
+            admission.release()
+
+    @app.errorhandler(PoolTimeout)
+    @app.errorhandler(AsyncPoolTimeout)
+    def _pool_exhausted(e):
+        return reject(503, "The server is busy, please retry shortly.", ADMISSION_RETRY_AFTER)
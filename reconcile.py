@@ -0,0 +1,212 @@
+"""
+Reconciliation of summed polling unit results against announced LGA results.
+
+For every LGA and party the sum of the polling unit scores (taken from
+rollup_lga_results, which the rollup triggers keep current) is compared with
+the total in announced_lga_results, in one set-based FULL JOIN. The results
+are stored in reconciliation_results (created by migrations.py) together with
+a marker describing the source tables, so a run only recomputes what changed:
+
+- nothing, when neither table changed since the last run;
+- the LGAs whose summed rollup totals differ from the stored pu_total, when
+  only polling unit results changed;
+- everything, when announced_lga_results changed or a full run is asked for.
+
+Changes are found by comparing committed contents, never by timestamps, so a
+long transaction that commits after a run is still picked up by the next one.
+
+Party codes are compared on their first four characters, upper-cased, because
+announced_lga_results.party_abbreviation is CHAR(4) ('LABO' for 'LABOUR').
+
+Usage:
+    python reconcile.py                  # refresh and print every LGA/party
+    python reconcile.py --mismatches     # only rows where the totals differ
+    python reconcile.py --lga 19 --json  # one LGA as JSON
+    python reconcile.py --full           # recompute everything
+"""
+import threading
+from database import query_db, transaction
+
+RECONCILE_LOCK_ID = 7340114 # pg_advisory_xact_lock key serialising refreshes
+
+# Summaries of both sources. The rollups hold one row per LGA and party, so a digest of
+# their committed contents is cheap and changes with any insert, delete or score change.
+MARKER_SQL = """
+SELECT pu.digest AS pu_signature,
+       ann.n || '/' || ann.max_id || '/' || ann.total AS announced_signature
+FROM (SELECT md5(COALESCE(string_agg(lga_id || ':' || party_abbreviation || ':' || total_score, ','
+                                     ORDER BY lga_id, party_abbreviation), '')) AS digest
+      FROM rollup_lga_results) pu,
+     (SELECT COUNT(*) AS n, COALESCE(MAX(result_id), 0) AS max_id, COALESCE(SUM(party_score::BIGINT), 0) AS total
+      FROM announced_lga_results) ann;
+"""
+
+# LGAs whose summed polling unit totals no longer match what the last run stored
+CHANGED_LGAS_SQL = """
+SELECT DISTINCT COALESCE(pu.lga_id, r.lga_id) AS lga_id
+FROM (
+    SELECT lga_id, upper(left(rtrim(party_abbreviation), 4)) AS party_key, SUM(total_score) AS total
+    FROM rollup_lga_results
+    GROUP BY 1, 2
+) pu
+FULL JOIN (
+    SELECT lga_id, party_key, pu_total FROM reconciliation_results WHERE pu_total IS NOT NULL
+) r ON r.lga_id = pu.lga_id AND r.party_key = pu.party_key
+WHERE pu.total IS DISTINCT FROM r.pu_total;
+"""
+
+# %(lga_ids)s is NULL for every LGA, or an array of the LGAs to recompute
+RECONCILE_SQL = """
+INSERT INTO reconciliation_results (lga_id, party_key, pu_total, announced_total)
+SELECT COALESCE(pu.lga_id, ann.lga_id), COALESCE(pu.party_key, ann.party_key), pu.total, ann.total
+FROM (
+    SELECT lga_id, upper(left(rtrim(party_abbreviation), 4)) AS party_key, SUM(total_score) AS total
+    FROM rollup_lga_results
+    WHERE %(lga_ids)s::INTEGER[] IS NULL OR lga_id = ANY(%(lga_ids)s::INTEGER[])
+    GROUP BY 1, 2
+) pu
+FULL JOIN (
+    SELECT lga_id, upper(left(rtrim(party_abbreviation), 4)) AS party_key, SUM(party_score)::BIGINT AS total
+    FROM announced_lga_results
+    WHERE %(lga_ids)s::INTEGER[] IS NULL OR lga_id = ANY(%(lga_ids)s::INTEGER[])
+    GROUP BY 1, 2
+) ann ON ann.lga_id = pu.lga_id AND ann.party_key = pu.party_key;
+"""
+
+REPORT_SQL = """
+SELECT r.lga_id, l.lga_name, l.state_id, r.party_key AS party,
+       r.pu_total, r.announced_total,
+       COALESCE(r.pu_total, 0) - COALESCE(r.announced_total, 0) AS difference,
+       CASE WHEN r.announced_total IS NULL THEN 'not announced'
+            WHEN r.pu_total IS NULL THEN 'no polling unit results'
+            WHEN r.pu_total = r.announced_total THEN 'match'
+            ELSE 'mismatch' END AS status
+FROM reconciliation_results r
+LEFT JOIN (
+    SELECT DISTINCT ON (lga_id) lga_id, lga_name, state_id FROM lga ORDER BY lga_id, uniqueid
+) l ON l.lga_id = r.lga_id
+ORDER BY l.lga_name, r.lga_id, r.party_key;
+"""
+
+_report = None  # (marker, rows) of the last report this process loaded
+_report_lock = threading.Lock()
+
+
+def _marker_key(marker):
+    return (marker['pu_signature'], marker['announced_signature'])
+
+
+def refresh(full=False):
+    """
+    Brings reconciliation_results up to date with the source tables.
+
+    Args:
+        full (bool): Recompute every LGA even if an incremental run would do.
+
+    Returns:
+        tuple: (mode, lgas) where mode is 'unchanged', 'incremental' or 'full'
+            and lgas is the number of LGAs recomputed (None for a full run).
+    """
+    with transaction() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(%s);", (RECONCILE_LOCK_ID,))
+        cur.execute(MARKER_SQL)
+        current = cur.fetchone()
+        cur.execute("SELECT pu_signature, announced_signature FROM reconciliation_marker WHERE id = 1;")
+        last = cur.fetchone()
+
+        if not full and last and _marker_key(last) == _marker_key(current):
+            return 'unchanged', 0
+
+        if full or not last or last['announced_signature'] != current['announced_signature']:
+            mode, lga_ids = 'full', None
+            cur.execute("DELETE FROM reconciliation_results;")
+        else:
+            mode = 'incremental'
+            cur.execute(CHANGED_LGAS_SQL)
+            lga_ids = [row['lga_id'] for row in cur.fetchall()]
+            cur.execute("DELETE FROM reconciliation_results WHERE lga_id = ANY(%s::INTEGER[]);", (lga_ids,))
+
+        cur.execute(RECONCILE_SQL, {'lga_ids': lga_ids})
+        cur.execute(
+            """
+            INSERT INTO reconciliation_marker (id, pu_signature, announced_signature, ran_at)
+            VALUES (1, %s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (id) DO UPDATE
+            SET pu_signature = EXCLUDED.pu_signature,
+                announced_signature = EXCLUDED.announced_signature, ran_at = EXCLUDED.ran_at;
+            """,
+            (current['pu_signature'], current['announced_signature'])
+        )
+    return mode, (None if lga_ids is None else len(lga_ids))
+
+
+def get_reconciliation(state_id=None, lga_id=None, mismatches_only=False):
+    """
+    Returns the reconciliation rows, refreshing them first if the sources changed.
+
+    The full report is cached per process against the source marker, so
+    repeated requests cost one small marker query while nothing changes.
+
+    Args:
+        state_id (int): Only LGAs of this state.
+        lga_id (int): Only this LGA.
+        mismatches_only (bool): Leave out rows whose totals match.
+
+    Returns:
+        list of dict: lga_id, lga_name, state_id, party, pu_total,
+            announced_total, difference and status, ordered by LGA name and party.
+    """
+    global _report
+    marker = query_db(MARKER_SQL, fetchone=True)
+    key = _marker_key(marker)
+    report = _report
+    if report is None or report[0] != key:
+        with _report_lock:
+            if _report is None or _report[0] != key:
+                refresh()
+                _report = (key, query_db(REPORT_SQL, fetchall=True))
+            report = _report
+
+    rows = report[1]
+    if state_id is not None:
+        rows = [row for row in rows if row['state_id'] == state_id]
+    if lga_id is not None:
+        rows = [row for row in rows if row['lga_id'] == lga_id]
+    if mismatches_only:
+        rows = [row for row in rows if row['status'] != 'match']
+    return rows
+
+
+def summarize(rows):
+    """Counts rows per status, plus the number of LGAs with at least one mismatch."""
+    summary = {'rows': len(rows), 'match': 0, 'mismatch': 0, 'not announced': 0, 'no polling unit results': 0}
+    for row in rows:
+        summary[row['status']] += 1
+    summary['lgas_with_mismatches'] = len({row['lga_id'] for row in rows if row['status'] == 'mismatch'})
+    return summary
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Compare summed polling unit results with announced LGA results.")
+    parser.add_argument('--state', type=int, help="Only LGAs of this state.")
+    parser.add_argument('--lga', type=int, help="Only this LGA.")
+    parser.add_argument('--mismatches', action='store_true', help="Only rows whose totals differ.")
+    parser.add_argument('--full', action='store_true', help="Recompute every LGA instead of only changed ones.")
+    parser.add_argument('--json', action='store_true', help="Print JSON instead of a table.")
+    cli_args = parser.parse_args()
+
+    mode, lga_count = refresh(full=cli_args.full)
+    rows = get_reconciliation(cli_args.state, cli_args.lga, cli_args.mismatches)
+    if cli_args.json:
+        print(json.dumps({'refresh': mode, 'summary': summarize(rows), 'rows': rows}, indent=2))
+    else:
+        print(f"Refresh: {mode}" + (f" ({lga_count} LGAs)" if mode == 'incremental' else ""))
+        print(f"{'LGA':24s} {'party':6s} {'PU total':>10s} {'announced':>10s} {'difference':>11s}  status")
+        fmt = lambda value: '-' if value is None else str(value)
+        for row in rows:
+            print(f"{(row['lga_name'] or str(row['lga_id']))[:24]:24s} {row['party']:6s} {fmt(row['pu_total']):>10s} "
+                  f"{fmt(row['announced_total']):>10s} {row['difference']:>11d}  {row['status']}")
+        print(json.dumps(summarize(rows)))
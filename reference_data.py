@@ -0,0 +1,124 @@
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from database import query_db
+
+# --- Reference Data Cache ---
+# Parties, LGAs and wards almost never change, yet every form page needs them.
+# They are cached per process for REFERENCE_CACHE_TTL seconds and dropped
+# explicitly by invalidate_reference_data() whenever the app writes.
+REFERENCE_CACHE_TTL = float(os.environ.get("REFERENCE_CACHE_TTL", "300"))
+DEFAULT_STATE_ID = int(os.environ.get("DEFAULT_STATE_ID", "25")) # Delta State; the state served at the unprefixed URLs
+
+_cache = {}          # key -> (expires_at, rows)
+_fingerprints = {}   # key -> digest of the rows last loaded for that key
+_last_modified = {}  # key -> UTC datetime at which the digest last changed
+_lock = threading.Lock()
+
+
+def _cached(key, query, args=()):
+    """Returns the cached rows for key, reloading them once the TTL has expired."""
+    entry = _cache.get(key)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+
+    rows = query_db(query, args, fetchall=True)
+    digest = hashlib.sha1(repr(rows).encode('utf-8')).hexdigest()
+    with _lock:
+        if _fingerprints.get(key) != digest:
+            _fingerprints[key] = digest
+            # HTTP dates have one-second resolution
+            _last_modified[key] = datetime.now(timezone.utc).replace(microsecond=0)
+        _cache[key] = (time.monotonic() + REFERENCE_CACHE_TTL, rows)
+    return rows
+
+
+def get_parties():
+    """Returns all parties ordered by name, as dicts with partyid and partyname."""
+    return _cached('parties', "SELECT partyid, partyname FROM party ORDER BY partyname;")
+
+
+def get_states():
+    """Returns all states ordered by name, as dicts with state_id and state_name."""
+    return _cached('states', "SELECT state_id, state_name FROM states ORDER BY state_name;")
+
+
+def get_state(state_id):
+    """Returns one state as a dict with state_id and state_name, or None if it does not exist."""
+    return next((state for state in get_states() if state['state_id'] == state_id), None)
+
+
+def get_lgas(state_id=DEFAULT_STATE_ID):
+    """
+    Returns the LGAs of a state ordered by name, as dicts with lga_id and lga_name.
+
+    Each state is cached under its own key, so serving one state never loads another's LGAs.
+    """
+    return _cached(
+        ('lgas', state_id),
+        "SELECT lga_id, lga_name FROM lga WHERE state_id = %s ORDER BY lga_name;",
+        (state_id,)
+    )
+
+
+def get_lga_wards(lga_id):
+    """
+    Returns the wards of one LGA ordered by name, as dicts with ward_id and ward_name.
+
+    Each LGA is cached under its own key, so a lookup only ever loads (and a
+    client only ever receives) that LGA's wards.
+    """
+    return _cached(
+        ('wards', lga_id),
+        "SELECT ward_id, ward_name FROM ward WHERE lga_id = %s ORDER BY ward_name;",
+        (lga_id,)
+    )
+
+
+def invalidate_reference_data():
+    """Drops every cached entry so the next read goes back to the database."""
+    with _lock:
+        _cache.clear()
+
+
+# Data set name -> loader; a data set key is the name, or (name, argument) for per-state and per-LGA sets
+_LOADERS = {
+    'parties': get_parties,
+    'states': get_states,
+    'lgas': get_lgas,
+    'wards': get_lga_wards,
+}
+
+
+def _ensure_loaded(key):
+    if isinstance(key, tuple):
+        _LOADERS[key[0]](*key[1:])
+    else:
+        _LOADERS[key]()
+
+
+def reference_etag(*keys):
+    """
+    Returns an ETag value covering the given reference data sets.
+
+    The tag is a digest of the rows of exactly those sets (loading any not yet
+    cached), so every worker computes the same tag for the same data and it
+    stays stable across TTL reloads of identical rows and while other sets load.
+
+    Args:
+        *keys: Data set keys, e.g. 'parties', ('lgas', state_id), ('wards', lga_id).
+    """
+    for key in keys:
+        _ensure_loaded(key)
+    with _lock:
+        combined = "|".join(f"{key!r}={_fingerprints[key]}" for key in keys)
+    return hashlib.sha1(combined.encode('utf-8')).hexdigest()
+
+
+def reference_last_modified(*keys):
+    """Returns the last time any of the given (loaded) reference data sets changed, or None."""
+    with _lock:
+        times = [_last_modified[key] for key in keys if key in _last_modified]
+    return max(times) if times else None
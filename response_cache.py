@@ -0,0 +1,132 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+
+# --- Response Cache ---
+# Rendered result pages are kept in a bounded per-process LRU under keys that
+# carry the version of the data they were built from (see
+# ResultsBroadcaster.lga_version()), so new results make the old entries
+# unreachable instead of having to be purged. Concurrent misses for one key
+# are coalesced: the first request computes the page and the others wait for
+# it, so a burst of identical requests costs one query and one render.
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "512"))                    # Entries per process
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(32 << 20)))  # Total body size per process
+RESPONSE_CACHE_MAX_AGE = int(os.environ.get("RESPONSE_CACHE_MAX_AGE", "5"))                # Seconds proxies may reuse a page
+RESPONSE_CACHE_WAIT = float(os.environ.get("RESPONSE_CACHE_WAIT", "10"))                   # Seconds to wait for a coalesced fill
+
+
+class _Fill:
+    """One in-progress computation that other requests for the same key wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.failed = False
+
+
+class ResponseCache:
+    """A thread-safe LRU of response bodies (bytes), bounded by entry count and total size."""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._fills = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = value
+            self._bytes += len(value)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the cached value for key, computing it at most once at a time.
+
+        Args:
+            key: Hashable cache key.
+            compute (callable): Builds the value (bytes) on a miss.
+
+        Returns:
+            tuple: (value, outcome) where outcome is 'hit', 'miss' or 'coalesced'.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value, 'hit'
+        fill, leader = self._join(key)
+        if not leader:
+            if fill.done.wait(RESPONSE_CACHE_WAIT) and not fill.failed:
+                return fill.value, 'coalesced'
+            return compute(), 'miss' # The first request failed or is stuck; do not wait on it again
+
+        try:
+            fill.value = compute()
+            self.set(key, fill.value)
+            return fill.value, 'miss'
+        except Exception:
+            fill.failed = True
+            raise
+        finally:
+            self._leave(key, fill)
+
+    async def get_or_compute_async(self, key, compute):
+        """
+        Same as get_or_compute() for async views, where compute is a coroutine function.
+
+        Fills are shared with get_or_compute(), so sync and async requests for
+        one key coalesce with each other; waiting happens off the event loop.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value, 'hit'
+        fill, leader = self._join(key)
+        if not leader:
+            if await asyncio.to_thread(fill.done.wait, RESPONSE_CACHE_WAIT) and not fill.failed:
+                return fill.value, 'coalesced'
+            return await compute(), 'miss'
+
+        try:
+            fill.value = await compute()
+            self.set(key, fill.value)
+            return fill.value, 'miss'
+        except BaseException: # Includes cancellation, which would otherwise leave waiters hanging
+            fill.failed = True
+            raise
+        finally:
+            self._leave(key, fill)
+
+    def _join(self, key):
+        """Returns (fill, leader): the in-progress fill for key, and whether this caller started it."""
+        with self._lock:
+            fill = self._fills.get(key)
+            if fill is not None:
+                return fill, False
+            fill = self._fills[key] = _Fill()
+            return fill, True
+
+    def _leave(self, key, fill):
+        with self._lock:
+            self._fills.pop(key, None)
+        fill.done.set()
@@ -0,0 +1,403 @@
+"""
+In-memory columnar aggregation over announced_pu_results.
+
+Each worker process keeps a compact, array-backed snapshot of every result:
+one row per result holding only dictionary-encoded codes (polling unit, party)
+and the score. The ward, LGA and state of a row are derived through small
+per-polling-unit and per-ward lookup arrays, so a row costs 10 bytes. Any
+group-by over state, LGA, ward, polling unit and party, with filters on the
+same dimensions, is answered with NumPy (bincount over a mixed-radix group key)
+without touching Postgres.
+
+The snapshot is refreshed at most every ENGINE_REFRESH_SECONDS by loading only
+results with a result_id above the highest one already loaded. Concurrent
+writers commit out of id order, so ids missing just below the highest loaded
+one (within ENGINE_GAP_WINDOW) are remembered as gaps and fetched again on
+every refresh until they show up or are ENGINE_GAP_SECONDS old (rolled back).
+The total of rollup_lga_results is read in the same REPEATABLE READ snapshot;
+if the arrays still do not add up to it (a delete, an update, or a result that
+committed later than that), the snapshot is rebuilt from scratch. It is also
+rebuilt every ENGINE_FULL_RELOAD_SECONDS, which picks up polling units moved
+between wards.
+
+Usage:
+    python results_engine.py lga,party --state 25 --top 1
+"""
+import itertools
+import os
+import threading
+import time
+import numpy as np
+from database import pooled_connection, choose_read_dsn
+
+ENGINE_REFRESH_SECONDS = float(os.environ.get("ENGINE_REFRESH_SECONDS", "2"))         # Max staleness of answers
+ENGINE_FULL_RELOAD_SECONDS = float(os.environ.get("ENGINE_FULL_RELOAD_SECONDS", "3600"))
+ENGINE_FETCH_BATCH = int(os.environ.get("ENGINE_FETCH_BATCH", "50000"))               # Rows per server-side fetch
+ENGINE_GAP_WINDOW = int(os.environ.get("ENGINE_GAP_WINDOW", "10000"))                 # Ids below the highest watched for late commits
+ENGINE_GAP_SECONDS = float(os.environ.get("ENGINE_GAP_SECONDS", "600"))               # Longest a missing id is waited for
+BINCOUNT_MAX_GROUPS = 1 << 24 # Larger key spaces are grouped with np.unique instead of a dense bincount
+
+DIMENSIONS = ('state', 'lga', 'ward', 'polling_unit', 'party')
+
+RESULTS_SQL = """
+SELECT apr.result_id, apr.polling_unit_uniqueid, apr.party_abbreviation, COALESCE(apr.party_score, 0)
+FROM announced_pu_results apr
+WHERE (apr.result_id > %s OR apr.result_id = ANY(%s::INTEGER[]))
+  AND EXISTS (SELECT 1 FROM polling_unit pu WHERE pu.uniqueid = apr.polling_unit_uniqueid)
+ORDER BY apr.result_id;
+"""
+POLLING_UNITS_SQL = """
+SELECT uniqueid, lga_id, ward_id, polling_unit_name FROM polling_unit
+WHERE %s::INTEGER[] IS NULL OR uniqueid = ANY(%s::INTEGER[]);
+"""
+LGAS_SQL = "SELECT DISTINCT ON (lga_id) lga_id, lga_name, state_id FROM lga ORDER BY lga_id, uniqueid;"
+WARDS_SQL = "SELECT DISTINCT ON (lga_id, ward_id) lga_id, ward_id, ward_name FROM ward ORDER BY lga_id, ward_id, uniqueid;"
+STATES_SQL = "SELECT state_id, state_name FROM states;"
+# Maintained by the rollup triggers; the snapshot must add up to it
+TOTAL_SQL = "SELECT COALESCE(SUM(total_score), 0) FROM rollup_lga_results;"
+
+
+class _Codes:
+    """Append-only dictionary encoding of one dimension: value <-> dense integer code."""
+
+    def __init__(self):
+        self.values = []
+        self.index = {}
+
+    def code(self, value):
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class Snapshot:
+    """An immutable view of the results; queries run against one without locking."""
+
+    def __init__(self, pu, party, score, pu_ward, ward_lga, lga_state, labels, max_result_id, loaded_at):
+        self.pu = pu                  # int32 polling unit code per result
+        self.party = party            # int16 party code per result
+        self.score = score            # int32 score per result
+        self.pu_ward = pu_ward        # int32 ward code per polling unit code
+        self.ward_lga = ward_lga      # int32 LGA code per ward code
+        self.lga_state = lga_state    # int32 state code per LGA code
+        self.labels = labels          # dimension -> list of (id, name) per code
+        self.max_result_id = max_result_id
+        self.loaded_at = loaded_at
+
+    def cardinality(self, dimension):
+        return len(self.labels[dimension])
+
+    def codes(self, dimension, rows=None):
+        """Returns the per-result codes of a dimension (optionally for a subset of rows)."""
+        pu = self.pu if rows is None else self.pu[rows]
+        if dimension == 'polling_unit':
+            return pu
+        if dimension == 'party':
+            return self.party if rows is None else self.party[rows]
+        ward = self.pu_ward[pu]
+        if dimension == 'ward':
+            return ward
+        lga = self.ward_lga[ward]
+        if dimension == 'lga':
+            return lga
+        return self.lga_state[lga]
+
+
+class ResultsEngine:
+    """Keeps this process's snapshot current and answers aggregation queries from it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._reset()
+
+    def _reset(self):
+        self._pus = _Codes()       # uniqueid
+        self._wards = _Codes()     # (lga_id, ward_id)
+        self._lgas = _Codes()      # lga_id
+        self._states = _Codes()    # state_id
+        self._parties = _Codes()   # party_abbreviation
+        self._pu_names = []
+        self._pu_ward = []
+        self._ward_lga = []
+        self._lga_state = []
+        self._names = {'lga': {}, 'ward': {}, 'state': {}}
+        self._columns = (np.empty(0, np.int32), np.empty(0, np.int16), np.empty(0, np.int32))
+        self._total = 0
+        self._max_result_id = 0
+        self._gaps = {}            # result_id not yet seen below _max_result_id -> monotonic time first missed
+        self._full_loaded_at = time.monotonic()
+
+    def snapshot(self):
+        """Returns a snapshot no older than ENGINE_REFRESH_SECONDS, refreshing it if needed."""
+        if self._snapshot is None or time.monotonic() - self._checked_at >= ENGINE_REFRESH_SECONDS:
+            # One thread refreshes; the others keep answering from the current snapshot
+            if self._lock.acquire(blocking=self._snapshot is None):
+                try:
+                    if self._snapshot is None or time.monotonic() - self._checked_at >= ENGINE_REFRESH_SECONDS:
+                        self._try_refresh()
+                        self._checked_at = time.monotonic()
+                finally:
+                    self._lock.release()
+        return self._snapshot
+
+    def _try_refresh(self):
+        try:
+            self._refresh()
+        except Exception as e:
+            # The arrays may be half-appended: start over on the next refresh
+            self._reset()
+            self._full_loaded_at = float('-inf')
+            if self._snapshot is None:
+                raise
+            print(f"Results engine refresh failed, serving the previous snapshot: {e}")
+
+    def _refresh(self):
+        full = self._snapshot is None or time.monotonic() - self._full_loaded_at >= ENGINE_FULL_RELOAD_SECONDS
+        with pooled_connection(choose_read_dsn()) as conn:
+            try:
+                with conn.cursor() as cur:
+                    # Results, labels and the control total all come from one database snapshot
+                    cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY;")
+                    cur.execute(TOTAL_SQL)
+                    expected_total = int(cur.fetchone()[0])
+                if full:
+                    self._reset()
+                appended = self._load(conn)
+                if not full and self._total != expected_total:
+                    self._reset() # A delete, an update, or a result committed outside the gap window
+                    appended = self._load(conn)
+            finally:
+                conn.rollback()
+        if appended or self._snapshot is None:
+            self._publish()
+
+    def _load(self, conn):
+        """
+        Appends every result above the highest loaded result_id, and any that
+        filled a remembered gap; returns how many were added.
+        """
+        pu_codes, party_codes, scores = [], [], []
+        new_pus = set()
+        previous_max = self._max_result_id
+        new_ids = []
+        with conn.cursor(name=f"results_engine_{threading.get_ident()}") as cur:
+            cur.itersize = ENGINE_FETCH_BATCH
+            cur.execute(RESULTS_SQL, (previous_max, sorted(self._gaps)))
+            while True:
+                batch = cur.fetchmany(ENGINE_FETCH_BATCH)
+                if not batch:
+                    break
+                for result_id, uniqueid, party, score in batch:
+                    if result_id > previous_max:
+                        new_ids.append(result_id)
+                    else:
+                        self._gaps.pop(result_id, None)
+                    if uniqueid not in self._pus.index:
+                        new_pus.add(uniqueid)
+                    pu_codes.append(self._pus.code(uniqueid))
+                    party_codes.append(self._parties.code(party))
+                    scores.append(score)
+                self._max_result_id = max(self._max_result_id, batch[-1][0])
+        self._track_gaps(previous_max, new_ids)
+        if not scores:
+            return 0
+
+        if new_pus:
+            self._load_hierarchy(conn, new_pus)
+        pu, party, score = self._columns
+        self._columns = (
+            np.concatenate([pu, np.asarray(pu_codes, np.int32)]),
+            np.concatenate([party, np.asarray(party_codes, np.int16)]),
+            np.concatenate([score, np.asarray(scores, np.int32)]),
+        )
+        self._total += int(np.asarray(scores, np.int64).sum())
+        return len(scores)
+
+    def _track_gaps(self, previous_max, new_ids):
+        """Remembers ids skipped just below the new highest result_id and forgets stale ones."""
+        now = time.monotonic()
+        if new_ids:
+            low = max(previous_max, self._max_result_id - ENGINE_GAP_WINDOW) + 1
+            window = np.asarray([result_id for result_id in new_ids if result_id >= low], np.int64)
+            for result_id in np.setdiff1d(np.arange(low, self._max_result_id, dtype=np.int64), window):
+                self._gaps[int(result_id)] = now
+        floor = self._max_result_id - ENGINE_GAP_WINDOW
+        self._gaps = {result_id: seen for result_id, seen in self._gaps.items()
+                      if result_id > floor and now - seen < ENGINE_GAP_SECONDS}
+
+    def _load_hierarchy(self, conn, new_pus):
+        """Adds ward/LGA/state codes and names for polling units seen for the first time."""
+        with conn.cursor() as cur:
+            cur.execute(LGAS_SQL)
+            lgas = {lga_id: (name, state_id) for lga_id, name, state_id in cur.fetchall()}
+            cur.execute(WARDS_SQL)
+            self._names['ward'] = {(lga_id, ward_id): name for lga_id, ward_id, name in cur.fetchall()}
+            cur.execute(STATES_SQL)
+            self._names['state'] = dict(cur.fetchall())
+            self._names['lga'] = {lga_id: name for lga_id, (name, _) in lgas.items()}
+            # Every polling unit on a full load, only the new ones afterwards
+            ids = None if len(new_pus) == len(self._pus.values) else sorted(new_pus)
+            cur.execute(POLLING_UNITS_SQL, (ids, ids))
+            polling_units = {row[0]: row[1:] for row in cur.fetchall()}
+
+        for code in range(len(self._pu_ward), len(self._pus.values)):
+            lga_id, ward_id, name = polling_units.get(self._pus.values[code], (None, None, None))
+            ward_code = self._wards.code((lga_id, ward_id))
+            if ward_code == len(self._ward_lga):
+                lga_code = self._lgas.code(lga_id)
+                if lga_code == len(self._lga_state):
+                    self._lga_state.append(self._states.code(lgas.get(lga_id, (None, None))[1]))
+                self._ward_lga.append(lga_code)
+            self._pu_ward.append(ward_code)
+            self._pu_names.append(name)
+
+    def _publish(self):
+        names = self._names
+        labels = {
+            'polling_unit': list(zip(self._pus.values, self._pu_names)),
+            'party': [(party, party) for party in self._parties.values],
+            'ward': [(key, names['ward'].get(key)) for key in self._wards.values],
+            'lga': [(lga_id, names['lga'].get(lga_id)) for lga_id in self._lgas.values],
+            'state': [(state_id, names['state'].get(state_id)) for state_id in self._states.values],
+        }
+        pu, party, score = self._columns
+        self._snapshot = Snapshot(
+            pu, party, score,
+            np.asarray(self._pu_ward, np.int32), np.asarray(self._ward_lga, np.int32),
+            np.asarray(self._lga_state, np.int32), labels, self._max_result_id, time.time()
+        )
+
+    def aggregate(self, group_by=(), filters=None, top=None, limit=None):
+        """
+        Sums party scores grouped by any of DIMENSIONS.
+
+        Args:
+            group_by (sequence): Dimensions to group by, in output order.
+            filters (dict): Dimension -> iterable of accepted ids. Ward ids match
+                in every LGA unless an LGA filter is given too.
+            top (int): Keep the top N rows per parent group, where the parent is
+                the group without the party (e.g. lga,party with top=1 gives the
+                winner of each LGA); without party, the top N groups overall.
+                Shares are taken of the parent's total in the same way.
+            limit (int): Return at most this many rows.
+
+        Returns:
+            dict: rows (each with the group's ids/names, total and share),
+                total_rows before the limit, and snapshot details.
+        """
+        snap = self.snapshot()
+        group_by = list(group_by)
+        for dimension in itertools.chain(group_by, filters or {}):
+            if dimension not in DIMENSIONS:
+                raise ValueError(f"Unknown dimension: {dimension}")
+
+        rows = None
+        for dimension, ids in (filters or {}).items():
+            wanted = self._filter_codes(snap, dimension, ids)
+            mask = np.isin(snap.codes(dimension) if rows is None else snap.codes(dimension, rows), wanted)
+            rows = np.flatnonzero(mask) if rows is None else rows[mask]
+
+        weights = snap.score if rows is None else snap.score[rows]
+        cards = [max(snap.cardinality(d), 1) for d in group_by]
+        key = np.zeros(len(weights), np.int64)
+        for dimension, card in zip(group_by, cards):
+            key = key * card + snap.codes(dimension, rows)
+        groups, totals = _sum_by_key(key, weights, int(np.prod(cards, dtype=np.int64)))
+
+        # Split the group keys back into one code array per dimension
+        codes, remaining = {}, groups
+        for dimension, card in reversed(list(zip(group_by, cards))):
+            remaining, codes[dimension] = np.divmod(remaining, card)
+
+        # Without party in the group, every group shares one parent: the filtered total
+        parent_key = np.zeros(len(groups), np.int64)
+        for dimension, card in zip(group_by, cards):
+            if dimension != 'party' and 'party' in group_by:
+                parent_key = parent_key * card + codes[dimension]
+        parents, parent_of = np.unique(parent_key, return_inverse=True)
+        parent_totals = np.bincount(parent_of, totals, minlength=len(parents))
+
+        order = np.lexsort((-totals, parent_of)) # By parent, then highest total first
+        if top is not None:
+            ranked = parent_of[order]
+            starts = np.flatnonzero(np.r_[True, ranked[1:] != ranked[:-1]])
+            rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+            order = order[rank < top]
+        total_rows = len(order)
+        if limit is not None:
+            order = order[:limit]
+
+        result = []
+        for i in order:
+            row = {}
+            for dimension in group_by:
+                row.update(_label(dimension, snap.labels[dimension][codes[dimension][i]]))
+            parent_total = parent_totals[parent_of[i]]
+            row['total'] = int(totals[i])
+            row['share'] = round(float(totals[i] / parent_total), 6) if parent_total else None
+            result.append(row)
+        return {
+            'group_by': group_by,
+            'rows': result,
+            'total_rows': total_rows,
+            'snapshot': {'results': int(len(snap.score)), 'max_result_id': snap.max_result_id, 'loaded_at': snap.loaded_at},
+        }
+
+    @staticmethod
+    def _filter_codes(snap, dimension, ids):
+        ids = set(ids)
+        if dimension == 'ward':
+            return [code for code, ((lga_id, ward_id), _) in enumerate(snap.labels['ward']) if ward_id in ids]
+        return [code for code, (value, _) in enumerate(snap.labels[dimension]) if value in ids]
+
+
+def _sum_by_key(key, weights, key_space):
+    """Returns (distinct keys present, score total per key)."""
+    if key_space <= BINCOUNT_MAX_GROUPS:
+        counts = np.bincount(key, minlength=key_space)
+        totals = np.bincount(key, weights, minlength=key_space)
+        groups = np.flatnonzero(counts)
+        return groups, np.rint(totals[groups]).astype(np.int64)
+    groups, inverse = np.unique(key, return_inverse=True)
+    return groups, np.rint(np.bincount(inverse, weights, minlength=len(groups))).astype(np.int64)
+
+
+def _label(dimension, label):
+    value, name = label
+    if dimension == 'party':
+        return {'party': value}
+    if dimension == 'ward':
+        return {'lga_id': value[0], 'ward_id': value[1], 'ward_name': name}
+    if dimension == 'polling_unit':
+        return {'polling_unit_id': value, 'polling_unit_name': name}
+    return {f'{dimension}_id': value, f'{dimension}_name': name}
+
+
+engine = ResultsEngine()
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Aggregate results from the in-memory engine.")
+    parser.add_argument('group_by', nargs='?', default='', help="Comma-separated: " + ", ".join(DIMENSIONS))
+    parser.add_argument('--state', type=int, action='append', help="Only this state (repeatable).")
+    parser.add_argument('--lga', type=int, action='append', help="Only this LGA (repeatable).")
+    parser.add_argument('--party', action='append', help="Only this party (repeatable).")
+    parser.add_argument('--top', type=int)
+    parser.add_argument('--limit', type=int, default=50)
+    cli_args = parser.parse_args()
+
+    started = time.perf_counter()
+    engine.snapshot()
+    loaded = time.perf_counter()
+    filters = {name: values for name, values in
+               (('state', cli_args.state), ('lga', cli_args.lga), ('party', cli_args.party)) if values}
+    answer = engine.aggregate([d for d in cli_args.group_by.split(',') if d], filters, cli_args.top, cli_args.limit)
+    print(json.dumps(answer, indent=2, default=str))
+    print(f"Loaded in {loaded - started:.2f}s, answered in {(time.perf_counter() - loaded) * 1000:.1f} ms")
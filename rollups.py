@@ -0,0 +1,220 @@
+"""
+Precomputed per-ward, per-LGA and per-state party totals.
+
+The rollup_* tables hold running SUM(party_score) totals of announced_pu_results,
+grouped by the polling unit's own ward_id and lga_id (and the LGA's state_id).
+Statement-level triggers with transition tables keep them up to date: every
+INSERT, UPDATE or DELETE on announced_pu_results (including multi-row inserts
+and COPY) applies one aggregated delta per statement, in the same transaction.
+Each statement also sends its per-LGA party deltas with NOTIFY on
+RESULTS_CHANNEL, delivered when the transaction commits, for the live dashboard.
+
+Migration 8 (migrations.py) installs the tables and triggers and fills them.
+
+Usage:
+    python rollups.py install   # create tables, trigger functions and triggers again
+    python rollups.py rebuild   # recompute every total from announced_pu_results
+"""
+from database import query_db, transaction
+
+RESULTS_CHANNEL = 'announced_results'
+# NOTIFY payloads are limited to 8000 bytes; bigger deltas tell listeners to reload instead
+NOTIFY_MAX_BYTES = 7900
+RESYNC_PAYLOAD = '{"resync": true}'
+
+ROLLUP_TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS rollup_ward_results (
+  lga_id INTEGER NOT NULL,
+  ward_id INTEGER NOT NULL,
+  party_abbreviation VARCHAR(255) NOT NULL,
+  total_score BIGINT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (lga_id, ward_id, party_abbreviation)
+);
+
+CREATE TABLE IF NOT EXISTS rollup_lga_results (
+  lga_id INTEGER NOT NULL,
+  party_abbreviation VARCHAR(255) NOT NULL,
+  total_score BIGINT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (lga_id, party_abbreviation)
+);
+
+CREATE TABLE IF NOT EXISTS rollup_state_results (
+  state_id INTEGER NOT NULL,
+  party_abbreviation VARCHAR(255) NOT NULL,
+  total_score BIGINT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (state_id, party_abbreviation)
+);
+"""
+
+
+def _apply_delta_sql(source, sign):
+    """
+    Returns one statement that folds the rows of source into all three rollups.
+
+    Rows are upserted in primary-key order so concurrent submissions touching
+    the same totals always lock them in the same order and cannot deadlock.
+    """
+    return f"""
+    WITH delta AS (
+        SELECT pu.lga_id, pu.ward_id, r.party_abbreviation,
+               {sign} * SUM(r.party_score)::BIGINT AS score
+        FROM {source} r
+        JOIN polling_unit pu ON pu.uniqueid = r.polling_unit_uniqueid
+        GROUP BY pu.lga_id, pu.ward_id, r.party_abbreviation
+    ),
+    ward_upsert AS (
+        INSERT INTO rollup_ward_results AS t (lga_id, ward_id, party_abbreviation, total_score)
+        SELECT lga_id, ward_id, party_abbreviation, score
+        FROM delta
+        ORDER BY lga_id, ward_id, party_abbreviation
+        ON CONFLICT (lga_id, ward_id, party_abbreviation) DO UPDATE
+        SET total_score = t.total_score + EXCLUDED.total_score, updated_at = CURRENT_TIMESTAMP
+    ),
+    lga_upsert AS (
+        INSERT INTO rollup_lga_results AS t (lga_id, party_abbreviation, total_score)
+        SELECT lga_id, party_abbreviation, SUM(score)
+        FROM delta
+        GROUP BY lga_id, party_abbreviation
+        ORDER BY lga_id, party_abbreviation
+        ON CONFLICT (lga_id, party_abbreviation) DO UPDATE
+        SET total_score = t.total_score + EXCLUDED.total_score, updated_at = CURRENT_TIMESTAMP
+    )
+    INSERT INTO rollup_state_results AS t (state_id, party_abbreviation, total_score)
+    SELECT l.state_id, d.party_abbreviation, SUM(d.score)
+    FROM delta d
+    JOIN (SELECT DISTINCT lga_id, state_id FROM lga) l ON l.lga_id = d.lga_id
+    GROUP BY l.state_id, d.party_abbreviation
+    ORDER BY l.state_id, d.party_abbreviation
+    ON CONFLICT (state_id, party_abbreviation) DO UPDATE
+    SET total_score = t.total_score + EXCLUDED.total_score, updated_at = CURRENT_TIMESTAMP;
+    """
+
+
+def _notify_delta_sql(parts):
+    """
+    Returns a PL/pgSQL statement that sends the statement's per-LGA party deltas.
+
+    Args:
+        parts (list): (transition table, sign) pairs, e.g. [('new_rows', 1)].
+
+    The payload is {"at": ..., "deltas": [{"lga_id", "party", "score"}, ...]}.
+    The timestamp keeps payloads of one transaction distinct, since Postgres
+    folds identical notifications together.
+    """
+    rows = " UNION ALL ".join(
+        f"SELECT polling_unit_uniqueid, party_abbreviation, {sign} * party_score::BIGINT AS score FROM {source}"
+        for source, sign in parts
+    )
+    return f"""
+    PERFORM pg_notify('{RESULTS_CHANNEL}',
+                      CASE WHEN octet_length(payload) <= {NOTIFY_MAX_BYTES} THEN payload ELSE '{RESYNC_PAYLOAD}' END)
+    FROM (
+        SELECT json_build_object(
+                   'at', clock_timestamp(),
+                   'deltas', json_agg(json_build_object('lga_id', lga_id, 'party', party_abbreviation, 'score', score))
+               )::text AS payload
+        FROM (
+            SELECT pu.lga_id, r.party_abbreviation, SUM(r.score) AS score
+            FROM ({rows}) r
+            JOIN polling_unit pu ON pu.uniqueid = r.polling_unit_uniqueid
+            GROUP BY pu.lga_id, r.party_abbreviation
+        ) d
+        HAVING COUNT(*) > 0
+    ) n;
+    """
+
+
+def _trigger_function_sql(name, statements):
+    body = "\n".join(statements)
+    return f"""
+    CREATE OR REPLACE FUNCTION {name}() RETURNS trigger AS $$
+    BEGIN
+        {body}
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+
+
+ROLLUP_TRIGGERS_SQL = (
+    _trigger_function_sql('rollup_pu_results_insert', [_apply_delta_sql('new_rows', 1),
+                                                         _notify_delta_sql([('new_rows', 1)])])
+    + _trigger_function_sql('rollup_pu_results_delete', [_apply_delta_sql('old_rows', -1),
+                                                         _notify_delta_sql([('old_rows', -1)])])
+    + _trigger_function_sql('rollup_pu_results_update', [_apply_delta_sql('old_rows', -1),
+                                                         _apply_delta_sql('new_rows', 1),
+                                                         _notify_delta_sql([('old_rows', -1), ('new_rows', 1)])])
+    + """
+    DROP TRIGGER IF EXISTS rollup_pu_results_insert ON announced_pu_results;
+    CREATE TRIGGER rollup_pu_results_insert
+        AFTER INSERT ON announced_pu_results
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION rollup_pu_results_insert();
+
+    DROP TRIGGER IF EXISTS rollup_pu_results_delete ON announced_pu_results;
+    CREATE TRIGGER rollup_pu_results_delete
+        AFTER DELETE ON announced_pu_results
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION rollup_pu_results_delete();
+
+    DROP TRIGGER IF EXISTS rollup_pu_results_update ON announced_pu_results;
+    CREATE TRIGGER rollup_pu_results_update
+        AFTER UPDATE ON announced_pu_results
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION rollup_pu_results_update();
+    """
+)
+
+REBUILD_SQL = """
+-- Block writers so no delta is applied between the scan and the swap
+LOCK TABLE announced_pu_results IN SHARE MODE;
+TRUNCATE rollup_ward_results, rollup_lga_results, rollup_state_results;
+""" + _apply_delta_sql('announced_pu_results', 1) + f"""
+SELECT pg_notify('{RESULTS_CHANNEL}', '{RESYNC_PAYLOAD}');
+"""
+
+
+def install_rollups():
+    """Creates the rollup tables and triggers, then fills the tables from scratch."""
+    with transaction() as cur:
+        cur.execute(ROLLUP_TABLES_SQL)
+        cur.execute(ROLLUP_TRIGGERS_SQL)
+        cur.execute(REBUILD_SQL)
+
+
+def rebuild_rollups():
+    """Recomputes every rollup total from announced_pu_results in one transaction."""
+    with transaction() as cur:
+        cur.execute(REBUILD_SQL)
+
+
+# Party totals of one LGA, highest first: one row per party however many results the LGA has
+LGA_TOTALS_SQL = """
+    SELECT party_abbreviation, total_score
+    FROM rollup_lga_results
+    WHERE lga_id = %s
+    ORDER BY total_score DESC, party_abbreviation;
+"""
+
+
+def get_lga_totals(lga_id):
+    """Returns the party totals of an LGA from rollup_lga_results, highest first."""
+    return query_db(LGA_TOTALS_SQL, (lga_id,), fetchall=True)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Maintain the precomputed result totals.")
+    parser.add_argument('command', choices=['install', 'rebuild'])
+    cli_args = parser.parse_args()
+
+    if cli_args.command == 'install':
+        install_rollups()
+        print("Rollup tables and triggers installed.")
+    else:
+        rebuild_rollups()
+        print("Rollup totals rebuilt.")
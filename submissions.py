@@ -0,0 +1,245 @@
+"""
+Durable intake queue for /q3 submissions.
+
+/q3 validates a submission, stores it in submission_queue under its
+idempotency key and returns at once. A replayed POST with the same key finds
+the existing row instead of adding another, so a submission is applied at
+most once however often an unreliable connection resends it. A key reused for
+different results is refused (IdempotencyConflict) rather than dropping them. Workers take
+pending rows in batches with FOR UPDATE SKIP LOCKED and apply each batch in
+one transaction, so any number of them can run side by side.
+
+Every web worker runs SUBMISSION_WORKER_THREADS worker threads; set it to 0
+when the queue is served by separate worker processes instead.
+
+Usage:
+    python submissions.py worker   # apply submissions as they arrive
+    python submissions.py status   # queue counts by status
+"""
+import hashlib
+import json
+import os
+import select
+import threading
+import time
+import psycopg2
+from database import get_db_connection, transaction, insert_polling_unit_results
+from reference_data import invalidate_reference_data
+
+SUBMISSION_CHANNEL = 'submission_queue'
+SUBMISSION_BATCH_SIZE = int(os.environ.get("SUBMISSION_BATCH_SIZE", "50"))        # Submissions per transaction
+SUBMISSION_POLL_SECONDS = float(os.environ.get("SUBMISSION_POLL_SECONDS", "5"))   # Wake-up interval without a NOTIFY
+SUBMISSION_WORKER_THREADS = int(os.environ.get("SUBMISSION_WORKER_THREADS", "1"))
+SUBMISSION_MAX_ATTEMPTS = int(os.environ.get("SUBMISSION_MAX_ATTEMPTS", "5"))     # Tries before an erroring submission fails
+SUBMISSION_RECONNECT_SECONDS = 2.0
+
+_workers_pid = None
+_workers_lock = threading.Lock()
+
+
+class IdempotencyConflict(Exception):
+    """Raised when an idempotency key is replayed with a different submission."""
+
+
+def enqueue_submission(idempotency_key, polling_unit_name, ward_id, lga_id, entered_by, ip_address, scores):
+    """
+    Stores a submission for the workers, unless one with the same key exists.
+
+    See database.insert_polling_unit_results() for the submission arguments.
+
+    Args:
+        idempotency_key (str): Identifies the submission across retries.
+
+    Returns:
+        tuple: (submission, created) where submission is a dict with id, status
+            and polling_unit_uniqueid, and created is False for a replay.
+
+    Raises:
+        IdempotencyConflict: The key was already used for a different submission.
+    """
+    payload = {
+        'polling_unit_name': polling_unit_name,
+        'ward_id': ward_id,
+        'lga_id': lga_id,
+        'entered_by': entered_by,
+        'ip_address': ip_address,
+        'scores': [[party, score] for party, score in scores],
+    }
+    # The client address is left out: a retry may arrive from another address
+    fingerprint = {name: value for name, value in payload.items() if name != 'ip_address'}
+    payload_hash = hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode('utf-8')).hexdigest()
+    with transaction() as cur:
+        cur.execute(
+            """
+            INSERT INTO submission_queue (idempotency_key, payload, payload_hash) VALUES (%s, %s, %s)
+            ON CONFLICT (idempotency_key) DO NOTHING
+            RETURNING id, status, polling_unit_uniqueid;
+            """,
+            (idempotency_key, json.dumps(payload), payload_hash)
+        )
+        submission = cur.fetchone()
+        if submission:
+            cur.execute("SELECT pg_notify(%s, '');", (SUBMISSION_CHANNEL,)) # Delivered on commit
+            return submission, True
+        cur.execute(
+            """
+            SELECT id, status, polling_unit_uniqueid, payload_hash
+            FROM submission_queue WHERE idempotency_key = %s;
+            """,
+            (idempotency_key,)
+        )
+        submission = cur.fetchone()
+        if submission.pop('payload_hash') not in (None, payload_hash): # NULL: queued before hashes were kept
+            raise IdempotencyConflict(f"Idempotency key {idempotency_key} was already used for different results.")
+        return submission, False
+
+
+def get_submission(idempotency_key):
+    """Returns the status of a submission as a dict, or None if the key is unknown."""
+    with transaction() as cur:
+        cur.execute(
+            """
+            SELECT status, polling_unit_uniqueid, error, created_at, applied_at
+            FROM submission_queue WHERE idempotency_key = %s;
+            """,
+            (idempotency_key,)
+        )
+        return cur.fetchone()
+
+
+def process_batch(batch_size=SUBMISSION_BATCH_SIZE):
+    """
+    Applies up to batch_size pending submissions in one transaction.
+
+    Each submission is applied inside its own savepoint, so one that errors
+    never holds up the rest of the batch. One the database rejects outright
+    (integrity or data errors) is marked failed at once; any other error
+    leaves it pending for another try, and it fails after
+    SUBMISSION_MAX_ATTEMPTS tries. Only losing the connection rolls the whole
+    batch back so it is retried. Once a batch that stored results commits,
+    this process's reference data cache is dropped, as for any other write.
+
+    Returns:
+        int: Number of submissions taken from the queue.
+    """
+    applied = 0
+    with transaction() as cur:
+        cur.execute(
+            """
+            SELECT id, payload FROM submission_queue
+            WHERE status = 'pending'
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED;
+            """,
+            (batch_size,)
+        )
+        submissions = cur.fetchall()
+        for submission in submissions:
+            payload = submission['payload']
+            cur.execute("SAVEPOINT submission;")
+            try:
+                uniqueid = insert_polling_unit_results(
+                    cur, payload['polling_unit_name'], payload['ward_id'], payload['lga_id'],
+                    payload['entered_by'], payload['ip_address'],
+                    [(party, score) for party, score in payload['scores']]
+                )
+            except Exception as e:
+                try:
+                    cur.execute("ROLLBACK TO SAVEPOINT submission;")
+                except psycopg2.Error:
+                    raise e # The connection is unusable; the whole batch is retried
+                permanent = isinstance(e, (psycopg2.IntegrityError, psycopg2.DataError))
+                cur.execute(
+                    """
+                    UPDATE submission_queue
+                    SET attempts = attempts + 1, error = %(error)s,
+                        status = CASE WHEN %(permanent)s OR attempts + 1 >= %(max_attempts)s
+                                      THEN 'failed' ELSE status END,
+                        applied_at = CASE WHEN %(permanent)s OR attempts + 1 >= %(max_attempts)s
+                                          THEN CURRENT_TIMESTAMP ELSE applied_at END
+                    WHERE id = %(id)s
+                    RETURNING status;
+                    """,
+                    {'error': str(e).strip(), 'permanent': permanent,
+                     'max_attempts': SUBMISSION_MAX_ATTEMPTS, 'id': submission['id']}
+                )
+                print(f"Submission {submission['id']} {cur.fetchone()['status']}: {e}")
+                continue
+            cur.execute("RELEASE SAVEPOINT submission;")
+            cur.execute(
+                """
+                UPDATE submission_queue
+                SET status = 'applied', polling_unit_uniqueid = %s, attempts = attempts + 1,
+                    applied_at = CURRENT_TIMESTAMP
+                WHERE id = %s;
+                """,
+                (uniqueid, submission['id'])
+            )
+            applied += 1
+    if applied:
+        invalidate_reference_data()
+    return len(submissions)
+
+
+def drain():
+    """Applies batches until the queue has no pending submission left; returns how many were taken."""
+    total = 0
+    while True:
+        taken = process_batch()
+        total += taken
+        if taken < SUBMISSION_BATCH_SIZE:
+            return total
+
+
+def run_worker():
+    """Applies submissions forever, woken by NOTIFY and every SUBMISSION_POLL_SECONDS."""
+    while True:
+        conn = None
+        try:
+            conn = get_db_connection()
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {SUBMISSION_CHANNEL};")
+            while True:
+                drain() # Also picks up whatever was queued while nobody was listening
+                select.select([conn], [], [], SUBMISSION_POLL_SECONDS)
+                conn.poll()
+                conn.notifies.clear()
+        except Exception as e:
+            print(f"Submission worker error: {e}")
+            time.sleep(SUBMISSION_RECONNECT_SECONDS)
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+def start_worker_threads():
+    """Starts this process's SUBMISSION_WORKER_THREADS worker threads once (again after a fork)."""
+    global _workers_pid
+    pid = os.getpid()
+    if _workers_pid == pid or SUBMISSION_WORKER_THREADS <= 0:
+        return
+    with _workers_lock:
+        if _workers_pid == pid:
+            return
+        _workers_pid = pid
+        for i in range(SUBMISSION_WORKER_THREADS):
+            threading.Thread(target=run_worker, name=f"submission-worker-{i}", daemon=True).start()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Apply queued /q3 submissions.")
+    parser.add_argument('command', choices=['worker', 'status'], nargs='?', default='worker')
+    cli_args = parser.parse_args()
+
+    if cli_args.command == 'status':
+        with transaction() as cur:
+            cur.execute("SELECT status, COUNT(*) AS n FROM submission_queue GROUP BY status ORDER BY status;")
+            for row in cur.fetchall():
+                print(f"{row['status']:8s} {row['n']}")
+    else:
+        print("Applying queued submissions...")
+        run_worker()